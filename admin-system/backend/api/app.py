@@ -1,13 +1,15 @@
+import logging
 import os
 import shutil
 
-import torch
 from dotenv import load_dotenv
 from flask import Flask
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 
+import constants
+from api.database import configure_engine, get_database_uri, get_engine_options
 from api.routes.errors import errors
 
 # Load environment variables from .env file
@@ -36,28 +38,64 @@ def create_app(test_config=None):
 
     # Load the configuration
     app.secret_key = os.getenv("SECRET_KEY")
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///database.db"
+    app.config['SQLALCHEMY_DATABASE_URI'] = get_database_uri()
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['DATA_FOLDER'] = "data"
+    app.config['REAPER_INTERVAL_SECONDS'] = constants.REAPER_INTERVAL_SECONDS
+    app.config['IMPORT_WORKERS'] = constants.IMPORT_WORKERS
 
     if test_config is not None:
         # Load the test config if passed in
         app.config.from_mapping(test_config)
 
     # Initialize the database and create the tables
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', get_engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
     db.init_app(app)
     with app.app_context():
+        # Set up the connections before the first one is opened
+        configure_engine(db.engine)
+
+        from api import migrations
+
         # Clear the test database and data files if testing
         if test_config is not None:
             db.drop_all()
+            migrations.drop_version(db.engine)
             shutil.rmtree(os.path.join(app.instance_path, app.config['DATA_FOLDER']), ignore_errors=True)
 
+        # Create the missing tables, then bring the existing ones up to date
+        fresh = not db.inspect(db.engine).has_table("user")
         db.create_all()
-        from api.machine_learning_eval import model
-        model.load_state_dict(torch.load(os.path.join(app.instance_path, "model.pth"),
-                                         map_location=torch.device('cpu'),
-                                         weights_only=False))
-        model.eval()
+        migrations.upgrade(db.engine, fresh)
+        from api.machine_learning_eval import load_model
+        load_model(os.path.join(app.instance_path, "model.pth"))
+
+    # Each request is a single transaction: the helpers only add their changes to the session, which is committed
+    # once the route has returned (including the 4xx responses, which record failed login events), or rolled back on
+    # server errors. The motion pattern initialization also commits the pico handshake before waiting for the Pico.
+    @app.after_request
+    def end_transaction(response):
+        if response.status_code < 500:
+            db.session.commit()
+        else:
+            db.session.rollback()
+        return response
+
+    # Commands, run with ``flask -A api.app <command>``
+    from api import maintenance, provisioning
+    app.cli.add_command(maintenance.reap_sessions_command)
+    app.cli.add_command(provisioning.import_users_command)
+
+    # Delete the expired sessions in the background, from the first request on (so that creating an app, e.g. to run
+    # a command, does not start it)
+    if not app.testing and app.config['REAPER_INTERVAL_SECONDS'] > 0:
+        reaper = []
+
+        @app.before_request
+        def start_reaper():
+            if not reaper:
+                reaper.append(maintenance.start_reaper(app, app.config['REAPER_INTERVAL_SECONDS']))
+                app.logger.setLevel(logging.INFO)
 
     # Create the data directory for user files
     os.makedirs(os.path.join(app.instance_path, app.config['DATA_FOLDER']), exist_ok=True)
@@ -0,0 +1,155 @@
+import json
+import os
+import struct
+import zlib
+from datetime import date, timedelta
+
+from flask import current_app
+
+try:
+    import fcntl
+except ImportError:  # Windows (the development server only runs one process)
+    fcntl = None
+
+# Folder of the login history archive, inside the app's data folder
+ARCHIVE_FOLDER = "archive"
+SEGMENT_EXTENSION = ".seg"
+# Every frame of a segment starts with the length of its compressed data
+FRAME_HEADER = struct.Struct(">I")
+
+
+###################################################################################
+#                               Login History Archive                             #
+###################################################################################
+# The login sessions moved out of the database are stored in one segment file per day (of the sessions' date).
+# Segments are append-only: every archiving run appends a frame, the zlib compressed JSON lines of its records,
+# preceded by its length. A frame is written and synced to disk before the rows are deleted from the database,
+# so a run interrupted in between archives the same rows again: readers keep the last record of each ID.
+# A frame cut short by a crash is ignored when reading, and cut off before the next frame is appended. Frames are
+# only written at the end, so appending only walks the frame headers and checks the last frame.
+
+def get_archive_folder() -> str:
+    """
+    Get the folder of the archive of the current app
+
+    :return: The absolute path of the folder
+    """
+    return os.path.join(current_app.instance_path, current_app.config['DATA_FOLDER'], ARCHIVE_FOLDER)
+
+
+def get_segment_path(day: date) -> str:
+    """
+    Get the path of the segment of a day
+
+    :param day: The day
+    :return: The absolute path of the segment
+    """
+    return os.path.join(get_archive_folder(), str(day.year), day.isoformat() + SEGMENT_EXTENSION)
+
+
+def read_frames(file) -> tuple[list[bytes], int]:
+    """
+    Read the complete frames of a segment
+
+    :param file: The segment, opened in binary mode
+    :return: The decompressed frames and the length of the segment up to the end of the last complete frame
+    """
+    frames, end = [], 0
+    while True:
+        header = file.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return frames, end
+        data = file.read(FRAME_HEADER.unpack(header)[0])
+        try:
+            frames.append(zlib.decompress(data))
+        except zlib.error:
+            # Cut short by a crash while it was written
+            return frames, end
+        end = file.tell()
+
+
+def find_end(file) -> int:
+    """
+    Find the end of the last complete frame of a segment, without decompressing the frames before it
+
+    :param file: The segment, opened in binary mode
+    :return: The length of the segment up to the end of the last complete frame
+    """
+    size = file.seek(0, os.SEEK_END)
+    last, end = 0, 0
+    while end + FRAME_HEADER.size <= size:
+        file.seek(end)
+        length = FRAME_HEADER.unpack(file.read(FRAME_HEADER.size))[0]
+        # An empty frame is never written
+        if length == 0 or end + FRAME_HEADER.size + length > size:
+            break
+        last, end = end, end + FRAME_HEADER.size + length
+
+    if end:
+        # Only the last frame can have been cut short by a crash
+        file.seek(last + FRAME_HEADER.size)
+        try:
+            zlib.decompress(file.read(end - last - FRAME_HEADER.size))
+        except zlib.error:
+            return last
+    return end
+
+
+def append_records(day: date, records: list[dict]) -> None:
+    """
+    Append records to the segment of a day
+
+    :param day: The day of the records
+    :param records: The records (JSON serializable)
+    """
+    if not records:
+        return
+    frame = zlib.compress("".join(json.dumps(record) + "\n" for record in records).encode("utf-8"))
+
+    path = get_segment_path(day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+b") as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        file.truncate(find_end(file))
+        file.write(FRAME_HEADER.pack(len(frame)) + frame)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def read_records(day: date) -> list[dict]:
+    """
+    Read the records of a day (the last record of each ID, in the order they were archived)
+
+    :param day: The day
+    :return: The records
+    """
+    try:
+        with open(get_segment_path(day), "rb") as file:
+            frames, _ = read_frames(file)
+    except FileNotFoundError:
+        return []
+
+    records = {}
+    for frame in frames:
+        for line in frame.decode("utf-8").splitlines():
+            record = json.loads(line)
+            records.pop(record["id"], None)
+            records[record["id"]] = record
+    return list(records.values())
+
+
+def read_range(start: date, end: date) -> list[dict]:
+    """
+    Read the records of every day from ``start`` to ``end`` (included)
+
+    :param start: The first day
+    :param end: The last day
+    :return: The records, oldest day first
+    """
+    records = []
+    day = start
+    while day <= end:
+        records.extend(read_records(day))
+        day += timedelta(days=1)
+    return records
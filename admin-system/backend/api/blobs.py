@@ -0,0 +1,100 @@
+import hashlib
+import os
+import time
+import uuid
+
+from flask import current_app
+
+# Folder of the photo store, inside the app's data folder
+PHOTO_FOLDER = "photos"
+# Photos stored more recently than this are never removed, as the rows referencing them may not be committed yet
+PHOTO_GRACE_SECONDS = 60 * 60
+
+
+###################################################################################
+#                                   Photo Store                                   #
+###################################################################################
+# Photos are stored once on disk, named by the SHA-256 of their content, and the database rows only keep the
+# hash. Storing the same photo twice returns the same hash without writing it again. A file is written under a
+# temporary name and renamed once complete, so a photo is either fully stored or not at all. Storing a photo
+# again refreshes its modification time, which protects it from ``remove_unreferenced_photos`` until the new
+# row is committed.
+
+def get_photo_folder() -> str:
+    """
+    Get the folder of the photo store of the current app
+
+    :return: The absolute path of the folder
+    """
+    return os.path.join(current_app.instance_path, current_app.config['DATA_FOLDER'], PHOTO_FOLDER)
+
+
+def get_photo_path(digest: str) -> str:
+    """
+    Get the path of a photo in the store (the first two characters of the hash are used as a sub folder)
+
+    :param digest: The SHA-256 of the photo
+    :return: The absolute path of the photo
+    """
+    return os.path.join(get_photo_folder(), digest[:2], digest)
+
+
+def put_photo(data: bytes) -> str:
+    """
+    Store a photo, unless the same photo is already stored
+
+    :param data: The content of the photo
+    :return: The SHA-256 of the photo
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    path = get_photo_path(digest)
+
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+
+    return digest
+
+
+def get_photo(digest: str) -> bytes:
+    """
+    Read a photo from the store
+
+    :param digest: The SHA-256 of the photo
+    :return: The content of the photo
+    :raises FileNotFoundError: The photo is not in the store
+    """
+    with open(get_photo_path(digest), "rb") as file:
+        return file.read()
+
+
+def remove_unreferenced_photos(referenced: set[str], grace_seconds: float = PHOTO_GRACE_SECONDS) -> int:
+    """
+    Delete the photos that are no longer referenced (and the leftovers of interrupted writes)
+
+    :param referenced: The hashes of the photos still referenced by the database
+    :param grace_seconds: Files modified more recently than this are kept
+    :return: The number of deleted files
+    """
+    removed = 0
+    folder = get_photo_folder()
+    if not os.path.isdir(folder):
+        return removed
+
+    cutoff = time.time() - grace_seconds
+    for prefix in os.listdir(folder):
+        for entry in os.scandir(os.path.join(folder, prefix)):
+            if entry.name in referenced or entry.stat().st_mtime > cutoff:
+                continue
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                # Removed by another worker
+                pass
+    return removed
@@ -0,0 +1,98 @@
+import os
+
+import sqlalchemy
+from sqlalchemy import event
+
+import constants
+
+# Settings applied to every SQLite connection, so the gunicorn workers can share the database file
+SQLITE_PRAGMAS = {
+    # Readers do not block the writer (and the writer does not block readers)
+    "journal_mode": "WAL",
+    # Wait up to 10 seconds for another connection's write lock instead of failing with "database is locked"
+    "busy_timeout": 10000,
+    # Safe with WAL (a power loss can only lose the last commits) and does not sync on every commit
+    "synchronous": "NORMAL",
+    # Page cache of 16 MB per connection (negative values are in KiB)
+    "cache_size": -16000,
+    # Read the database through a memory map of up to 128 MB
+    "mmap_size": 128 * 1024 * 1024,
+}
+
+
+def configure_sqlite_connection(dbapi_connection, connection_record) -> None:
+    """
+    Apply ``SQLITE_PRAGMAS`` to a new SQLite connection (SQLAlchemy ``connect`` event)
+
+    :param dbapi_connection: The sqlite3 connection
+    :param connection_record: The pool's record of the connection (unused)
+    """
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+
+def begin_sqlite_savepoint(connection: sqlalchemy.Connection, name: str) -> None:
+    """
+    Start the transaction of a SQLite connection before its first savepoint (SQLAlchemy ``savepoint`` event)
+
+    The sqlite3 module only starts a transaction before an INSERT, UPDATE or DELETE. A savepoint made before any of
+    them would start its own transaction instead, and releasing it would commit the request's changes early.
+
+    :param connection: The connection making the savepoint
+    :param name: The name of the savepoint (unused)
+    """
+    dbapi_connection = connection.connection.dbapi_connection
+    if not dbapi_connection.in_transaction:
+        dbapi_connection.execute("BEGIN")
+
+
+def configure_engine(engine: sqlalchemy.Engine) -> None:
+    """
+    Set up the database engine for the database it connects to
+
+    :param engine: The app's database engine
+    """
+    if engine.dialect.name == "sqlite" and not event.contains(engine, "connect", configure_sqlite_connection):
+        event.listen(engine, "connect", configure_sqlite_connection)
+        event.listen(engine, "savepoint", begin_sqlite_savepoint)
+
+
+def get_database_uri() -> str:
+    """
+    Get the database URI from the ``DATABASE_URL`` environment variable
+
+    :return: The database URI (``constants.DEFAULT_DATABASE_URL`` if the variable is not set)
+    """
+    return os.getenv("DATABASE_URL") or constants.DEFAULT_DATABASE_URL
+
+
+def get_engine_options(uri: str) -> dict:
+    """
+    Get the connection pool options of a database from the environment variables
+
+    - ``DATABASE_POOL_SIZE``: The number of connections kept open by each worker
+    - ``DATABASE_MAX_OVERFLOW``: The number of connections opened above the pool size under load
+    - ``DATABASE_POOL_RECYCLE``: The number of seconds after which a connection is replaced (-1 to never replace)
+    - ``DATABASE_POOL_PRE_PING``: Whether a connection is tested before being used (``true`` or ``false``)
+
+    :param uri: The database URI
+    :return: The options of ``sqlalchemy.create_engine``
+    :raises ValueError: If one of the variables is not valid
+    """
+    url = sqlalchemy.make_url(uri)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory SQLite databases live in a single connection, so there is no pool to configure
+        return {}
+
+    pre_ping = os.getenv("DATABASE_POOL_PRE_PING", str(constants.DATABASE_POOL_PRE_PING)).strip().lower()
+    if pre_ping not in ("true", "false", "1", "0"):
+        raise ValueError("DATABASE_POOL_PRE_PING must be true or false")
+
+    return {
+        "pool_size": int(os.getenv("DATABASE_POOL_SIZE", constants.DATABASE_POOL_SIZE)),
+        "max_overflow": int(os.getenv("DATABASE_MAX_OVERFLOW", constants.DATABASE_MAX_OVERFLOW)),
+        "pool_recycle": int(os.getenv("DATABASE_POOL_RECYCLE", constants.DATABASE_POOL_RECYCLE_SECONDS)),
+        "pool_pre_ping": pre_ping in ("true", "1"),
+    }
@@ -3,14 +3,17 @@ import json
 import mimetypes
 import os
 import uuid
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 import flask
 import werkzeug.datastructures
 from flask import jsonify, current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import undefer
+from sqlalchemy.exc import IntegrityError
 
 import constants
-from api import models
+from api import archive, blobs, models
 from api.app import db
 
 
@@ -95,6 +98,33 @@ def input_validate_login(request: flask.Request, param: str, curr_stage: str,
     return user, session, request_data
 
 
+def parse_date_range(request: flask.Request) -> tuple[date, date] | None:
+    """
+    Get the range of days of a request from its ``start`` and ``end`` query params (``YYYY-MM-DD``, both included)
+
+    :param request: The request object
+    :return: The first and last day, or None if the request has no range
+    :raises AssertionError: Only one of the days is provided, or the range is invalid
+    """
+    start, end = request.args.get('start', None), request.args.get('end', None)
+    if start is None and end is None:
+        return None
+    if start is None or end is None:
+        raise AssertionError('Both start and end must be provided')
+
+    try:
+        start, end = date.fromisoformat(start), date.fromisoformat(end)
+    except ValueError:
+        raise AssertionError('Dates must be formatted as YYYY-MM-DD')
+
+    if start > end:
+        raise AssertionError('Start must not be after end')
+    if (end - start).days >= constants.MAX_HISTORY_RANGE_DAYS:
+        raise AssertionError(f'The range must be at most {constants.MAX_HISTORY_RANGE_DAYS} days')
+
+    return start, end
+
+
 def input_validate_auth(request: flask.Request, request_type: str = "json", expiry_check: bool = True,
                         admin_check: bool = False
                         ) -> tuple[models.User, models.AuthSession, dict] | tuple[flask.Response, int]:
@@ -147,6 +177,52 @@ def input_validate_auth(request: flask.Request, request_type: str = "json", expi
     return user, auth_session, request_data
 
 
+###################################################################################
+#                               Database Inserts                                  #
+###################################################################################
+# The helpers never commit: they add their changes to the session, and each request is committed once after its
+# route returns (see ``app.py``). Code running outside of a request commits the session itself. The writes that can
+# fail on a unique constraint are flushed in a savepoint, so that a failure only rolls back that write.
+
+def new_primary_keys(*rows: db.Model) -> None:
+    """
+    Give rows new random primary keys
+
+    :param rows: The rows to update
+    """
+    for row in rows:
+        setattr(row, inspect(type(row)).primary_key[0].key, uuid.uuid4())
+
+
+def insert_rows(*rows: db.Model, new_ids=new_primary_keys, on_conflict=None) -> None:
+    """
+    Insert new rows without first querying whether their unique columns are already taken
+
+    IDs are random UUID4s, so the database's unique constraints are relied on instead of a SELECT before each insert.
+    The rows are flushed in a savepoint. If a constraint fails, the savepoint is rolled back and ``on_conflict`` is
+    called to raise an ``AssertionError`` for conflicts the client caused (e.g. a duplicate email). Otherwise the
+    failure was an ID collision: ``new_ids`` gives the rows new IDs and the insert is retried, up to
+    ``INSERT_ATTEMPTS`` times.
+
+    :param rows: The rows to insert
+    :param new_ids: Function giving new IDs to the rows (by default a new primary key for each row)
+    :param on_conflict: Function raising an ``AssertionError`` if the conflict should not be retried
+    :raises AssertionError: From ``on_conflict``
+    :raises IntegrityError: The insert failed ``INSERT_ATTEMPTS`` times
+    """
+    for attempt in range(constants.INSERT_ATTEMPTS):
+        try:
+            with db.session.begin_nested():
+                db.session.add_all(rows)
+            return
+        except IntegrityError:
+            if on_conflict is not None:
+                on_conflict()
+            if attempt + 1 == constants.INSERT_ATTEMPTS:
+                raise
+            new_ids(*rows)
+
+
 ###################################################################################
 #                               Database Fetching                                 #
 ###################################################################################
@@ -216,14 +292,21 @@ def create_user_from_dict(request_data: dict, file: werkzeug.datastructures.File
     if request_data.get('auth_methods', None).get('face_recognition', None):
         user.set_face_recognition(file)
 
-    create_auth_methods_from_dict(request_data, user)
+    auth_method = create_auth_methods_from_dict(request_data, user)
+
+    def new_ids(user, auth_method):
+        new_primary_keys(user, auth_method)
+        auth_method.user_id = user.id
+
+    def on_conflict():
+        if get_user_from_email(user.email):
+            raise AssertionError('Provided email is already in use')
+
+    insert_rows(user, auth_method, new_ids=new_ids, on_conflict=on_conflict)
 
     # Create the user's data directory
     os.makedirs(os.path.join(current_app.instance_path, current_app.config['DATA_FOLDER'], str(user.id)), exist_ok=True)
 
-    db.session.add(user)
-    db.session.commit()
-
     return user
 
 
@@ -235,7 +318,6 @@ def make_user_admin(user: models.User) -> models.User:
     :return: The user object
     """
     user.admin = True
-    db.session.commit()
     return user
 
 
@@ -269,11 +351,15 @@ def add_user_file(user: models.User, filename: str, file: werkzeug.datastructure
 
     # TODO: encrypt the file
 
-    # Save the file
-    file.save(os.path.join(current_app.instance_path, user_file.file_path))
+    def new_ids(user_file):
+        new_primary_keys(user_file)
+        user_file.file_path = os.path.join(os.path.dirname(user_file.file_path),
+                                           str(user_file.id) + mimetypes.guess_extension(user_file.file_type))
 
-    db.session.add(user_file)
-    db.session.commit()
+    insert_rows(user_file, new_ids=new_ids)
+
+    # Save the file (once its ID is final)
+    file.save(os.path.join(current_app.instance_path, user_file.file_path))
 
     return user_file
 
@@ -307,9 +393,10 @@ def get_user_files(user: models.User) -> list[models.UserFiles]:
     Get all of a user's files
 
     :param user: The user to get the files for
-    :return: A list of the user's files
+    :return: A list of the user's files, oldest first
     """
-    return db.session.execute(db.select(models.UserFiles).filter(models.UserFiles.user_id == user.id)).scalars().all()
+    return db.session.execute(db.select(models.UserFiles).filter(models.UserFiles.user_id == user.id)
+                              .order_by(models.UserFiles.date)).scalars().all()
 
 
 def get_user_files_as_dict(user: models.User) -> list[dict]:
@@ -343,7 +430,6 @@ def delete_user_file(file_id: uuid.UUID) -> None:
     os.remove(os.path.join(current_app.instance_path, user_file.file_path))
 
     db.session.delete(user_file)
-    db.session.commit()
 
 
 ########################################
@@ -351,7 +437,7 @@ def delete_user_file(file_id: uuid.UUID) -> None:
 ########################################
 def create_auth_methods_from_dict(request_data: dict, user: models.User) -> models.UserAuthMethods:
     """
-    Create a user auth methods table entry from a dictionary
+    Create a user auth methods table entry from a dictionary (inserted with the user by ``create_user_from_dict``)
 
     ``request_data`` needs to contain::
 
@@ -373,34 +459,41 @@ def create_auth_methods_from_dict(request_data: dict, user: models.User) -> mode
         face_recognition=request_data.get("auth_methods", None).get('face_recognition', None),
     )
 
-    db.session.add(auth_method)
-    db.session.commit()
-
     return auth_method
 
 
-def get_auth_methods_as_dict(user: models.User) -> dict:
+def get_auth_methods(user: models.User) -> constants.AuthStage:
     """
-    Get a user's auth methods as a dictionary
+    Get a user's auth methods as a bitmask of auth stages
 
     :param user: The user to get the auth methods for
-    :return: A dictionary with the keys of enabled auth methods and the values set to False
+    :return: The stages of the enabled auth methods
     """
     auth_method: models.UserAuthMethods = db.session.execute(db.select(models.UserAuthMethods).filter(
         models.UserAuthMethods.user_id == user.id)).scalars().first()
 
-    output = {}
+    output = constants.AuthStage(0)
 
     if auth_method.password:
-        output["password"] = False
+        output |= constants.AuthStage.PASSWORD
     if auth_method.motion_pattern:
-        output["motion_pattern"] = False
+        output |= constants.AuthStage.MOTION_PATTERN
     if auth_method.face_recognition:
-        output["face_recognition"] = False
+        output |= constants.AuthStage.FACE_RECOGNITION
 
     return output
 
 
+def get_auth_methods_as_dict(user: models.User) -> dict:
+    """
+    Get a user's auth methods as a dictionary
+
+    :param user: The user to get the auth methods for
+    :return: A dictionary with the keys of enabled auth methods and the values set to False
+    """
+    return {stage.name.lower(): False for stage in get_auth_methods(user)}
+
+
 ########################################
 #            Login Session             #
 ########################################
@@ -415,48 +508,66 @@ def create_login_session(user: models.User) -> models.LoginSession:
         session_id=uuid.uuid4(),
         id=user.id,
         date=datetime.now(),
-        auth_stage=json.dumps(get_auth_methods_as_dict(user)),
+        auth_methods=int(get_auth_methods(user)),
+        auth_completed=0,
         motion_pattern_completed=False,
         motion_pattern_retry=False,
     )
 
-    db.session.add(session)
-    db.session.commit()
+    insert_rows(session)
 
     return session
 
 
-def get_login_sessions(count: int) -> list[models.LoginSession]:
+def get_login_sessions(count: int, with_photos: bool = False) -> list[models.LoginSession]:
     """
     Get the last ``count`` login sessions
 
     :param count: The number of login sessions to get
+    :param with_photos: Whether to load the login photo references with the sessions (otherwise they are only loaded
+        when accessed, one query per session)
     :return: A list of the last ``count`` login sessions
     """
-    return db.session.execute(db.select(models.LoginSession)
-                              .order_by(models.LoginSession.date.desc()).limit(count)).scalars().all()
+    query = db.select(models.LoginSession).order_by(models.LoginSession.date.desc()).limit(count)
+    if with_photos:
+        query = query.options(undefer(models.LoginSession.login_photo_hash))
+    return db.session.execute(query).scalars().all()
 
 
-def get_login_sessions_as_dict(count: int) -> list[dict]:
+def get_login_sessions_as_dict(count: int, with_photos: bool = True) -> list[dict]:
     """
     Get the last ``count`` login sessions as a dictionary
 
     :param count: The number of login sessions to get
+    :param with_photos: Whether to include the base64 encoded login photos (read from the photo store)
     :return: A list of the last ``count`` login sessions as a dictionary
     """
-    out = []
-    for login_session in get_login_sessions(count):
-        out.append({
-            "session_id": str(login_session.session_id),
-            "user_id": str(login_session.id),
-            "user_email": get_user_from_id(login_session.id).email,
-            "date": login_session.date.strftime("%d/%m/%Y %H:%M:%S"),
-            "auth_stages": login_session.auth_stage,
-            "motion_added_sequence": login_session.motion_added_sequence,
-            "motion_completed": login_session.motion_pattern_completed,
-            "photo": base64.b64encode(login_session.login_photo).decode("utf-8") if login_session.login_photo else str(None),
-        })
-    return out
+    return [login_session_to_dict(login_session, with_photos)
+            for login_session in get_login_sessions(count, with_photos)]
+
+
+def login_session_to_dict(login_session: models.LoginSession, with_photos: bool = True) -> dict:
+    """
+    Get a login session as a dictionary
+
+    :param login_session: The login session
+    :param with_photos: Whether to include the base64 encoded login photo (read from the photo store)
+    :return: The login session as a dictionary
+    """
+    session_dict = {
+        "session_id": str(login_session.session_id),
+        "user_id": str(login_session.id),
+        "user_email": get_user_from_id(login_session.id).email,
+        "date": login_session.date.strftime("%d/%m/%Y %H:%M:%S"),
+        "auth_stages": json.dumps(login_session.auth_stages),
+        "motion_added_sequence": (json.dumps(login_session.motion_added_moves)
+                                  if login_session.motion_added_sequence is not None else None),
+        "motion_completed": login_session.motion_pattern_completed,
+    }
+    if with_photos:
+        session_dict["photo"] = (base64.b64encode(login_session.login_photo).decode("utf-8")
+                                 if login_session.login_photo_hash else str(None))
+    return session_dict
 
 
 def get_login_session_from_id(session_id: uuid.UUID) -> models.LoginSession | None:
@@ -498,10 +609,12 @@ def add_pico_to_session(session: models.LoginSession, request_data: dict) -> mod
 
     models.check_valid_moves(request_data.get('data', None))
 
-    session.pico_id = request_data.get('pico_id', None)
-    session.motion_added_sequence = json.dumps(request_data.get('data', None))
-
-    db.session.commit()
+    try:
+        with db.session.begin_nested():
+            session.pico_id = request_data.get('pico_id', None)
+            session.motion_added_sequence = models.encode_moves(request_data.get('data', None))
+    except IntegrityError:
+        raise AssertionError('Provided pico_id is not unique')
 
     return session
 
@@ -524,16 +637,14 @@ def clear_pico_from_session(session: models.LoginSession) -> models.LoginSession
     :param session: The login session to clear the pico ID from
     :return: The updated login session
     """
-    identifier = uuid.uuid4()
-
-    while models.LoginSession.query.filter(models.LoginSession.pico_id == identifier).first():
-        identifier = uuid.uuid4()
-
-    session.pico_id = str(identifier)
-
-    db.session.commit()
-
-    return session
+    for attempt in range(constants.INSERT_ATTEMPTS):
+        try:
+            with db.session.begin_nested():
+                session.pico_id = str(uuid.uuid4())
+            return session
+        except IntegrityError:
+            if attempt + 1 == constants.INSERT_ATTEMPTS:
+                raise
 
 
 def split_motion_pattern(session: models.LoginSession, motion_pattern: list) -> tuple[list[str], list[str]]:
@@ -546,8 +657,9 @@ def split_motion_pattern(session: models.LoginSession, motion_pattern: list) ->
     """
     pattern_list = motion_pattern
 
-    if session.motion_added_sequence is not None and session.motion_added_sequence != 'null':
-        num_additional_motions = len(session.motion_added_sequence.strip('][').replace('"', '').split(', '))
+    if session.motion_added_sequence is not None:
+        # One character per move
+        num_additional_motions = len(session.motion_added_sequence)
     else:
         num_additional_motions = -1
     additional_motions = []
@@ -569,8 +681,6 @@ def retry_motion_pattern(session: models.LoginSession, val: bool) -> models.Logi
     """
     session.motion_pattern_retry = val
 
-    db.session.commit()
-
     return session
 
 
@@ -584,8 +694,6 @@ def complete_motion_pattern(session: models.LoginSession, val: bool) -> models.L
     """
     session.motion_pattern_completed = val
 
-    db.session.commit()
-
     return session
 
 
@@ -599,8 +707,6 @@ def save_face_recognition_photo(session: models.LoginSession, file) -> models.Lo
     """
     session.login_photo = file
 
-    db.session.commit()
-
     return session
 
 
@@ -612,17 +718,10 @@ def progress_to_next_auth_stage(session: models.LoginSession, current_stage: str
     :param current_stage: The current auth stage
     :return: The updated login session
     """
-    auth_dict = json.loads(session.auth_stage)
+    stage = constants.AUTH_STAGES_BY_NAME.get(current_stage, constants.AuthStage(0))
 
-    # Set the current stage to True
-    for key in auth_dict:
-        if key == current_stage:
-            auth_dict[key] = True
-            break
-
-    session.auth_stage = json.dumps(auth_dict)
-
-    db.session.commit()
+    # Mark the current stage as completed (if it is one of the session's stages)
+    session.auth_completed = int(session.auth_completed | (stage & session.auth_methods))
 
     return session
 
@@ -634,11 +733,10 @@ def get_next_auth_stage(session: models.LoginSession) -> str | None:
     :param session: The login session to get the next auth stage for
     :return: The next auth stage or None if all auth stages are complete
     """
-    auth_dict = json.loads(session.auth_stage)
-
-    for key in auth_dict:
-        if not auth_dict[key]:
-            return key
+    remaining = session.auth_methods & ~session.auth_completed
+    if remaining:
+        # The lowest bit is the earliest stage
+        return constants.AuthStage(remaining & -remaining).name.lower()
 
 
 ########################################
@@ -658,8 +756,7 @@ def create_auth_session(user: models.User) -> models.AuthSession:
         enabled=True,
     )
 
-    db.session.add(auth_session)
-    db.session.commit()
+    insert_rows(auth_session)
 
     return auth_session
 
@@ -702,8 +799,6 @@ def disable_auth_session(session: models.AuthSession) -> models.AuthSession:
     """
     session.enabled = False
 
-    db.session.commit()
-
     return session
 
 
@@ -735,13 +830,13 @@ def create_failed_login_event(session: models.LoginSession,
     if photo:
         fail_event.photo = photo
 
-    db.session.add(fail_event)
-    db.session.commit()
+    insert_rows(fail_event)
 
     return fail_event
 
 
-def get_failed_login_events_as_dict(user: models.User = None, session: models.LoginSession = None) -> list[dict]:
+def get_failed_login_events_as_dict(user: models.User = None, session: models.LoginSession = None,
+                                    with_photos: bool = True) -> list[dict]:
     """
     Get a list of failed events as a dictionary.
 
@@ -750,27 +845,38 @@ def get_failed_login_events_as_dict(user: models.User = None, session: models.Lo
 
     :param user: The user to get the failed events for
     :param session: The session to get the failed events for
+    :param with_photos: Whether to include the base64 encoded photos (read from the photo store)
     :return: A list of dictionaries containing the failed events
     """
-    failed_events = get_failed_login_events(user, session)
+    # The photo references are needed either way, to tell which events are face recognition failures
+    failed_events = get_failed_login_events(user, session, with_photos=True)
 
-    output = []
+    return [failed_login_event_to_dict(event, with_photos) for event in failed_events]
 
-    for event in failed_events:
-        output.append({
-            "id": str(event.id),
-            "session_id": str(event.session_id),
-            "date": event.date.strftime("%d/%m/%Y %H:%M:%S"),
-            "event": event.event,
-            "photo": base64.b64encode(event.photo).decode("utf-8") if event.photo else str(None),
-            "auth_stages": json.dumps({"face_recognition": True if event.photo is not None else False}),
-        })
 
-    return output
+def failed_login_event_to_dict(event: models.FailedLoginEvent, with_photos: bool = True) -> dict:
+    """
+    Get a failed event as a dictionary
+
+    :param event: The failed event
+    :param with_photos: Whether to include the base64 encoded photo (read from the photo store)
+    :return: The failed event as a dictionary
+    """
+    event_dict = {
+        "id": str(event.id),
+        "session_id": str(event.session_id),
+        "date": event.date.strftime("%d/%m/%Y %H:%M:%S"),
+        "event": event.event,
+        "auth_stages": json.dumps({"face_recognition": True if event.photo_hash is not None else False}),
+    }
+    if with_photos:
+        event_dict["photo"] = base64.b64encode(event.photo).decode("utf-8") if event.photo_hash else str(None)
+    return event_dict
 
 
 def get_failed_login_events(user: models.User = None,
-                            session: models.LoginSession = None) -> list[models.FailedLoginEvent]:
+                            session: models.LoginSession = None,
+                            with_photos: bool = False) -> list[models.FailedLoginEvent]:
     """
     Get a list of failed events.
 
@@ -779,15 +885,144 @@ def get_failed_login_events(user: models.User = None,
 
     :param user: The user to get the failed events for
     :param session: The session to get the failed events for
+    :param with_photos: Whether to load the photo references with the events (otherwise they are only loaded when
+        accessed, one query per event)
     :return: A list of failed events
     """
+    query = db.select(models.FailedLoginEvent)
+    if with_photos:
+        query = query.options(undefer(models.FailedLoginEvent.photo_hash))
+
     if user:
-        return db.session.execute(db.select(models.FailedLoginEvent)
-                                  .join(models.LoginSession)
-                                  .filter(models.FailedLoginEvent.session_id == models.LoginSession.session_id)
-                                  .filter(user.id == models.LoginSession.id)).scalars().all()
+        query = (query.join(models.LoginSession)
+                 .filter(models.FailedLoginEvent.session_id == models.LoginSession.session_id)
+                 .filter(user.id == models.LoginSession.id))
     elif session:
-        return db.session.execute(db.select(models.FailedLoginEvent)
-                                  .filter(models.FailedLoginEvent.session_id == session.session_id)).scalars().all()
+        query = query.filter(models.FailedLoginEvent.session_id == session.session_id)
+
+    return db.session.execute(query).scalars().all()
+
 
-    return db.session.execute(db.select(models.FailedLoginEvent)).scalars().all()
+###################################################################################
+#                                  Login History                                  #
+###################################################################################
+# Login sessions older than ``LOGIN_SESSION_ARCHIVE_DAYS`` are moved with their failed events to the archive (see
+# ``maintenance.py`` and ``archive.py``). These functions read a range of days from both the database and the
+# archive, in the same format as the functions above.
+
+def get_login_history_as_dict(start: date, end: date, count: int = None, with_photos: bool = True) -> list[dict]:
+    """
+    Get the login sessions of a range of days as a dictionary, latest first
+
+    :param start: The first day
+    :param end: The last day (included)
+    :param count: The maximum number of login sessions to get (all of them if None)
+    :param with_photos: Whether to include the base64 encoded login photos
+    :return: A list of the login sessions as a dictionary
+    """
+    first, last = datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.max.time())
+    query = (db.select(models.LoginSession).filter(models.LoginSession.date.between(first, last))
+             .order_by(models.LoginSession.date.desc()).limit(count))
+    if with_photos:
+        query = query.options(undefer(models.LoginSession.login_photo_hash))
+
+    sessions = [(login_session.date, login_session_to_dict(login_session, with_photos))
+                for login_session in db.session.execute(query).scalars()]
+
+    # A session is still in the database if its archiving was interrupted
+    in_database = {session_dict["session_id"] for _, session_dict in sessions}
+    for record in archive.read_range(start, end):
+        if record["id"] in in_database:
+            continue
+        session_date = datetime.fromisoformat(record["date"])
+        session_dict = {
+            "session_id": record["id"],
+            "user_id": record["user_id"],
+            "user_email": record["user_email"],
+            "date": session_date.strftime("%d/%m/%Y %H:%M:%S"),
+            "auth_stages": record["auth_stage"],
+            "motion_added_sequence": record["motion_added_sequence"],
+            "motion_completed": record["motion_pattern_completed"],
+        }
+        if with_photos:
+            session_dict["photo"] = record["photo"] or str(None)
+        sessions.append((session_date, session_dict))
+
+    sessions.sort(key=lambda item: item[0], reverse=True)
+    return [session_dict for _, session_dict in sessions[:count]]
+
+
+def get_failed_login_event_history_as_dict(start: date, end: date, user: models.User = None,
+                                           session_id: uuid.UUID = None, with_photos: bool = True) -> list[dict]:
+    """
+    Get the failed events of a range of days as a dictionary, oldest first
+
+    If a user is provided, only get the failed events for that user.
+    If a session ID is provided, only get the failed events for that session.
+
+    :param start: The first day
+    :param end: The last day (included)
+    :param user: The user to get the failed events for
+    :param session_id: The ID of the session to get the failed events for
+    :param with_photos: Whether to include the base64 encoded photos
+    :return: A list of the failed events as a dictionary
+    """
+    first, last = datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.max.time())
+    query = (db.select(models.FailedLoginEvent).filter(models.FailedLoginEvent.date.between(first, last))
+             .options(undefer(models.FailedLoginEvent.photo_hash)))
+    if user:
+        query = (query.join(models.LoginSession, models.FailedLoginEvent.session_id == models.LoginSession.session_id)
+                 .filter(models.LoginSession.id == user.id))
+    elif session_id:
+        query = query.filter(models.FailedLoginEvent.session_id == session_id)
+
+    events = [(event.date, failed_login_event_to_dict(event, with_photos))
+              for event in db.session.execute(query).scalars()]
+
+    in_database = {event_dict["id"] for _, event_dict in events}
+    # The archive is split by the day of the sessions, which can start the day before their events
+    for record in archive.read_range(start - timedelta(days=1), end):
+        if (user and record["user_id"] != str(user.id)) or (session_id and record["id"] != str(session_id)):
+            continue
+        for event in record["failed_events"]:
+            event_date = datetime.fromisoformat(event["date"])
+            if event["id"] in in_database or not first <= event_date <= last:
+                continue
+            event_dict = {
+                "id": event["id"],
+                "session_id": record["id"],
+                "date": event_date.strftime("%d/%m/%Y %H:%M:%S"),
+                "event": event["event"],
+                "auth_stages": json.dumps({"face_recognition": event["photo"] is not None}),
+            }
+            if with_photos:
+                event_dict["photo"] = event["photo"] or str(None)
+            events.append((event_date, event_dict))
+
+    events.sort(key=lambda item: item[0])
+    return [event_dict for _, event_dict in events]
+
+
+###################################################################################
+#                                   Photo Store                                   #
+###################################################################################
+def get_referenced_photos() -> set[str]:
+    """
+    Get the hashes of every photo referenced by the database
+
+    :return: The set of photo hashes
+    """
+    referenced = set()
+    for column in (models.User.photo_hash, models.LoginSession.login_photo_hash, models.FailedLoginEvent.photo_hash):
+        referenced.update(db.session.execute(db.select(column).filter(column.is_not(None)).distinct()).scalars())
+    return referenced
+
+
+def remove_unreferenced_photos(grace_seconds: float = blobs.PHOTO_GRACE_SECONDS) -> int:
+    """
+    Delete the stored photos that no row references anymore
+
+    :param grace_seconds: Photos stored more recently than this are kept
+    :return: The number of deleted photos
+    """
+    return blobs.remove_unreferenced_photos(get_referenced_photos(), grace_seconds)
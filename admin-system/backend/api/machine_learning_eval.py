@@ -5,32 +5,38 @@ from PIL import Image
 from torch import nn
 from torchvision.transforms import ToTensor, Compose, Resize
 
+# Output channels of the four conv layers and size of the feature vector of the default architecture
+CHANNELS = (64, 128, 128, 256)
+FEATURES = 4096
+# Size of the map each conv channel is reduced to for a 105x105 input
+EMBEDDING_AREA = 9 * 9
+
 
 # ----------------------------------------------------------------- #
 # ----------------------- Model Definitions ----------------------- #
 # ----------------------------------------------------------------- #
 class EmbeddingNetwork(nn.Module):
-    def __init__(self):
+    def __init__(self, channels=CHANNELS):
         super(EmbeddingNetwork, self).__init__()
 
-        # layers
+        # layers (channel counts are for the default architecture)
         # first layer: 3 input channels, 64 output channels
-        self.l1 = nn.Conv2d(3, 64, 10, padding=1)
+        self.l1 = nn.Conv2d(3, channels[0], 10, padding=1)
         self.a1 = nn.ReLU()
         self.p1 = nn.MaxPool2d(2)
 
         # second layer: 64 input channels, 128 output channels
-        self.l2 = nn.Conv2d(64, 128, 7, padding=1)
+        self.l2 = nn.Conv2d(channels[0], channels[1], 7, padding=1)
         self.a2 = nn.ReLU()
         self.p2 = nn.MaxPool2d(2)
 
         # third layer: 128 input channels, 128 output channels
-        self.l3 = nn.Conv2d(128, 128, 4, padding=1)
+        self.l3 = nn.Conv2d(channels[1], channels[2], 4, padding=1)
         self.a3 = nn.ReLU()
         self.p3 = nn.MaxPool2d(2)
 
         # fourth layer: 128 input channels, 256 output channels
-        self.l4 = nn.Conv2d(128, 256, 4, padding=1)
+        self.l4 = nn.Conv2d(channels[2], channels[3], 4, padding=1)
         self.a4 = nn.ReLU()
         self.p4 = nn.Flatten()
 
@@ -63,16 +69,17 @@ class EmbeddingNetwork(nn.Module):
 
 
 class SiameseNetwork(nn.Module):
-    def __init__(self):
+    def __init__(self, channels=CHANNELS, features=FEATURES):
         super(SiameseNetwork, self).__init__()
 
         # embedding layer
-        self.embedding_layer = EmbeddingNetwork()
+        self.embedding_layer = EmbeddingNetwork(channels)
 
         # fully connected classification layer
         # 2 classes: 0 (negative) and 1 (positive)
-        self.feature_vector = nn.Linear(20736, 4096)
-        self.classification_layer = nn.Linear(4096, 2)
+        # the embedding is a 9x9 map per output channel: 256 * 9 * 9 = 20736 by default
+        self.feature_vector = nn.Linear(channels[3] * EMBEDDING_AREA, features)
+        self.classification_layer = nn.Linear(features, 2)
 
     def forward(self, anchor, db_image):
         """Pass the input tensor through the siamese network.
@@ -102,6 +109,29 @@ class SiameseNetwork(nn.Module):
 model = SiameseNetwork()
 
 
+def load_model(path: str) -> SiameseNetwork:
+    """
+    Load the model weights, building the network to match them.
+
+    The architecture is read from the shapes in the state dict so that smaller (distilled or pruned)
+    models can be deployed by only replacing ``model.pth``.
+
+    :param path: The path to the state dict
+    :return: The loaded model (also set as the module's ``model``)
+    """
+    global model
+
+    state_dict = torch.load(path, map_location=torch.device('cpu'), weights_only=False)
+    channels = tuple(state_dict[f"embedding_layer.l{i}.weight"].shape[0] for i in range(1, 5))
+    features = state_dict["feature_vector.weight"].shape[0]
+
+    model = SiameseNetwork(channels, features)
+    model.load_state_dict(state_dict)
+    model.eval()
+
+    return model
+
+
 # ---------------------------------------------------------------- #
 # ----------------------- Image Evaluation ----------------------- #
 # ---------------------------------------------------------------- #
@@ -0,0 +1,183 @@
+import base64
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+import flask
+from sqlalchemy.orm import undefer
+
+import constants
+from api import archive, blobs, helpers, models
+from api.app import db
+
+
+###################################################################################
+#                                  Session Reaper                                 #
+###################################################################################
+# Expired rows are deleted in small batches, each in its own short transaction, so the reaper never holds the
+# database's write lock for long and the requests' writes get in between the batches.
+#
+# - Auth sessions are deleted once expired. Disabled (logged out) sessions are kept until they expire too: the
+#   latest session of a user decides whether they are logged in, so deleting it early would revive an older one.
+# - Login sessions are also the login history listed on the admin dashboard, so they are kept in the database for
+#   ``LOGIN_SESSION_ARCHIVE_DAYS``, then moved with their failed events and photos to the archive (see
+#   ``archive.py``). Their photos are removed from the photo store once nothing references them anymore.
+
+def delete_in_batches(model, key, condition, batch_size: int, pause_seconds: float, before_delete=None) -> int:
+    """
+    Delete the rows of a table matching a condition, ``batch_size`` rows per transaction
+
+    :param model: The model of the table
+    :param key: The primary key column of the table
+    :param condition: The condition selecting the rows to delete
+    :param batch_size: The number of rows deleted per transaction
+    :param pause_seconds: The pause between two transactions
+    :param before_delete: Called with the keys of each batch before the batch is deleted, in the same transaction
+    :return: The number of deleted rows
+    """
+    deleted = 0
+    while True:
+        keys = db.session.execute(db.select(key).filter(condition).limit(batch_size)).scalars().all()
+        if not keys:
+            return deleted
+
+        if before_delete is not None:
+            before_delete(keys)
+        db.session.execute(db.delete(model).filter(key.in_(keys)), execution_options={"synchronize_session": False})
+        db.session.commit()
+        deleted += len(keys)
+
+        if len(keys) < batch_size:
+            return deleted
+        time.sleep(pause_seconds)
+
+
+def photo_to_string(photo_hash: str | None) -> str | None:
+    return base64.b64encode(blobs.get_photo(photo_hash)).decode("utf-8") if photo_hash else None
+
+
+def archive_login_sessions(session_ids: list) -> int:
+    """
+    Append login sessions, with their failed events and photos, to the archive
+
+    :param session_ids: The IDs of the sessions
+    :return: The number of archived failed events
+    """
+    sessions = db.session.execute(db.select(models.LoginSession, models.User.email)
+                                  .outerjoin(models.User, models.User.id == models.LoginSession.id)
+                                  .filter(models.LoginSession.session_id.in_(session_ids))
+                                  .options(undefer(models.LoginSession.login_photo_hash))).all()
+    events = db.session.execute(db.select(models.FailedLoginEvent)
+                                .filter(models.FailedLoginEvent.session_id.in_(session_ids))
+                                .options(undefer(models.FailedLoginEvent.photo_hash))).scalars().all()
+
+    events_by_session = {}
+    for event in events:
+        events_by_session.setdefault(event.session_id, []).append({
+            "id": str(event.id),
+            "date": event.date.isoformat(),
+            "event": event.event,
+            "photo": photo_to_string(event.photo_hash),
+        })
+
+    records_by_day = {}
+    for login_session, email in sessions:
+        records_by_day.setdefault(login_session.date.date(), []).append({
+            "id": str(login_session.session_id),
+            "user_id": str(login_session.id),
+            "user_email": email,
+            "date": login_session.date.isoformat(),
+            # In the format of the dashboard
+            "auth_stage": json.dumps(login_session.auth_stages),
+            "motion_added_sequence": (json.dumps(login_session.motion_added_moves)
+                                      if login_session.motion_added_sequence is not None else None),
+            "motion_pattern_completed": login_session.motion_pattern_completed,
+            "photo": photo_to_string(login_session.login_photo_hash),
+            "failed_events": events_by_session.get(login_session.session_id, []),
+        })
+    for day, records in records_by_day.items():
+        archive.append_records(day, records)
+    return len(events)
+
+
+def reap_expired_sessions(batch_size: int = constants.REAPER_BATCH_SIZE,
+                          pause_seconds: float = constants.REAPER_PAUSE_SECONDS,
+                          now: datetime = None) -> dict[str, int]:
+    """
+    Delete the expired auth sessions, and move the login sessions older than ``LOGIN_SESSION_ARCHIVE_DAYS`` to the
+    archive
+
+    :param batch_size: The number of rows deleted per transaction
+    :param pause_seconds: The pause between two transactions
+    :param now: The current date and time (defaults to now)
+    :return: The number of rows deleted (or archived) from each table, and the number of photos removed from the
+        photo store
+    """
+    now = now or datetime.now()
+    report = {"auth_session": 0, "login_session": 0, "failed_login_event": 0, "photos": 0}
+
+    auth_cutoff = now - timedelta(minutes=float(constants.AUTH_SESSION_EXPIRY_MINUTES))
+    report["auth_session"] = delete_in_batches(models.AuthSession, models.AuthSession.session_id,
+                                               models.AuthSession.date < auth_cutoff, batch_size, pause_seconds)
+
+    def archive_and_delete_failed_events(session_ids):
+        # Written to the archive before the rows are deleted (the deletion is committed after this returns)
+        report["failed_login_event"] += archive_login_sessions(session_ids)
+        db.session.execute(db.delete(models.FailedLoginEvent)
+                           .filter(models.FailedLoginEvent.session_id.in_(session_ids)),
+                           execution_options={"synchronize_session": False})
+
+    login_cutoff = now - timedelta(days=float(constants.LOGIN_SESSION_ARCHIVE_DAYS))
+    report["login_session"] = delete_in_batches(models.LoginSession, models.LoginSession.session_id,
+                                                models.LoginSession.date < login_cutoff, batch_size, pause_seconds,
+                                                before_delete=archive_and_delete_failed_events)
+
+    if report["login_session"]:
+        report["photos"] = helpers.remove_unreferenced_photos()
+    return report
+
+
+def format_report(report: dict[str, int]) -> str:
+    return ", ".join(f"{count} {name}" for name, count in report.items())
+
+
+def start_reaper(app: flask.Flask, interval_seconds: float) -> threading.Thread:
+    """
+    Run ``reap_expired_sessions`` every ``interval_seconds`` in a background thread of the app's process
+
+    Every gunicorn worker runs its own reaper, they start at random times so they rarely run together (and a row
+    deleted by two reapers at once is simply deleted once).
+
+    :param app: The Flask app
+    :param interval_seconds: The time between two runs
+    :return: The (daemon) thread
+    """
+    def run():
+        time.sleep(random.uniform(0, interval_seconds))
+        while True:
+            with app.app_context():
+                try:
+                    report = reap_expired_sessions()
+                    app.logger.info("Session reaper: deleted %s", format_report(report))
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Session reaper failed")
+                finally:
+                    db.session.remove()
+            time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=run, name="session-reaper", daemon=True)
+    thread.start()
+    return thread
+
+
+@click.command("reap-sessions")
+@click.option("--batch-size", type=int, default=constants.REAPER_BATCH_SIZE, show_default=True,
+              help="Number of rows deleted per transaction.")
+def reap_sessions_command(batch_size: int):
+    """Delete the expired auth sessions and archive the old login sessions."""
+    report = reap_expired_sessions(batch_size)
+    click.echo(f"Deleted {format_report(report)}")
@@ -0,0 +1,186 @@
+import json
+
+import sqlalchemy
+from sqlalchemy import bindparam, text
+
+from api import blobs
+from constants import AUTH_STAGES_BY_NAME, MOVE_CODES
+
+# The schema version of each database is stored in this table (a single row)
+VERSION_TABLE = "schema_version"
+
+
+###################################################################################
+#                                   Migrations                                    #
+###################################################################################
+# ``db.create_all()`` creates missing tables but never changes existing ones, so every change to the schema of
+# an existing table needs a migration. Migrations are applied in order at startup, each in its own transaction,
+# and must leave the database matching ``models.py``. Databases created from scratch already match the models
+# and are stamped with the latest version instead. They run in the app context, as the photo store is part of
+# the app's data folder.
+
+def add_lookup_indexes(connection: sqlalchemy.Connection) -> None:
+    """
+    Index the columns used by the login session, auth session, failed event and file lookups
+    """
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_login_session_date ON login_session (date)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_auth_session_id_date ON auth_session (id, date)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_failed_login_event_session_id "
+                            "ON failed_login_event (session_id)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_user_files_user_id_file_name "
+                            "ON user_files (user_id, file_name)"))
+
+
+# (table, primary key, photo column, column of the photo's hash in the photo store)
+PHOTO_COLUMNS = [
+    ("user", "id", "photo", "photo_hash"),
+    ("login_session", "session_id", "login_photo", "login_photo_hash"),
+    ("failed_login_event", "id", "photo", "photo_hash"),
+]
+# Number of photos read from the database at once when moving them to the photo store
+PHOTO_BATCH_SIZE = 50
+
+
+def move_photos_to_store(connection: sqlalchemy.Connection) -> None:
+    """
+    Move the photos stored in the rows to the photo store, keeping only their hash in the rows
+    """
+    for table, key, photo_column, hash_column in PHOTO_COLUMNS:
+        columns = {column["name"] for column in sqlalchemy.inspect(connection).get_columns(table)}
+        if hash_column not in columns:
+            connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {hash_column} VARCHAR(64)'))
+        if photo_column not in columns:
+            continue
+
+        keys = connection.execute(text(f'SELECT {key} FROM "{table}" WHERE {photo_column} IS NOT NULL')).scalars().all()
+        select_photos = (text(f'SELECT {key}, {photo_column} FROM "{table}" WHERE {key} IN :keys')
+                         .bindparams(bindparam("keys", expanding=True)))
+        for start in range(0, len(keys), PHOTO_BATCH_SIZE):
+            for row_key, photo in connection.execute(select_photos, {"keys": keys[start:start + PHOTO_BATCH_SIZE]}):
+                connection.execute(text(f'UPDATE "{table}" SET {hash_column} = :digest WHERE {key} = :key'),
+                                   {"digest": blobs.put_photo(photo), "key": row_key})
+
+        connection.execute(text(f'ALTER TABLE "{table}" DROP COLUMN {photo_column}'))
+
+
+# Number of login sessions read and converted at once when encoding the auth stages
+SESSION_BATCH_SIZE = 500
+
+
+def encode_auth_stages(connection: sqlalchemy.Connection) -> None:
+    """
+    Replace the JSON auth stages of the login sessions by bitmasks, and encode their added motion sequences
+    """
+    columns = {column["name"] for column in sqlalchemy.inspect(connection).get_columns("login_session")}
+    for column in ("auth_methods", "auth_completed"):
+        if column not in columns:
+            connection.execute(text(f"ALTER TABLE login_session ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+    if "auth_stage" not in columns:
+        return
+
+    update = text("UPDATE login_session SET auth_methods = :auth_methods, auth_completed = :auth_completed, "
+                  "motion_added_sequence = :motion_added_sequence WHERE session_id = :key")
+    # Read in pages of SESSION_BATCH_SIZE by session_id, each page updated before the next one is read
+    select_first = text("SELECT session_id, auth_stage, motion_added_sequence FROM login_session "
+                        "ORDER BY session_id LIMIT :limit")
+    select_next = text("SELECT session_id, auth_stage, motion_added_sequence FROM login_session "
+                       "WHERE session_id > :after ORDER BY session_id LIMIT :limit")
+    after = None
+    while True:
+        if after is None:
+            page = connection.execute(select_first, {"limit": SESSION_BATCH_SIZE}).all()
+        else:
+            page = connection.execute(select_next, {"after": after, "limit": SESSION_BATCH_SIZE}).all()
+        if not page:
+            break
+
+        rows = []
+        for session_id, auth_stage, motion_added_sequence in page:
+            auth_methods = auth_completed = 0
+            for name, completed in json.loads(auth_stage).items():
+                auth_methods |= AUTH_STAGES_BY_NAME[name]
+                auth_completed |= AUTH_STAGES_BY_NAME[name] if completed else 0
+            moves = json.loads(motion_added_sequence) if motion_added_sequence is not None else None
+            rows.append({"key": session_id, "auth_methods": int(auth_methods),
+                         "auth_completed": int(auth_completed),
+                         "motion_added_sequence": "".join(MOVE_CODES[move] for move in moves) if moves else None})
+        connection.execute(update, rows)
+        after = page[-1][0]
+
+    connection.execute(text("ALTER TABLE login_session DROP COLUMN auth_stage"))
+
+
+# (version, description, function applying the migration), in order
+MIGRATIONS = [
+    (1, "Add lookup indexes", add_lookup_indexes),
+    (2, "Move the photos to the photo store", move_photos_to_store),
+    (3, "Store the auth stages as bitmasks and the added motions as move codes", encode_auth_stages),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+###################################################################################
+#                                     Runner                                      #
+###################################################################################
+def get_version(connection: sqlalchemy.Connection) -> int:
+    """
+    Get the schema version of a database
+
+    :param connection: The database connection
+    :return: The version (0 if the database has never been migrated)
+    """
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (version INTEGER NOT NULL)"))
+    version = connection.execute(text(f"SELECT version FROM {VERSION_TABLE}")).scalar()
+    return version or 0
+
+
+def set_version(connection: sqlalchemy.Connection, version: int) -> None:
+    """
+    Set the schema version of a database
+
+    :param connection: The database connection
+    :param version: The new version
+    """
+    connection.execute(text(f"DELETE FROM {VERSION_TABLE}"))
+    connection.execute(text(f"INSERT INTO {VERSION_TABLE} (version) VALUES (:version)"), {"version": version})
+
+
+def drop_version(engine: sqlalchemy.Engine) -> None:
+    """
+    Drop the schema version of a database (when its tables are dropped)
+
+    :param engine: The database engine
+    """
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {VERSION_TABLE}"))
+
+
+def upgrade(engine: sqlalchemy.Engine, fresh: bool = False) -> list[int]:
+    """
+    Apply the migrations a database is missing
+
+    :param engine: The database engine
+    :param fresh: Whether the tables were just created from the models (they are then stamped with the latest version)
+    :return: The versions that were applied
+    """
+    with engine.begin() as connection:
+        if fresh and get_version(connection) == 0:
+            set_version(connection, LATEST_VERSION)
+            return []
+
+    applied = []
+    for migration_version, description, migrate in MIGRATIONS:
+        with engine.begin() as connection:
+            # Checked in the migration's transaction, as every worker process runs the migrations at startup
+            if get_version(connection) >= migration_version:
+                continue
+            migrate(connection)
+            set_version(connection, migration_version)
+        applied.append(migration_version)
+
+    if applied and engine.dialect.name == "sqlite":
+        # Migrations can rewrite whole tables, give the freed pages back to the file system
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("VACUUM"))
+    return applied
@@ -1,19 +1,25 @@
-import json
 import re
 import uuid
 
 import werkzeug
 from flask_bcrypt import generate_password_hash, check_password_hash
-from sqlalchemy.orm import validates
+from sqlalchemy.orm import deferred, validates
 
+from api import blobs
 from api.app import db
 from api.machine_learning_eval import evaluate_images
-from constants import ValidMoves
+from constants import MOVE_CODES, AuthStage, ValidMoves
+
+# The move of each character of the stored motion sequences
+MOVES_BY_CODE = {code: move for move, code in MOVE_CODES.items()}
 
 
 def validate_id(identifier) -> uuid.UUID:
     """
-    Validate an ID by checking that it is a unique UUID and is not null.
+    Validate an ID by checking that it is a UUID and is not null.
+
+    Uniqueness is not checked here: IDs are random UUID4s and the database's unique constraints reject the
+    (practically impossible) duplicates on insert, see ``helpers.insert_rows``.
 
     :param identifier: The ID to validate
     :return: The ID if it is valid
@@ -47,6 +53,63 @@ def check_valid_moves(motion_pattern: list[str]):
             raise AssertionError("Invalid motion pattern")
 
 
+def check_valid_email(email: str):
+    """
+    Check that an email is provided, is a valid email address, and is at most 120 characters
+
+    :param email: The email to check (in lower case)
+    :raises AssertionError: The email is invalid
+    """
+    if email == "none":
+        raise AssertionError('No email provided')
+
+    is_less_than_120_characters = len(email) <= 120
+
+    if not is_less_than_120_characters:
+        raise AssertionError('Provided email is too long')
+
+    if not re.fullmatch(r"^[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*@(?:[a-z0-9](?:["
+                        r"a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?$", email):
+        raise AssertionError('Provided email is not an email address')
+
+
+def check_valid_password(password: str):
+    """
+    Check that a password is provided, is between 8 and 50 characters, and contains 1 capital letter and 1 number
+
+    :param password: The password to check
+    :raises AssertionError: The password is invalid
+    """
+    if not password:
+        raise AssertionError('Password not provided')
+
+    if not re.search(r'\d.*[A-Z]|[A-Z].*\d', password):
+        raise AssertionError('Password must contain 1 capital letter and 1 number')
+
+    if len(password) < 8 or len(password) > 50:
+        raise AssertionError('Password must be between 8 and 50 characters')
+
+
+def encode_moves(moves: list[str]) -> str:
+    """
+    Encode a list of moves as a string of one character per move (see ``constants.MOVE_CODES``)
+
+    :param moves: The moves (checked with ``check_valid_moves``)
+    :return: The encoded moves
+    """
+    return "".join(MOVE_CODES[move] for move in moves)
+
+
+def decode_moves(sequence: str) -> list[str]:
+    """
+    Decode a string of moves encoded by ``encode_moves``
+
+    :param sequence: The encoded moves
+    :return: The list of moves
+    """
+    return [MOVES_BY_CODE[code] for code in sequence]
+
+
 class User(db.Model):
     """
     User model for the database.
@@ -58,7 +121,7 @@ class User(db.Model):
     :param email: The user's email address
     :param pwd: The user's password (hashed)
     :param motion_pattern: The user's motion pattern (hashed)
-    :param photo: The user's facial recognition reference photo
+    :param photo: The user's facial recognition reference photo (kept in the photo store, see ``blobs.py``)
     """
     __tablename__ = "user"
 
@@ -70,53 +133,37 @@ class User(db.Model):
     pwd = db.Column(db.String(300), nullable=True)
     # User's motion pattern (hashed) - only used if the user has enabled pico authentication
     motion_pattern = db.Column(db.String, nullable=True)
-    # User's facial recognition reference photo - only used if the user has enabled facial recognition authentication
-    photo = db.Column(db.LargeBinary, nullable=True)
+    # SHA-256 of the user's facial recognition reference photo in the photo store - only used if the user has enabled
+    # facial recognition authentication
+    photo_hash = db.Column(db.String(64), nullable=True)
     # Whether the user has admin privileges
     admin = db.Column(db.Boolean, nullable=False, default=False)
 
-    # Ensures that the ID is a unique UUID and is not null
+    # User's facial recognition reference photo (read from the photo store)
+    @property
+    def photo(self) -> bytes | None:
+        return blobs.get_photo(self.photo_hash) if self.photo_hash else None
+
+    @photo.setter
+    def photo(self, data: bytes | None):
+        self.photo_hash = blobs.put_photo(data) if data else None
+
+    # Ensures that the ID is a UUID and is not null (uniqueness is enforced by the database on insert)
     @validates('id')
     def validate_id(self, key, identifier):
-        validate_id(identifier)
-        while User.query.filter(User.id == identifier).first():
-            identifier = uuid.uuid4()
-
         return validate_id(identifier)
 
-    # Ensures that the email is not null, is a valid email address, is unique, and is less than 120 characters
+    # Ensures that the email is not null, is a valid email address, and is less than 120 characters
+    # (uniqueness is enforced by the database on insert)
     @validates('email')
     def validate_email(self, key, email):
-        if email == "none":
-            raise AssertionError('No email provided')
-
-        is_unique = not db.session.execute(db.select(User).filter(User.email == email)).scalars().first()
-        is_less_than_120_characters = len(email) <= 120
-
-        if not is_unique:
-            raise AssertionError('Provided email is already in use')
-
-        if not is_less_than_120_characters:
-            raise AssertionError('Provided email is too long')
-
-        if not re.fullmatch(r"^[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*@(?:[a-z0-9](?:["
-                            r"a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?$", email):
-            raise AssertionError('Provided email is not an email address')
-
+        check_valid_email(email)
         return email
 
     # Ensures that the password is not null, is between 8 and 50 characters, and contains 1 capital letter and 1 number
     def set_password(self, password):
-        if not password:
-            raise AssertionError('Password not provided')
-
-        if not re.search(r'\d.*[A-Z]|[A-Z].*\d', password):
-            raise AssertionError('Password must contain 1 capital letter and 1 number')
-
-        if len(password) < 8 or len(password) > 50:
-            raise AssertionError('Password must be between 8 and 50 characters')
-
-        self.pwd = generate_password_hash(password)
+        check_valid_password(password)
+        self.pwd = generate_password_hash(password).decode('utf-8')
 
     # Checks the provided password against the stored password hash
     def check_password(self, password):
@@ -130,7 +177,7 @@ class User(db.Model):
         # Check that every element in the motion pattern is a valid move
         check_valid_moves(motion_pattern)
 
-        self.motion_pattern = generate_password_hash(str(motion_pattern))
+        self.motion_pattern = generate_password_hash(str(motion_pattern)).decode('utf-8')
 
     # Checks the provided motion pattern against the stored motion pattern hash
     def check_motion_pattern(self, motion_pattern):
@@ -162,6 +209,8 @@ class UserFiles(db.Model):
     :param file_path: The relative path to the file (from instance path)
     """
     __tablename__ = "user_files"
+    # Used to check that file names are unique for each user
+    __table_args__ = (db.Index("ix_user_files_user_id_file_name", "user_id", "file_name"),)
 
     id = db.Column(db.Uuid, primary_key=True, unique=True, nullable=False)
     user_id = db.Column(db.Uuid, db.ForeignKey('user.id'), nullable=False)
@@ -170,13 +219,9 @@ class UserFiles(db.Model):
     file_type = db.Column(db.String, nullable=False)
     file_path = db.Column(db.String, nullable=False)
 
-    # Ensures that the ID is a unique UUID and is not null
+    # Ensures that the ID is a UUID and is not null (uniqueness is enforced by the database on insert)
     @validates('id')
     def validate_id(self, key, identifier):
-        validate_id(identifier)
-        while UserFiles.query.filter(UserFiles.id == identifier).first():
-            identifier = uuid.uuid4()
-
         return validate_id(identifier)
 
 
@@ -204,13 +249,9 @@ class UserAuthMethods(db.Model):
     motion_pattern = db.Column(db.Boolean, nullable=False)
     face_recognition = db.Column(db.Boolean, nullable=False)
 
-    # Ensures that the ID is a unique UUID and is not null
+    # Ensures that the ID is a UUID and is not null (uniqueness is enforced by the database on insert)
     @validates('id')
     def validate_id(self, key, identifier):
-        validate_id(identifier)
-        while UserAuthMethods.query.filter(UserAuthMethods.id == identifier).first():
-            identifier = uuid.uuid4()
-
         return validate_id(identifier)
 
 
@@ -221,79 +262,93 @@ class LoginSession(db.Model):
     This table is used to log all past successful and failed login attempts. It also tracks
     current login sessions and what stage they are at. Note that failed events (incorrect password
     attempts, motion pattern failure, etc.) are stored in separate table but incomplete login attempts
-    (fails) are stored as login session with the auth_stage being a dictionary of booleans containing
-    at least one false value. A login session times out after the timeout period
+    (fails) are stored as login session with auth_completed missing at least one of the stages of
+    auth_methods. A login session times out after the timeout period
     ``LOGIN_SESSION_EXPIRY_MINUTES`` specified in the ``constants.py`` file.
 
     :param session_id: A unique ID for the session
     :param id: The ID of the user that the session is for
     :param date: The date and time of the session creation
-    :param auth_stage: A string cast dictionary of booleans indicating which authentication methods have been completed
+    :param auth_methods: A bitmask of the authentication methods (``constants.AuthStage``) of the login
+    :param auth_completed: A bitmask of the authentication methods that have been completed
     :param pico_id: A unique pico ID passed upon each motion password attempt
-    :param motion_added_sequence: The sequence of moves to be added to the user's motion pattern
+    :param motion_added_sequence: The sequence of moves to be added to the user's motion pattern (encoded with
+        ``encode_moves``)
     :param motion_pattern_completed: A flag to indicate whether the motion pattern has been successfully completed
     :param motion_pattern_retry: A flag to indicate whether the motion pattern needs to be retried
-    :param login_photo: The successful login photo (if applicable)
+    :param login_photo: The successful login photo (if applicable, kept in the photo store, see ``blobs.py``)
     """
     __tablename__ = "login_session"
 
     session_id = db.Column(db.Uuid, unique=True, nullable=False, primary_key=True)
     id = db.Column(db.Uuid, db.ForeignKey('user.id'), nullable=False)
-    date = db.Column(db.DateTime, nullable=False)
-    # A dictionary of booleans indicating which authentication methods have been completed
-    auth_stage = db.Column(db.String, nullable=False)
+    # Indexed to list the latest login sessions
+    date = db.Column(db.DateTime, nullable=False, index=True)
+    # A bitmask of the authentication methods of the login (``constants.AuthStage``)
+    auth_methods = db.Column(db.Integer, nullable=False)
+    # A bitmask of the authentication methods that have been completed
+    auth_completed = db.Column(db.Integer, nullable=False)
     # The user's pico_id (if applicable)
     pico_id = db.Column(db.String, unique=True, nullable=True)
-    # The sequence of moves to be added to the user's motion pattern
+    # The sequence of moves to be added to the user's motion pattern, one character per move (see ``encode_moves``)
     motion_added_sequence = db.Column(db.String, nullable=True)
     # A flag to indicate whether the motion pattern has been successfully completed
     motion_pattern_completed = db.Column(db.Boolean, nullable=False)
     # A flag to indicate whether the motion pattern needs to be retried
     motion_pattern_retry = db.Column(db.Boolean, nullable=False)
-    # The successful login photo (if applicable)
-    login_photo = db.Column(db.LargeBinary, nullable=True)
-
-    # Ensures that the session ID is a unique UUID and is not null
+    # SHA-256 of the successful login photo in the photo store (if applicable) - only loaded when accessed, or when
+    # the query asks for it (see ``helpers.get_login_sessions``)
+    login_photo_hash = deferred(db.Column(db.String(64), nullable=True))
+
+    # The successful login photo (read from the photo store)
+    @property
+    def login_photo(self) -> bytes | None:
+        return blobs.get_photo(self.login_photo_hash) if self.login_photo_hash else None
+
+    @login_photo.setter
+    def login_photo(self, data: bytes | None):
+        self.login_photo_hash = blobs.put_photo(data) if data else None
+
+    # The authentication methods of the login, in order, and whether they have been completed
+    @property
+    def auth_stages(self) -> dict[str, bool]:
+        return {stage.name.lower(): bool(self.auth_completed & stage) for stage in AuthStage(self.auth_methods)}
+
+    # The decoded sequence of moves to be added to the user's motion pattern
+    @property
+    def motion_added_moves(self) -> list[str] | None:
+        return decode_moves(self.motion_added_sequence) if self.motion_added_sequence is not None else None
+
+    # Ensures that the session ID is a UUID and is not null (uniqueness is enforced by the database on insert)
     @validates('session_id')
     def validate_id(self, key, identifier):
-        validate_id(identifier)
-        while LoginSession.query.filter(LoginSession.session_id == identifier).first():
-            identifier = uuid.uuid4()
-
         return validate_id(identifier)
 
-    # Ensures that the pico ID is a unique UUID and is not null
+    # Ensures that the pico ID is not null (uniqueness is enforced by the database on update)
     @validates('pico_id')
     def validate_pico_id(self, key, pico_id):
-        is_unique = not db.session.execute(db.select(LoginSession)
-                                           .filter(LoginSession.pico_id == pico_id)).scalars().first()
         if not pico_id:
             raise AssertionError('No pico_id provided')
-        if not is_unique:
-            raise AssertionError('Provided pico_id is not unique')
         return pico_id
 
-    # Ensures that the auth_stage is a valid dictionary and is not null
-    @validates('auth_stage')
-    def validate_auth_stage(self, key, auth_stage):
-        if not auth_stage:
-            raise AssertionError('No auth_stage provided')
-        try:
-            json.loads(auth_stage)
-        except json.JSONDecodeError:
-            raise AssertionError('Auth_stage is not a valid dictionary')
+    # Ensures that the auth methods and completed stages are bitmasks of auth stages and are not null
+    @validates('auth_methods', 'auth_completed')
+    def validate_auth_stages(self, key, stages):
+        if stages is None:
+            raise AssertionError(f'No {key} provided')
+        if not isinstance(stages, int) or isinstance(stages, bool) or stages & ~AuthStage(0) != stages:
+            raise AssertionError(f'{key.capitalize()} is not a valid bitmask of auth stages')
 
-        return auth_stage
+        return stages
 
-    # Ensures that the motion added sequence is a valid dictionary and is not null
+    # Ensures that the motion added sequence is a valid encoded sequence of moves and is not null
     @validates('motion_added_sequence')
     def validate_motion_added_sequence(self, key, motion_added_sequence):
         if not motion_added_sequence:
             raise AssertionError('No motion added sequence provided')
-        try:
-            json.loads(motion_added_sequence)
-        except json.JSONDecodeError:
-            raise AssertionError('Motion added sequence is not a valid dictionary')
+        if not isinstance(motion_added_sequence, str) or any(code not in MOVES_BY_CODE
+                                                             for code in motion_added_sequence):
+            raise AssertionError('Motion added sequence is not a valid sequence of moves')
 
         return motion_added_sequence
 
@@ -310,23 +365,32 @@ class FailedLoginEvent(db.Model):
     :param session_id: The ID of the session that the event is for
     :param date: The date and time of the event
     :param event: Details of the event
-    :param photo: The photo relevant to the event (from failed face recognition if applicable)
+    :param photo: The photo relevant to the event (from failed face recognition if applicable, kept in the photo
+        store, see ``blobs.py``)
     """
     __tablename__ = "failed_login_event"
 
     id = db.Column(db.Uuid, unique=True, nullable=False, primary_key=True)
-    session_id = db.Column(db.Uuid, db.ForeignKey('login_session.session_id'), nullable=False)
+    # Indexed to join the events to their login session
+    session_id = db.Column(db.Uuid, db.ForeignKey('login_session.session_id'), nullable=False, index=True)
     date = db.Column(db.DateTime, nullable=False)
     event = db.Column(db.String, nullable=False)
-    photo = db.Column(db.LargeBinary, nullable=True)
+    # SHA-256 of the photo in the photo store (if applicable) - only loaded when accessed, or when the query asks
+    # for it (see ``helpers.get_failed_login_events``)
+    photo_hash = deferred(db.Column(db.String(64), nullable=True))
+
+    # The photo relevant to the event (read from the photo store)
+    @property
+    def photo(self) -> bytes | None:
+        return blobs.get_photo(self.photo_hash) if self.photo_hash else None
+
+    @photo.setter
+    def photo(self, data: bytes | None):
+        self.photo_hash = blobs.put_photo(data) if data else None
 
-    # Ensures that the session ID is a unique UUID and is not null
+    # Ensures that the session ID is a UUID and is not null (uniqueness is enforced by the database on insert)
     @validates('id')
     def validate_id(self, key, identifier):
-        validate_id(identifier)
-        while FailedLoginEvent.query.filter(FailedLoginEvent.id == identifier).first():
-            identifier = uuid.uuid4()
-
         return validate_id(identifier)
 
 
@@ -343,17 +407,15 @@ class AuthSession(db.Model):
     :param date: The date and time of the session creation
     """
     __tablename__ = "auth_session"
+    # Used to find the latest auth session of a user
+    __table_args__ = (db.Index("ix_auth_session_id_date", "id", "date"),)
 
     session_id = db.Column(db.Uuid, unique=True, nullable=False, primary_key=True)
     id = db.Column(db.Uuid, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.DateTime, nullable=False)
     enabled = db.Column(db.Boolean, nullable=False)
 
-    # Ensures that the session ID is a unique UUID and is not null
+    # Ensures that the session ID is a UUID and is not null (uniqueness is enforced by the database on insert)
     @validates('session_id')
     def validate_id(self, key, identifier):
-        validate_id(identifier)
-        while AuthSession.query.filter(AuthSession.session_id == identifier).first():
-            identifier = uuid.uuid4()
-
         return validate_id(identifier)
@@ -0,0 +1,383 @@
+import base64
+import binascii
+import csv
+import json
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, TextIO
+
+import click
+import flask
+from flask import current_app
+from flask_bcrypt import generate_password_hash
+from sqlalchemy.exc import IntegrityError
+
+import constants
+from api import blobs, models
+from api.app import db
+
+# Formats of the import files, by file extension
+IMPORT_FORMATS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv"}
+# Folder of the uploaded import files and of the import reports, inside the app's data folder
+IMPORT_FOLDER = "imports"
+# Number of hashes sent to a hashing process at once
+HASH_CHUNK_SIZE = 8
+
+
+###################################################################################
+#                                Bulk User Import                                 #
+###################################################################################
+# Users are imported from NDJSON files, one object per line in the format of the signup request (see
+# ``helpers.create_user_from_dict``) with the face recognition photo base64 encoded in ``photo``, or from CSV files
+# with the columns ``email``, ``password``, ``motion_pattern`` (moves separated by spaces), ``auth_methods`` (names
+# separated by spaces) and ``photo``.
+#
+# The records are read ``IMPORT_BATCH_SIZE`` at a time, and each batch is validated in this process. Hashing the
+# passwords and motion patterns (bcrypt) is most of the work, so it is spread over a pool of processes: the secrets
+# of a batch are sent to the pool while the previous batch is inserted, in a single transaction. Only two batches
+# (and the emails already imported) are held in memory at once, whatever the size of the file. The photos are put
+# in the photo store with their batch, right before it is inserted: an import can take hours, longer than
+# ``blobs.PHOTO_GRACE_SECONDS``, and a photo stored at validation could be removed as unreferenced before its user
+# is inserted. The users' data folders are created with
+# their first file (see ``helpers.add_user_file``).
+
+def get_import_format(filename: str) -> str:
+    """
+    Get the format of an import file from its extension
+
+    :param filename: The name of the file
+    :return: The format (``ndjson`` or ``csv``)
+    :raises AssertionError: The extension is not one of ``IMPORT_FORMATS``
+    """
+    file_format = IMPORT_FORMATS.get(os.path.splitext(filename or "")[1].lower())
+    if file_format is None:
+        raise AssertionError(f"Import files must be one of {', '.join(IMPORT_FORMATS)}")
+    return file_format
+
+
+def read_records(file: TextIO, file_format: str) -> Iterator[tuple[int, dict | None, str | None]]:
+    """
+    Read the user records of an import file
+
+    :param file: The file, opened in text mode
+    :param file_format: The format of the file (``ndjson`` or ``csv``)
+    :return: The line number, the record (in the format of the signup request) and the error of each record
+    """
+    if file_format == "ndjson":
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                yield line_number, None, "Record is not valid JSON"
+                continue
+            if isinstance(record, dict):
+                yield line_number, record, None
+            else:
+                yield line_number, None, "Record is not a JSON object"
+        return
+
+    reader = csv.DictReader(file)
+    for row in reader:
+        enabled = (row.get("auth_methods") or "").split()
+        yield reader.line_num, {
+            "email": row.get("email"),
+            "password": row.get("password") or None,
+            "motion_pattern": (row.get("motion_pattern") or "").split() or None,
+            "auth_methods": {name: name in enabled for name in constants.AUTH_STAGES_BY_NAME},
+            "photo": row.get("photo") or None,
+        }, None
+
+
+def prepare_user(record: dict) -> tuple[dict, dict, bytes | None, tuple[str | None, str | None]]:
+    """
+    Validate a user record, with the same checks as ``helpers.create_user_from_dict``, and decode its photo
+
+    :param record: The record (in the format of the signup request)
+    :return: The user row, its auth methods row, its photo (stored by ``insert_users``) and the secrets to hash (the
+        password and the motion pattern)
+    :raises AssertionError: The record is invalid
+    """
+    auth_methods = record.get('auth_methods', None)
+    if not isinstance(auth_methods, dict):
+        raise AssertionError("No auth methods provided")
+    elif not any(auth_methods.values()):
+        raise AssertionError("At least one auth method must be enabled")
+
+    email = str(record.get('email', None)).lower()
+    models.check_valid_email(email)
+
+    password = motion_pattern = photo = None
+    if auth_methods.get('password', None):
+        password = record.get('password', None)
+        models.check_valid_password(password)
+    if auth_methods.get('motion_pattern', None):
+        if record.get('motion_pattern', None) is None:
+            raise AssertionError('Motion pattern not provided')
+        models.check_valid_moves(record['motion_pattern'])
+        # Hashed like ``User.set_motion_pattern``
+        motion_pattern = str(record['motion_pattern'])
+    if auth_methods.get('face_recognition', None):
+        if not record.get('photo', None):
+            raise AssertionError("No photo submitted")
+        try:
+            photo = base64.b64decode(record['photo'], validate=True)
+        except (binascii.Error, TypeError):
+            raise AssertionError("Photo is not valid base64")
+
+    user_id = uuid.uuid4()
+    user_row = {"id": user_id, "email": email, "photo_hash": None, "admin": False}
+    auth_row = {
+        "id": uuid.uuid4(),
+        "user_id": user_id,
+        "password": bool(auth_methods.get('password', None)),
+        "motion_pattern": bool(auth_methods.get('motion_pattern', None)),
+        "face_recognition": bool(auth_methods.get('face_recognition', None)),
+    }
+    return user_row, auth_row, photo, (password, motion_pattern)
+
+
+def hash_secrets(secrets: tuple[str | None, str | None]) -> tuple[str | None, str | None]:
+    """
+    Hash the password and the motion pattern of a user (run in the hashing processes)
+
+    :param secrets: The password and the motion pattern (None if not enabled)
+    :return: Their hashes
+    """
+    return tuple(generate_password_hash(secret).decode('utf-8') if secret is not None else None
+                 for secret in secrets)
+
+
+def insert_users(users: list[tuple[int, dict, dict, bytes | None]], report: dict) -> None:
+    """
+    Store the photos of hashed users, then insert the users and their auth methods in a single transaction
+
+    The users whose email is already taken are added to the report's failures. If a user is created concurrently
+    with the same email, the users are inserted one by one instead.
+
+    :param users: The line number, the user row, the auth methods row and the photo of each user
+    :param report: The report of the import
+    """
+    emails = [user_row["email"] for _, user_row, _, _ in users]
+    taken = set(db.session.execute(db.select(models.User.email).filter(models.User.email.in_(emails))).scalars())
+    new_users = []
+    for line, user_row, auth_row, photo in users:
+        if user_row["email"] in taken:
+            report["failed"].append({"line": line, "email": user_row["email"],
+                                     "error": "Provided email is already in use"})
+        else:
+            if photo is not None:
+                user_row["photo_hash"] = blobs.put_photo(photo)
+            new_users.append((line, user_row, auth_row))
+    if not new_users:
+        return
+
+    try:
+        db.session.execute(db.insert(models.User), [user_row for _, user_row, _ in new_users])
+        db.session.execute(db.insert(models.UserAuthMethods), [auth_row for _, _, auth_row in new_users])
+        db.session.commit()
+        report["created"] += len(new_users)
+        return
+    except IntegrityError:
+        db.session.rollback()
+
+    for line, user_row, auth_row in new_users:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(models.User), [user_row])
+                db.session.execute(db.insert(models.UserAuthMethods), [auth_row])
+            report["created"] += 1
+        except IntegrityError:
+            report["failed"].append({"line": line, "email": user_row["email"],
+                                     "error": "Provided email is already in use"})
+    db.session.commit()
+
+
+def import_users(records: Iterable[tuple[int, dict | None, str | None]], workers: int = constants.IMPORT_WORKERS,
+                 batch_size: int = constants.IMPORT_BATCH_SIZE) -> dict:
+    """
+    Create users in bulk
+
+    :param records: The line number, the record and the error of each user (see ``read_records``), read one batch
+        ahead of the inserts
+    :param workers: The number of hashing processes (0 for one per CPU, 1 to hash in this process)
+    :param batch_size: The number of records validated and inserted together (in a single transaction)
+    :return: The number of created users, and the line, email and error of each user that was not created
+    """
+    report = {"created": 0, "failed": []}
+    records = iter(records)
+    emails = set()
+
+    def validate(chunk):
+        users, secrets = [], []
+        for line, record, error in chunk:
+            try:
+                if error is not None:
+                    raise AssertionError(error)
+                user_row, auth_row, photo, user_secrets = prepare_user(record)
+                if user_row["email"] in emails:
+                    raise AssertionError('Provided email is already in use')
+            except AssertionError as exception_message:
+                email = record.get('email', None) if isinstance(record, dict) else None
+                report["failed"].append({"line": line, "email": email, "error": str(exception_message)})
+                continue
+            emails.add(user_row["email"])
+            users.append((line, user_row, auth_row, photo))
+            secrets.append(user_secrets)
+        return users, secrets
+
+    def insert(users, hashes):
+        for (_, user_row, _, _), (password_hash, motion_pattern_hash) in zip(users, hashes):
+            user_row["pwd"] = password_hash
+            user_row["motion_pattern"] = motion_pattern_hash
+        insert_users(users, report)
+
+    workers = workers or os.cpu_count() or 1
+    executor = None
+    # The validated batch whose secrets are being hashed, and its hashes
+    pending = None
+    try:
+        for chunk in iter(lambda: list(islice(records, batch_size)), []):
+            users, secrets = validate(chunk)
+            if executor is None and workers > 1 and len(secrets) > 1:
+                # Spawned rather than forked, as the app's process can have other threads (e.g. the session reaper)
+                executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            hashes = (executor.map(hash_secrets, secrets, chunksize=HASH_CHUNK_SIZE) if executor is not None
+                      else map(hash_secrets, secrets))
+            if pending is not None:
+                insert(*pending)
+            pending = (users, hashes)
+        if pending is not None:
+            insert(*pending)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    report["failed"].sort(key=lambda failure: failure["line"])
+    return report
+
+
+def import_users_from_file(path: str, file_format: str = None, workers: int = constants.IMPORT_WORKERS,
+                           batch_size: int = constants.IMPORT_BATCH_SIZE) -> dict:
+    """
+    Create the users of an import file
+
+    :param path: The path of the file
+    :param file_format: The format of the file (by default from its extension)
+    :param workers: The number of hashing processes (0 for one per CPU, 1 to hash in this process)
+    :param batch_size: The number of users inserted per transaction
+    :return: The report of the import (see ``import_users``)
+    :raises AssertionError: The format of the file is unknown
+    """
+    file_format = file_format or get_import_format(path)
+    with open(path, newline="", encoding="utf-8") as file:
+        return import_users(read_records(file, file_format), workers, batch_size)
+
+
+###################################################################################
+#                                Background Imports                               #
+###################################################################################
+# Importing thousands of users takes minutes, so the dashboard's imports run in a background thread of the worker
+# that received the file. Their status is written to a file next to the upload, so any worker can report it. The
+# uploaded file is deleted once imported, as it contains the users' passwords.
+
+def get_import_path(import_id: uuid.UUID, extension: str) -> str:
+    """
+    Get the path of a file of an import
+
+    :param import_id: The ID of the import
+    :param extension: The extension of the file (``.json`` for the status)
+    :return: The absolute path of the file
+    """
+    return os.path.join(current_app.instance_path, current_app.config['DATA_FOLDER'], IMPORT_FOLDER,
+                        str(import_id) + extension)
+
+
+def write_import_status(import_id: uuid.UUID, status: dict) -> None:
+    """
+    Write the status of an import (replacing the previous one at once)
+
+    :param import_id: The ID of the import
+    :param status: The status
+    """
+    path = get_import_path(import_id, ".json")
+    temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump(status, file)
+    os.replace(temporary_path, path)
+
+
+def get_import_status(import_id: uuid.UUID) -> dict | None:
+    """
+    Read the status of an import (if it exists)
+
+    :param import_id: The ID of the import
+    :return: The status, with the report of the import once it is done
+    """
+    try:
+        with open(get_import_path(import_id, ".json"), encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def start_import(app: flask.Flask, file, filename: str) -> uuid.UUID:
+    """
+    Save an uploaded import file and import it in a background thread
+
+    :param app: The Flask app
+    :param file: The uploaded file
+    :param filename: The name of the uploaded file (for its format)
+    :return: The ID of the import
+    :raises AssertionError: The format of the file is unknown
+    """
+    file_format = get_import_format(filename)
+    extension = os.path.splitext(filename)[1].lower()
+    import_id = uuid.uuid4()
+    path = get_import_path(import_id, extension)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    file.save(path)
+    write_import_status(import_id, {"status": "running"})
+
+    def run():
+        with app.app_context():
+            try:
+                report = import_users_from_file(path, file_format, app.config['IMPORT_WORKERS'])
+                write_import_status(import_id, {"status": "done", **report})
+                app.logger.info("User import %s: created %d users, %d failed", import_id, report["created"],
+                                len(report["failed"]))
+            except Exception as exception:
+                db.session.rollback()
+                app.logger.exception("User import %s failed", import_id)
+                write_import_status(import_id, {"status": "failed", "error": str(exception)})
+            finally:
+                db.session.remove()
+                os.remove(path)
+
+    threading.Thread(target=run, name=f"user-import-{import_id}", daemon=True).start()
+    return import_id
+
+
+@click.command("import-users")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(sorted(set(IMPORT_FORMATS.values()))),
+              help="Format of the file (by default from its extension).")
+@click.option("--workers", type=int, default=constants.IMPORT_WORKERS, show_default=True,
+              help="Number of hashing processes (0 for one per CPU).")
+@click.option("--batch-size", type=int, default=constants.IMPORT_BATCH_SIZE, show_default=True,
+              help="Number of users inserted per transaction.")
+def import_users_command(path: str, file_format: str, workers: int, batch_size: int):
+    """Create the users of an NDJSON or CSV file."""
+    try:
+        report = import_users_from_file(path, file_format, workers, batch_size)
+    except AssertionError as exception_message:
+        raise click.BadParameter(str(exception_message), param_hint="PATH")
+
+    for failure in report["failed"]:
+        click.echo(f"Line {failure['line']} ({failure['email']}): {failure['error']}", err=True)
+    click.echo(f"Created {report['created']} users, {len(report['failed'])} failed")
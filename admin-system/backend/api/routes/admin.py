@@ -4,7 +4,7 @@ import flask
 from flask import jsonify, request, Blueprint
 
 import constants
-from api import helpers
+from api import helpers, provisioning
 
 admin = Blueprint("admin", __name__, url_prefix="/api/dashboard")
 
@@ -69,7 +69,11 @@ def get_login_session():
 
     Query params:
 
-    - ``count``: The number of sessions to return (optional) - defaults to the number set in ``constants.py``
+    - ``count``: The number of sessions to return (optional) - defaults to the number set in ``constants.py``, or
+      to every session of the range if ``start`` and ``end`` are provided
+    - ``photos``: ``false`` to leave out the login photos (optional) - defaults to ``true``
+    - ``start`` and ``end``: The first and last day (``YYYY-MM-DD``) of the sessions to return, including the
+      archived ones (optional)
 
     :return: The login sessions as a list of dicts or an error message
     """
@@ -80,7 +84,17 @@ def get_login_session():
 
     count = request.args.get('count', constants.DEFAULT_LOGIN_SESSION_LIST_LENGTH)
 
-    out = helpers.get_login_sessions_as_dict(count)
+    with_photos = request.args.get('photos', "true").lower() != "false"
+
+    try:
+        date_range = helpers.parse_date_range(request)
+    except AssertionError as exception_message:
+        return jsonify(msg='Error: {}.'.format(exception_message), success=0), 400
+
+    if date_range is None:
+        out = helpers.get_login_sessions_as_dict(count, with_photos)
+    else:
+        out = helpers.get_login_history_as_dict(*date_range, request.args.get('count', None, type=int), with_photos)
 
     return jsonify(msg="Login sessions retrieved.", success=1, sessions=out), 200
 
@@ -102,6 +116,9 @@ def get_failed_events():
 
     - ``email``: The email of the user to get failed events for (optional)
     - ``session_id``: The session ID of the login session (optional)
+    - ``photos``: ``false`` to leave out the photos (optional) - defaults to ``true``
+    - ``start`` and ``end``: The first and last day (``YYYY-MM-DD``) of the events to return, including the archived
+      ones (optional)
 
     :return: The failed events for the user
     """
@@ -112,6 +129,12 @@ def get_failed_events():
 
     email: str = request.args.get('email', None)
     session_id: str = request.args.get('session_id', None)
+    with_photos = request.args.get('photos', "true").lower() != "false"
+
+    try:
+        date_range = helpers.parse_date_range(request)
+    except AssertionError as exception_message:
+        return jsonify(msg='Error: {}.'.format(exception_message), success=0), 400
 
     user = None
     session = None
@@ -120,11 +143,88 @@ def get_failed_events():
         user = helpers.get_user_from_email(email)
         if user is None:
             return jsonify(msg="Invalid email, please try again.", success=0), 401
-    elif session_id is not None:
+    elif session_id is not None and date_range is None:
         session = helpers.get_login_session_from_id(uuid.UUID(session_id))
         if session is None:
             return jsonify(msg="Invalid session_id, please try again.", success=0), 401
 
-    events = helpers.get_failed_login_events_as_dict(user, session)
+    if date_range is None:
+        events = helpers.get_failed_login_events_as_dict(user, session, with_photos)
+    else:
+        # The session may have been archived already
+        events = helpers.get_failed_login_event_history_as_dict(
+            *date_range, user, uuid.UUID(session_id) if session_id is not None and user is None else None,
+            with_photos)
 
     return jsonify(msg="Failed events retrieved.", success=1, events=events), 200
+
+
+@admin.route("/users/import", methods=["POST"], strict_slashes=False)
+def import_users():
+    """
+    Route for creating users in bulk from an NDJSON or CSV file (see ``provisioning.py`` for the formats)
+
+    The users are created in the background, the status of the import is returned by ``/users/import/status``.
+
+    Form body:
+
+    - ``request``::
+
+        {
+            "auth_session_id": "uuid",
+        }
+
+    - ``file``: The NDJSON (``.ndjson`` or ``.jsonl``) or CSV (``.csv``) file
+
+    :return: The ID of the import or an error message
+    """
+    # Perform standard validation on the request
+    validate_out = helpers.input_validate_auth(request, "multipart/form-data", admin_check=True)
+    if isinstance(validate_out[0], flask.Response):
+        return validate_out
+
+    # Check if a file was submitted
+    file = request.files.get('file', None)
+
+    if file is None:
+        return jsonify(msg="No file submitted, please try again.", success=0), 400
+
+    try:
+        import_id = provisioning.start_import(flask.current_app._get_current_object(), file, file.filename)
+    except AssertionError as exception_message:
+        return jsonify(msg='Error: {}.'.format(exception_message), success=0), 400
+
+    return jsonify(msg="User import started.", success=1, import_id=import_id), 202
+
+
+@admin.route("/users/import/status", methods=["POST"], strict_slashes=False)
+def import_users_status():
+    """
+    Route for getting the status of a bulk user import
+
+    JSON body::
+
+        {
+            "auth_session_id": "uuid",
+            "import_id": "uuid",
+        }
+
+    :return: The status of the import (``running``, ``done`` with the number of created users and the failures, or
+             ``failed``) or an error message
+    """
+    # Perform standard validation on the request
+    validate_out = helpers.input_validate_auth(request, admin_check=True)
+    if isinstance(validate_out[0], flask.Response):
+        return validate_out
+    else:
+        request_data: dict = validate_out[2]
+
+    try:
+        status = provisioning.get_import_status(uuid.UUID(str(request_data.get('import_id', None))))
+    except ValueError:
+        status = None
+
+    if status is None:
+        return jsonify(msg="Invalid import_id, please try again.", success=0), 400
+
+    return jsonify(msg="Import status retrieved.", success=1, **status), 200
@@ -207,13 +207,17 @@ def login_motion_pattern():
         # If any of the moves are invalid, return an error
         return jsonify(msg='Error: {}.'.format(exception_message), success=0), 400
     session = helpers.retry_motion_pattern(session, False)
+    # Committed before waiting, as the Pico validates the pattern in its own request, which looks the session up by
+    # its pico_id (this is the only route committing twice, the rest of the request is committed by the app)
+    db.session.commit()
 
     # Repeatedly check the session for completion of the motion pattern or a retry
     count = 0
     poll_seconds = 3
 
     while not session.motion_pattern_completed and not session.motion_pattern_retry:
-        db.session.expire_all()
+        # Ends the read transaction, so the Pico's changes are seen and the connection is not held while waiting
+        db.session.rollback()
         session = helpers.get_login_session_from_id(uuid.UUID(request_data.get('session_id', None)))
         count += 1
         if count > constants.MOTION_PATTERN_TIMEOUT_SECONDS / poll_seconds:
@@ -277,7 +281,7 @@ def login_motion_pattern_validate():
 
     # Check if the base pattern and added sequence are correct
     if (not user.check_motion_pattern(str(split_pattern[0]))
-            or not session.motion_added_sequence.strip('][').replace('"', '').split(', ') == split_pattern[1]):
+            or session.motion_added_sequence != models.encode_moves(split_pattern[1])):
         helpers.retry_motion_pattern(session, True)
         if not user.check_motion_pattern(str(split_pattern[0])):
             helpers.create_failed_login_event(session, text="Incorrect base motion pattern entered.")
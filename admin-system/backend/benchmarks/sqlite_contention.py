@@ -0,0 +1,185 @@
+"""
+Benchmark of the SQLite database under concurrent writers
+
+Every writer process plays the login flow (insert a login session, then add a pico ID and motions to it, one commit
+each) while the poller processes look the sessions up by pico ID, like the Pico polling the motion pattern routes. It
+is run once with SQLite's default settings and once with the settings of ``api/database.py``, each on a new database.
+
+Run from the ``admin-system/backend`` folder::
+
+    python -m benchmarks.sqlite_contention --writers 4 --pollers 2 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+import sqlalchemy
+from sqlalchemy.exc import OperationalError
+
+import constants
+from api import models
+from api.app import db
+from api.database import configure_engine
+
+MODES = ("default", "tuned")
+# How long after the end of a run the processes have to report their results
+RESULT_TIMEOUT_SECONDS = 30
+
+
+def create_engine(path: str, mode: str) -> sqlalchemy.Engine:
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    if mode == "tuned":
+        configure_engine(engine)
+    return engine
+
+
+def writer(path: str, mode: str, start: float, seconds: float, results) -> None:
+    """
+    Insert login sessions and add a pico ID to each of them until the time is up
+    """
+    engine = create_engine(path, mode)
+    login_session = models.LoginSession.__table__
+    user_id = uuid.uuid4()
+    latencies, locked = [], 0
+
+    time.sleep(max(0.0, start - time.time()))
+    while time.time() < start + seconds:
+        session_id = uuid.uuid4()
+        statements = [
+            sqlalchemy.insert(login_session).values(session_id=session_id, id=user_id, date=datetime.now(),
+                                                    auth_methods=int(constants.AuthStage.PASSWORD
+                                                                     | constants.AuthStage.MOTION_PATTERN),
+                                                    auth_completed=0, motion_pattern_completed=False,
+                                                    motion_pattern_retry=False),
+            sqlalchemy.update(login_session).where(login_session.c.session_id == session_id)
+            .values(pico_id=str(session_id), motion_added_sequence=models.encode_moves(["UP", "DOWN", "LEFT"])),
+        ]
+        for statement in statements:
+            begin = time.perf_counter()
+            try:
+                with engine.begin() as connection:
+                    connection.execute(statement)
+            except OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                locked += 1
+                break
+            latencies.append(time.perf_counter() - begin)
+    results.put(("writer", latencies, locked))
+
+
+def poller(path: str, mode: str, start: float, seconds: float, results) -> None:
+    """
+    Look up login sessions by pico ID until the time is up
+    """
+    engine = create_engine(path, mode)
+    login_session = models.LoginSession.__table__
+    latencies, locked = [], 0
+
+    time.sleep(max(0.0, start - time.time()))
+    with engine.connect() as connection:
+        while time.time() < start + seconds:
+            begin = time.perf_counter()
+            try:
+                connection.execute(sqlalchemy.select(login_session.c.session_id)
+                                   .where(login_session.c.pico_id == str(uuid.uuid4()))).first()
+                connection.rollback()
+            except OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                connection.rollback()
+                locked += 1
+                continue
+            latencies.append(time.perf_counter() - begin)
+            time.sleep(0.01)
+    results.put(("poller", latencies, locked))
+
+
+def percentile(values: list[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[percent - 1]
+
+
+def run(mode: str, folder: str, writers: int, pollers: int, seconds: float) -> dict:
+    """
+    Run the writers and pollers against a new database
+
+    :return: The throughput, latencies and number of "database is locked" errors of the writes and reads
+    :raises RuntimeError: If a process crashed or did not report its results in time
+    """
+    path = os.path.join(folder, f"{mode}.db")
+    engine = create_engine(path, mode)
+    db.metadata.create_all(engine)
+    engine.dispose()
+
+    results = multiprocessing.Queue()
+    start = time.time() + 1
+    processes = [multiprocessing.Process(target=writer, args=(path, mode, start, seconds, results))
+                 for _ in range(writers)]
+    processes += [multiprocessing.Process(target=poller, args=(path, mode, start, seconds, results))
+                  for _ in range(pollers)]
+    for process in processes:
+        process.start()
+
+    collected = []
+    deadline = start + seconds + RESULT_TIMEOUT_SECONDS
+    while len(collected) < len(processes) and time.time() < deadline:
+        try:
+            collected.append(results.get(timeout=1))
+        except queue.Empty:
+            # A process that crashed never reports, stop waiting once they have all exited
+            if all(process.exitcode is not None for process in processes):
+                break
+    for process in processes:
+        process.join(timeout=1)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+    exit_codes = [process.exitcode for process in processes]
+    if len(collected) < len(processes) or any(exit_codes):
+        raise RuntimeError(f"{len(processes) - len(collected)} of the {len(processes)} benchmark processes failed "
+                           f"(exit codes: {exit_codes})")
+
+    report = {"mode": mode}
+    for role in ("writer", "poller"):
+        latencies = [latency for kind, values, _ in collected if kind == role for latency in values]
+        report[role] = {
+            "per_second": round(len(latencies) / seconds, 1),
+            "p50_ms": round(1000 * percentile(latencies, 50), 2),
+            "p99_ms": round(1000 * percentile(latencies, 99), 2),
+            "max_ms": round(1000 * max(latencies, default=0.0), 2),
+            "locked": sum(locked for kind, _, locked in collected if kind == role),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SQLite database under concurrent writers.")
+    parser.add_argument("--writers", type=int, default=4, help="number of writer processes (default: 4, like gunicorn)")
+    parser.add_argument("--pollers", type=int, default=2, help="number of processes polling the login sessions")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of each run")
+    parser.add_argument("--mode", choices=MODES, nargs="+", default=list(MODES), help="settings to benchmark")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="sqlite-contention-")
+    try:
+        for mode in args.mode:
+            report = run(mode, folder, args.writers, args.pollers, args.seconds)
+            for role in ("writer", "poller"):
+                stats = report[role]
+                print(f"{mode:>8} {role:>6}s: {stats['per_second']:>8.1f}/s, p50 {stats['p50_ms']:>7.2f} ms, "
+                      f"p99 {stats['p99_ms']:>8.2f} ms, max {stats['max_ms']:>8.2f} ms, locked {stats['locked']}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
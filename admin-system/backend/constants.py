@@ -1,9 +1,32 @@
-from enum import Enum
+from enum import Enum, IntFlag
 
 LOGIN_SESSION_EXPIRY_MINUTES = 5
 AUTH_SESSION_EXPIRY_MINUTES = 60
+# Login sessions (the login history of the admin dashboard) are moved from the database to the archive after this many
+# days
+LOGIN_SESSION_ARCHIVE_DAYS = 30
+# Longest range of days of login history the admin dashboard can ask for at once
+MAX_HISTORY_RANGE_DAYS = 366
+# The session reaper runs every REAPER_INTERVAL_SECONDS in each worker (0 to disable it), deleting REAPER_BATCH_SIZE
+# rows per transaction with a pause of REAPER_PAUSE_SECONDS between the transactions
+REAPER_INTERVAL_SECONDS = 600
+REAPER_BATCH_SIZE = 100
+REAPER_PAUSE_SECONDS = 0.05
 MOTION_PATTERN_TIMEOUT_SECONDS = 60
 DEFAULT_LOGIN_SESSION_LIST_LENGTH = 20
+# Attempts at inserting a row with a new random ID before giving up on unique constraint failures
+INSERT_ATTEMPTS = 3
+# Bulk user imports insert IMPORT_BATCH_SIZE users per transaction, and hash their passwords and motion patterns in
+# IMPORT_WORKERS processes (0 for one per CPU)
+IMPORT_BATCH_SIZE = 500
+IMPORT_WORKERS = 0
+# Database used when the DATABASE_URL environment variable is not set (relative to the instance folder)
+DEFAULT_DATABASE_URL = "sqlite:///database.db"
+# Connection pool of each worker process, overridden by the DATABASE_POOL_* environment variables
+DATABASE_POOL_SIZE = 5
+DATABASE_MAX_OVERFLOW = 10
+DATABASE_POOL_RECYCLE_SECONDS = 1800
+DATABASE_POOL_PRE_PING = True
 
 class ValidMoves(Enum):
     UP = "UP"
@@ -13,3 +36,28 @@ class ValidMoves(Enum):
     FORWARD = "FORWARD"
     BACKWARD = "BACKWARD"
     FLIP = "FLIP"
+
+
+# The character stored for each move in the added motion sequences of the login sessions (never change a code, the
+# stored sequences would change meaning)
+MOVE_CODES = {
+    ValidMoves.UP.value: "U",
+    ValidMoves.DOWN.value: "D",
+    ValidMoves.LEFT.value: "L",
+    ValidMoves.RIGHT.value: "R",
+    ValidMoves.FORWARD.value: "F",
+    ValidMoves.BACKWARD.value: "B",
+    ValidMoves.FLIP.value: "X",
+}
+
+
+# The stages of a login, in the order they are completed. The login sessions store them as bitmasks (never change a
+# value), and the API uses their names in lower case
+class AuthStage(IntFlag):
+    PASSWORD = 1
+    MOTION_PATTERN = 2
+    FACE_RECOGNITION = 4
+
+
+# The auth stages by their API name
+AUTH_STAGES_BY_NAME = {stage.name.lower(): stage for stage in AuthStage}
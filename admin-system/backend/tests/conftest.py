@@ -1,7 +1,10 @@
 import os
 import shutil
+from collections import defaultdict
 
+import flask
 import pytest
+from sqlalchemy import event
 from werkzeug.datastructures import FileStorage
 
 import api.helpers
@@ -9,6 +12,14 @@ import api.models
 from api.app import create_app, db
 from constants import ValidMoves
 
+# Database commits of every request made by the tests, by route (reported at the end of the run)
+ROUTE_COMMITS: dict[str, list[int]] = defaultdict(list)
+# The routes allowed to commit more than once per request
+ROUTE_COMMIT_LIMITS = {
+    # The pico handshake is committed before waiting for the Pico
+    "POST /api/login/motion_pattern/initialize": 2,
+}
+
 
 @pytest.fixture(scope='session', autouse=True)
 def test_client():
@@ -17,20 +28,63 @@ def test_client():
     """
     app = create_app({
         'TESTING': True,
-        'SQLALCHEMY_DATABASE_URI': "sqlite:///test-database.db",
+        'SQLALCHEMY_DATABASE_URI': os.getenv("TEST_DATABASE_URL", "sqlite:///test-database.db"),
         'SQLALCHEMY_TRACK_MODIFICATIONS': False,
         'DATA_FOLDER': "test-data",
     })
 
     # Establish an application context
     with app.app_context():
+        count_route_commits(app)
         # Create a test client using the Flask application configured for testing
         yield app.test_client()
-        db.drop_all()
+        # Ends the session's transaction first (the helpers leave the commit to the caller)
         db.session.remove()
+        db.drop_all()
         shutil.rmtree(os.path.join(app.instance_path, app.config['DATA_FOLDER']), ignore_errors=True)
 
 
+def count_route_commits(app: flask.Flask) -> None:
+    """
+    Count the database commits of each request, in ``ROUTE_COMMITS``
+    """
+    def count_commit(connection):
+        if flask.has_request_context():
+            flask.request.environ["tests.commits"] = flask.request.environ.get("tests.commits", 0) + 1
+
+    def record_request(sender, response, **extra):
+        route = flask.request.url_rule.rule if flask.request.url_rule else flask.request.path
+        ROUTE_COMMITS[f"{flask.request.method} {route}"].append(flask.request.environ.get("tests.commits", 0))
+
+    event.listen(db.engine, "commit", count_commit)
+    flask.request_finished.connect(record_request, app, weak=False)
+
+
+@pytest.fixture(autouse=True)
+def one_commit_per_request():
+    """
+    Checks that every request made by a test committed at most once (or its limit in ``ROUTE_COMMIT_LIMITS``)
+    """
+    requests_before = {route: len(commits) for route, commits in ROUTE_COMMITS.items()}
+    yield
+    for route, commits in ROUTE_COMMITS.items():
+        new_commits = commits[requests_before.get(route, 0):]
+        limit = ROUTE_COMMIT_LIMITS.get(route, 1)
+        assert all(count <= limit for count in new_commits), f"{route} committed {max(new_commits)} times"
+
+
+def pytest_terminal_summary(terminalreporter):
+    """
+    Reports the number of commits of the requests of each route
+    """
+    if not ROUTE_COMMITS:
+        return
+    terminalreporter.section("commits per request")
+    for route, commits in sorted(ROUTE_COMMITS.items()):
+        terminalreporter.write_line(f"{route}: {len(commits)} requests, {sum(commits)} commits, at most "
+                                    f"{max(commits)} per request")
+
+
 @pytest.fixture(scope='session', autouse=True)
 def list_of_users() -> list[list]:
     """
@@ -72,6 +126,7 @@ def users(list_of_users) -> list[api.models.User]:
         with open(path, 'rb') as photo:
             file = FileStorage(photo, content_type="image/png", filename=request_data[6])
             out.append(api.helpers.create_user_from_dict(data, file))
+    db.session.commit()
 
     return out
 
@@ -103,5 +158,6 @@ def files(users, list_of_files) -> list[api.models.UserFiles]:
         with open(path, 'rb') as file:
             file_storage = FileStorage(file, content_type="text/plain", filename=request_data[1])
             out.append(api.helpers.add_user_file(users[request_data[0]], request_data[2], file_storage))
+    db.session.commit()
 
     return out
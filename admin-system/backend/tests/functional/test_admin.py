@@ -1,3 +1,6 @@
+import io
+import json
+import time
 import uuid
 
 import pytest
@@ -36,10 +39,11 @@ def test_dashboard_login(test_client, email, password, admin, session, keys, exp
 
 @pytest.mark.database
 @pytest.mark.get_request
-@pytest.mark.parametrize("email, session, expected_result", [
-    ("nevlezayubyet@emaill.app", True, 200),  # Valid user
+@pytest.mark.parametrize("email, session, photos, expected_result", [
+    ("nevlezayubyet@emaill.app", True, None, 200),  # Valid user
+    ("nevlezayubyet@emaill.app", True, "false", 200),  # Without the photos
 ])
-def test_get_login_events(test_client, email, session, expected_result):
+def test_get_login_events(test_client, email, session, photos, expected_result):
     """
     Tests the get login events endpoint
     """
@@ -51,20 +55,24 @@ def test_get_login_events(test_client, email, session, expected_result):
     else:
         data = {}
 
-    response = test_client.post("/api/dashboard/login_sessions", json=data)
+    response = test_client.post("/api/dashboard/login_sessions", query_string={"photos": photos}, json=data)
     assert response.status_code == expected_result
+    if expected_result == 200:
+        assert all(("photo" in login_session) == (photos is None) for login_session in response.json["sessions"])
 
 
 @pytest.mark.database
 @pytest.mark.get_request
-@pytest.mark.parametrize("admin_email, email, session_id, expected_result", [
-    ("nevlezayubyet@emaill.app", None, None, 200),  # All events
-    ("nevlezayubyet@emaill.app", "nevlezayubyet@emaill.app", None, 200),  # Valid email
-    ("nevlezayubyet@emaill.app", "noemail@email.com", None, 401),  # Invalid email
-    ("nevlezayubyet@emaill.app", None, uuid.uuid5(namespace=uuid.uuid4(), name="no_session"), 401),  # Invalid session
-    (None, None, None, 400),  # No admin
+@pytest.mark.parametrize("admin_email, email, session_id, photos, expected_result", [
+    ("nevlezayubyet@emaill.app", None, None, None, 200),  # All events
+    ("nevlezayubyet@emaill.app", None, None, "false", 200),  # All events, without the photos
+    ("nevlezayubyet@emaill.app", "nevlezayubyet@emaill.app", None, None, 200),  # Valid email
+    ("nevlezayubyet@emaill.app", "noemail@email.com", None, None, 401),  # Invalid email
+    # Invalid session
+    ("nevlezayubyet@emaill.app", None, uuid.uuid5(namespace=uuid.uuid4(), name="no_session"), None, 401),
+    (None, None, None, None, 400),  # No admin
 ])
-def test_get_failed_events(test_client, admin_email, email, session_id, expected_result):
+def test_get_failed_events(test_client, admin_email, email, session_id, photos, expected_result):
     """
     Tests the get failed events endpoint
     """
@@ -79,7 +87,70 @@ def test_get_failed_events(test_client, admin_email, email, session_id, expected
     data = {
         "email": email,
         "session_id": session_id,
+        "photos": photos,
     }
 
     response = test_client.post("/api/dashboard/failed_events", query_string=data, json=json_data)
     assert response.status_code == expected_result
+    if expected_result == 200:
+        assert all(("photo" in event) == (photos is None) for event in response.json["events"])
+
+
+@pytest.mark.database
+@pytest.mark.get_request
+@pytest.mark.parametrize("endpoint, start, end, expected_result", [
+    ("/api/dashboard/login_sessions", "2024-01-01", "2024-01-31", 200),  # Valid range
+    ("/api/dashboard/failed_events", "2024-01-01", "2024-01-31", 200),  # Valid range
+    ("/api/dashboard/login_sessions", "2024-01-01", None, 400),  # Missing end
+    ("/api/dashboard/login_sessions", "2024-01-31", "2024-01-01", 400),  # Start after end
+    ("/api/dashboard/failed_events", "01/01/2024", "2024-01-31", 400),  # Invalid date
+    ("/api/dashboard/failed_events", "2020-01-01", "2024-01-31", 400),  # Range too long
+])
+def test_get_history(test_client, endpoint, start, end, expected_result):
+    """
+    Tests the login sessions and failed events endpoints with a range of days
+    """
+    session = api.helpers.create_auth_session(api.helpers.get_user_from_email("nevlezayubyet@emaill.app"))
+
+    response = test_client.post(endpoint, query_string={"start": start, "end": end},
+                                json={"auth_session_id": str(session.session_id)})
+    assert response.status_code == expected_result
+
+
+@pytest.mark.database
+@pytest.mark.post_request
+@pytest.mark.parametrize("admin_email, filename, content, expected_result", [
+    ("nevlezayubyet@emaill.app", "users.csv",
+     "email,password,auth_methods\ndashboard@import.com,Password1,password\nnot an email,Password1,password\n", 202),
+    ("nevlezayubyet@emaill.app", "users.xlsx", "", 400),  # Unknown format
+    ("nevlezayubyet@emaill.app", None, None, 400),  # No file
+    ("ad1723@xgod.cf", "users.csv", "email\n", 401),  # Not an admin
+])
+def test_import_users(test_client, admin_email, filename, content, expected_result):
+    """
+    Tests importing users from the dashboard, and getting the status of the import
+    """
+    session = api.helpers.create_auth_session(api.helpers.get_user_from_email(admin_email))
+    data = {"request": json.dumps({"auth_session_id": str(session.session_id)})}
+    if filename is not None:
+        data["file"] = (io.BytesIO(content.encode("utf-8")), filename)
+
+    response = test_client.post("/api/dashboard/users/import", content_type='multipart/form-data', data=data)
+    assert response.status_code == expected_result
+    if expected_result != 202:
+        return
+
+    json_data = {"auth_session_id": str(session.session_id), "import_id": response.json["import_id"]}
+    for _ in range(100):
+        status = test_client.post("/api/dashboard/users/import/status", json=json_data).json
+        if status["status"] != "running":
+            break
+        time.sleep(0.1)
+    assert status["status"] == "done"
+    assert status["created"] == 1
+    assert [failure["line"] for failure in status["failed"]] == [3]
+    assert api.helpers.get_user_from_email("dashboard@import.com").check_password("Password1")
+
+    json_data["import_id"] = str(uuid.uuid4())
+    response = test_client.post("/api/dashboard/users/import/status", json=json_data)
+    assert response.status_code == 400
@@ -39,6 +39,8 @@ def test_server_error(test_client):
     "/api/dashboard/login",
     "/api/dashboard/login_sessions",
     "/api/dashboard/failed_events",
+    "/api/dashboard/users/import",
+    "/api/dashboard/users/import/status",
 ])
 def test_not_json(test_client, endpoint):
     """
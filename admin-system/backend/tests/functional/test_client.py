@@ -2,7 +2,9 @@ import datetime
 import io
 import json
 import os
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
 
 import pytest
@@ -10,6 +12,7 @@ from werkzeug.datastructures import FileStorage
 
 import api.helpers
 import constants
+from api.app import db
 from constants import ValidMoves
 
 
@@ -213,6 +216,46 @@ def test_user_login_motion_pattern_pico(test_client, seed, email, key, motion_pa
     assert response.status_code == expected_result
 
 
+@pytest.mark.database
+@pytest.mark.post_request
+@pytest.mark.parametrize("motion_added, expected_result", [
+    ([ValidMoves.LEFT.value, ValidMoves.RIGHT.value], 200),  # Valid pattern
+    ([ValidMoves.DOWN.value], 401),  # Wrong added sequence
+])
+def test_user_login_motion_pattern_concurrent(monkeypatch, test_client, motion_added, expected_result):
+    """
+    Tests the motion pattern login with the Pico validating the pattern while the initialization request waits for it
+    """
+    monkeypatch.setattr(constants, "MOTION_PATTERN_TIMEOUT_SECONDS", 60)
+    pico_id = str(uuid.uuid4())
+    user = api.helpers.get_user_from_email("only@motion.com")
+    session = api.helpers.create_login_session(user)
+    db.session.commit()
+
+    def pico():
+        # The Pico retries until the initialization has saved its pico_id (the request runs in its own app context)
+        for _ in range(50):
+            response = test_client.post("/api/login/motion_pattern/validate", json={
+                "pico_id": pico_id,
+                "data": [ValidMoves.UP.value, ValidMoves.LEFT.value, ValidMoves.RIGHT.value],
+            })
+            if response.status_code != 400:
+                return response
+            time.sleep(0.1)
+        return response
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pico_response = executor.submit(pico)
+        response = test_client.post("/api/login/motion_pattern/initialize", json={
+            "session_id": str(session.session_id),
+            "pico_id": pico_id,
+            "data": motion_added,
+        })
+
+    assert pico_response.result().status_code == expected_result
+    assert response.status_code == expected_result
+
+
 @pytest.mark.database
 @pytest.mark.post_request
 @pytest.mark.parametrize("email, image, model_output, expected_result", [
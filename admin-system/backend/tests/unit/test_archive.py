@@ -0,0 +1,58 @@
+import zlib
+from datetime import date
+from unittest.mock import patch
+
+from api import archive
+
+DAY = date(2023, 3, 14)
+
+
+def test_append_and_read(test_client):
+    """
+    Tests that the records appended to a segment are read back, the last record of each ID winning
+    """
+    with test_client.application.app_context():
+        archive.append_records(DAY, [{"id": "a", "value": 1}, {"id": "b", "value": 2}])
+        archive.append_records(DAY, [{"id": "a", "value": 3}])
+        archive.append_records(DAY, [])
+
+        assert archive.get_segment_path(DAY).endswith("2023/2023-03-14" + archive.SEGMENT_EXTENSION)
+        assert archive.read_records(DAY) == [{"id": "b", "value": 2}, {"id": "a", "value": 3}]
+        assert archive.read_records(date(2023, 3, 15)) == []
+        assert archive.read_range(date(2023, 3, 13), date(2023, 3, 15)) == archive.read_records(DAY)
+
+
+def test_torn_frame(test_client):
+    """
+    Tests that a frame cut short is ignored, and cut off before the next frame is appended
+    """
+    day = date(2023, 3, 16)
+    with test_client.application.app_context():
+        archive.append_records(day, [{"id": "a"}])
+        with open(archive.get_segment_path(day), "ab") as file:
+            file.write(archive.FRAME_HEADER.pack(100) + b"cut short")
+        assert archive.read_records(day) == [{"id": "a"}]
+
+        archive.append_records(day, [{"id": "b"}])
+        assert archive.read_records(day) == [{"id": "a"}, {"id": "b"}]
+
+        # Complete, but with data that is not a frame
+        with open(archive.get_segment_path(day), "ab") as file:
+            file.write(archive.FRAME_HEADER.pack(9) + b"cut short")
+        archive.append_records(day, [{"id": "c"}])
+        assert archive.read_records(day) == [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+
+
+def test_append_reads_last_frame(test_client):
+    """
+    Tests that appending to a segment only decompresses its last frame
+    """
+    day = date(2023, 3, 17)
+    with test_client.application.app_context():
+        for index in range(5):
+            archive.append_records(day, [{"id": str(index)}])
+
+        with patch("api.archive.zlib.decompress", wraps=zlib.decompress) as decompress:
+            archive.append_records(day, [{"id": "last"}])
+        assert decompress.call_count == 1
+        assert [record["id"] for record in archive.read_records(day)] == ["0", "1", "2", "3", "4", "last"]
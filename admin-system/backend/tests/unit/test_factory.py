@@ -1,4 +1,8 @@
-from api.app import create_app
+import pytest
+from sqlalchemy import text
+
+from api.app import create_app, db
+from api.database import SQLITE_PRAGMAS
 
 
 def test_config():
@@ -12,3 +16,15 @@ def test_config():
         'SQLALCHEMY_TRACK_MODIFICATIONS': False,
         'DATA_FOLDER': "no-data",
     }).testing
+
+
+def test_sqlite_pragmas(test_client):
+    """
+    Test that the SQLite connections are set up for concurrent access
+    """
+    if db.engine.dialect.name != "sqlite":
+        pytest.skip("The test database is not SQLite")
+    assert db.session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+    assert db.session.execute(text("PRAGMA busy_timeout")).scalar() == SQLITE_PRAGMAS["busy_timeout"]
+    # NORMAL
+    assert db.session.execute(text("PRAGMA synchronous")).scalar() == 1
@@ -4,8 +4,11 @@ import uuid
 from unittest.mock import patch
 
 import pytest
+import sqlalchemy
 from werkzeug.datastructures import FileStorage
 
+import api.app
+import api.blobs
 import api.helpers
 import api.models
 from constants import ValidMoves
@@ -132,6 +135,58 @@ def test_login_session_create_fetch(test_client, users, user, expected_result):
     assert api.helpers.get_login_session_from_id(session.session_id) == session
 
 
+@pytest.mark.database
+def test_insert_retries_id_collision(test_client, users):
+    """
+    Tests that inserting a row whose random ID is already taken is retried with a new ID
+    """
+    existing = api.helpers.create_login_session(users[0])
+    existing_id = existing.session_id
+    api.app.db.session.expunge(existing)
+
+    new_id = uuid.uuid4()
+    with patch("uuid.uuid4", side_effect=[existing_id, new_id]):
+        session = api.helpers.create_login_session(users[0])
+
+    assert session.session_id == new_id
+    assert api.helpers.get_login_session_from_id(existing_id) is not None
+    assert api.helpers.get_login_session_from_id(new_id) == session
+
+
+@pytest.mark.database
+def test_add_duplicate_pico_id(test_client, users):
+    """
+    Tests that adding a pico ID already used by another login session fails
+    """
+    pico_id = str(uuid.uuid4())
+    request_data = {"pico_id": pico_id, "data": [ValidMoves.UP.value]}
+    api.helpers.add_pico_to_session(api.helpers.create_login_session(users[0]), request_data)
+
+    with pytest.raises(AssertionError):
+        api.helpers.add_pico_to_session(api.helpers.create_login_session(users[1]), request_data)
+
+
+@pytest.mark.database
+def test_insert_conflict_keeps_transaction(test_client, users):
+    """
+    Tests that a failed insert only rolls back its own rows, and that the helpers leave the commit to the caller
+    """
+    api.app.db.session.commit()
+    session_id = api.helpers.create_login_session(users[0]).session_id
+
+    data = {
+        "email": users[0].email,
+        "password": "Valid53flksj",
+        "auth_methods": {"password": True, "motion_pattern": False, "face_recognition": False},
+    }
+    with pytest.raises(AssertionError):
+        api.helpers.create_user_from_dict(data, None)
+    assert api.helpers.get_login_session_from_id(session_id) is not None
+
+    api.app.db.session.rollback()
+    assert api.helpers.get_login_session_from_id(session_id) is None
+
+
 @pytest.mark.database
 def test_fetch_login_sessions(test_client, users):
     """
@@ -149,6 +204,26 @@ def test_fetch_login_sessions(test_client, users):
     assert len(sessions) == 2
 
 
+@pytest.mark.database
+def test_fetch_without_photos(test_client, users):
+    """
+    Tests that the photo references are only loaded by the list queries when asked for
+    """
+    api.app.db.session.expire_all()
+    for login_session in api.helpers.get_login_sessions(5):
+        assert "login_photo_hash" in sqlalchemy.inspect(login_session).unloaded
+    for event in api.helpers.get_failed_login_events():
+        assert "photo_hash" in sqlalchemy.inspect(event).unloaded
+
+    for login_session in api.helpers.get_login_sessions(5, with_photos=True):
+        assert "login_photo_hash" not in sqlalchemy.inspect(login_session).unloaded
+    for event in api.helpers.get_failed_login_events(with_photos=True):
+        assert "photo_hash" not in sqlalchemy.inspect(event).unloaded
+
+    assert all("photo" not in session for session in api.helpers.get_login_sessions_as_dict(5, with_photos=False))
+    assert all("photo" in session for session in api.helpers.get_login_sessions_as_dict(5))
+
+
 @pytest.mark.database
 @pytest.mark.parametrize("user, expected_result", [
     ([0, uuid.uuid5(uuid.uuid4(), "&M8n;24h'=U,%<QS"), [ValidMoves.LEFT.value, ValidMoves.RIGHT.value,
@@ -246,6 +321,28 @@ def test_save_face_recognition_photo(test_client, users):
         assert session.login_photo == photo.read()
 
 
+@pytest.mark.database
+def test_photo_store(test_client, users):
+    """
+    Tests that photos are stored once, referenced by hash, and removed once no row references them
+    """
+    user = users[0]
+    session = api.helpers.create_login_session(user)
+    with open(os.path.join(os.curdir, "tests", "data", "user1.png"), 'rb') as photo:
+        data = photo.read()
+
+    # The same photo is only stored once
+    api.helpers.save_face_recognition_photo(session, data)
+    assert session.login_photo_hash == user.photo_hash == api.blobs.put_photo(data)
+    assert os.path.exists(api.blobs.get_photo_path(session.login_photo_hash))
+
+    unreferenced = api.blobs.put_photo(b"unreferenced photo")
+    assert api.helpers.remove_unreferenced_photos() == 0  # Too recent
+    assert api.helpers.remove_unreferenced_photos(grace_seconds=0) == 1
+    assert not os.path.exists(api.blobs.get_photo_path(unreferenced))
+    assert session.login_photo == data
+
+
 @pytest.mark.database
 @pytest.mark.parametrize("user, expected_result", [
     (0, ["password", "motion_pattern", "face_recognition"]),
@@ -1,5 +1,9 @@
 import os
 
+import torch
+from flask import current_app
+
+from api import machine_learning_eval
 from api.machine_learning_eval import evaluate_images
 
 
@@ -14,3 +18,21 @@ def test_machine_learning_eval():
 
     # Check the result
     assert isinstance(result, bool)
+
+
+def test_load_smaller_model(tmp_path):
+    """Test that a model with a smaller architecture can be loaded from its state dict alone."""
+    path = os.path.join(tmp_path, "model.pth")
+    torch.save(machine_learning_eval.SiameseNetwork((16, 32, 32, 64), 512).state_dict(), path)
+
+    try:
+        model = machine_learning_eval.load_model(path)
+        assert model.feature_vector.in_features == 64 * machine_learning_eval.EMBEDDING_AREA
+        assert model.feature_vector.out_features == 512
+        assert machine_learning_eval.model is model
+
+        with open(os.path.abspath(os.path.join(os.curdir, "tests", "data", "user1.png")), 'rb') as f:
+            assert isinstance(machine_learning_eval.evaluate_images(f.read(), f), bool)
+    finally:
+        # Restore the deployed model for the other tests
+        machine_learning_eval.load_model(os.path.join(current_app.instance_path, "model.pth"))
@@ -0,0 +1,77 @@
+import base64
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import api.blobs
+import api.helpers
+import constants
+from api import maintenance
+from api.app import db
+
+
+@pytest.mark.database
+def test_reap_expired_sessions(test_client, users):
+    """
+    Tests that only the expired auth sessions are deleted, and that only the old login sessions are archived
+    """
+    # Start without the expired sessions of the other tests
+    maintenance.reap_expired_sessions(pause_seconds=0)
+
+    now = datetime.now()
+    expired_auth = api.helpers.create_auth_session(users[0])
+    valid_auth = api.helpers.create_auth_session(users[0])
+    expired_auth.date = now - timedelta(minutes=constants.AUTH_SESSION_EXPIRY_MINUTES + 1)
+
+    old_session = api.helpers.create_login_session(users[1])
+    expired_session = api.helpers.create_login_session(users[1])
+    old_session.date = now - timedelta(days=constants.LOGIN_SESSION_ARCHIVE_DAYS + 1)
+    expired_session.date = now - timedelta(minutes=constants.LOGIN_SESSION_EXPIRY_MINUTES + 1)
+    photo = os.urandom(1024)
+    api.helpers.save_face_recognition_photo(old_session, photo)
+    for _ in range(3):
+        event = api.helpers.create_failed_login_event(old_session, text="Face recognition match failed.", photo=photo)
+        event.date = old_session.date
+    db.session.commit()
+    old_session_id, expired_auth_id, photo_path = (old_session.session_id, expired_auth.session_id,
+                                                   api.blobs.get_photo_path(old_session.login_photo_hash))
+    db.session.expunge(old_session)
+    db.session.expunge(expired_auth)
+
+    report = maintenance.reap_expired_sessions(batch_size=1, pause_seconds=0)
+    assert report == {"auth_session": 1, "login_session": 1, "failed_login_event": 3, "photos": 0}
+
+    assert api.helpers.get_auth_session_from_id(expired_auth_id) is None
+    assert api.helpers.get_auth_session_from_id(valid_auth.session_id) is not None
+    assert api.helpers.get_login_session_from_id(old_session_id) is None
+    assert api.helpers.get_login_session_from_id(expired_session.session_id) is not None
+
+    # The old session is still listed from the archive, with its failed events and photos
+    day = (now - timedelta(days=constants.LOGIN_SESSION_ARCHIVE_DAYS + 1)).date()
+    history = api.helpers.get_login_history_as_dict(day, day)
+    archived = [session for session in history if session["session_id"] == str(old_session_id)]
+    assert len(archived) == 1
+    assert archived[0]["user_email"] == users[1].email
+    assert base64.b64decode(archived[0]["photo"]) == photo
+    events = api.helpers.get_failed_login_event_history_as_dict(day, day, session_id=old_session_id)
+    assert len(events) == 3
+    assert all(base64.b64decode(event["photo"]) == photo for event in events)
+
+    # The photo is only removed from the store once it is older than the grace period
+    assert os.path.exists(photo_path)
+    api.helpers.remove_unreferenced_photos(grace_seconds=0)
+    assert not os.path.exists(photo_path)
+
+    assert maintenance.reap_expired_sessions(pause_seconds=0) == {
+        "auth_session": 0, "login_session": 0, "failed_login_event": 0, "photos": 0}
+
+
+@pytest.mark.database
+def test_reap_sessions_command(test_client):
+    """
+    Tests the reap-sessions command
+    """
+    result = test_client.application.test_cli_runner().invoke(args=["reap-sessions", "--batch-size", "10"])
+    assert result.exit_code == 0
+    assert "Deleted 0 auth_session, 0 login_session, 0 failed_login_event, 0 photos" in result.output
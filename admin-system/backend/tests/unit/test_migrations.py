@@ -0,0 +1,171 @@
+import json
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+import sqlalchemy
+
+from api import blobs, migrations
+from api.app import db
+
+LOOKUP_INDEXES = {
+    "login_session": "ix_login_session_date",
+    "auth_session": "ix_auth_session_id_date",
+    "failed_login_event": "ix_failed_login_event_session_id",
+    "user_files": "ix_user_files_user_id_file_name",
+}
+
+
+def index_names(engine: sqlalchemy.Engine, table: str) -> set[str]:
+    return {index["name"] for index in sqlalchemy.inspect(engine).get_indexes(table)}
+
+
+def create_json_auth_stage_columns(connection: sqlalchemy.Connection) -> None:
+    """
+    Replace the auth stage bitmasks of the login session table by the version 2 JSON column
+    """
+    for column in ("auth_methods", "auth_completed"):
+        connection.execute(sqlalchemy.text(f"ALTER TABLE login_session DROP COLUMN {column}"))
+    connection.execute(sqlalchemy.text("ALTER TABLE login_session ADD COLUMN auth_stage VARCHAR"))
+
+
+def create_inline_photo_database(engine: sqlalchemy.Engine, photos: list[bytes]) -> tuple[uuid.UUID, uuid.UUID]:
+    """
+    Create a version 1 database (photos stored in the rows) with a user, a login session and a failed event per photo
+
+    :return: The ID of the user and of the login session
+    """
+    db.metadata.create_all(engine)
+    photo_type = sqlalchemy.LargeBinary().compile(dialect=engine.dialect)
+    with engine.begin() as connection:
+        create_json_auth_stage_columns(connection)
+        for table, _, photo_column, hash_column in migrations.PHOTO_COLUMNS:
+            connection.execute(sqlalchemy.text(f'ALTER TABLE "{table}" DROP COLUMN {hash_column}'))
+            connection.execute(sqlalchemy.text(f'ALTER TABLE "{table}" ADD COLUMN {photo_column} {photo_type}'))
+        migrations.get_version(connection)
+        migrations.set_version(connection, 1)
+
+    # Lightweight definitions of the version 1 tables (the models no longer have the photo columns)
+    user = sqlalchemy.table("user", *(sqlalchemy.column(name, type_) for name, type_ in (
+        ("id", sqlalchemy.Uuid), ("email", sqlalchemy.String), ("admin", sqlalchemy.Boolean),
+        ("photo", sqlalchemy.LargeBinary))))
+    login_session = sqlalchemy.table("login_session", *(sqlalchemy.column(name, type_) for name, type_ in (
+        ("session_id", sqlalchemy.Uuid), ("id", sqlalchemy.Uuid), ("date", sqlalchemy.DateTime),
+        ("auth_stage", sqlalchemy.String), ("motion_added_sequence", sqlalchemy.String),
+        ("motion_pattern_completed", sqlalchemy.Boolean),
+        ("motion_pattern_retry", sqlalchemy.Boolean), ("login_photo", sqlalchemy.LargeBinary))))
+    failed_login_event = sqlalchemy.table("failed_login_event", *(sqlalchemy.column(name, type_) for name, type_ in (
+        ("id", sqlalchemy.Uuid), ("session_id", sqlalchemy.Uuid), ("date", sqlalchemy.DateTime),
+        ("event", sqlalchemy.String), ("photo", sqlalchemy.LargeBinary))))
+
+    user_id, session_id = uuid.uuid4(), uuid.uuid4()
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.insert(user).values(
+            id=user_id, email="inline@photo.com", photo=photos[0], admin=False))
+        connection.execute(sqlalchemy.insert(login_session).values(
+            session_id=session_id, id=user_id, date=datetime.now(),
+            auth_stage=json.dumps({"password": True, "motion_pattern": False}),
+            motion_added_sequence=json.dumps(["UP", "LEFT"]),
+            motion_pattern_completed=False, motion_pattern_retry=False, login_photo=photos[0]))
+        for photo in photos:
+            connection.execute(sqlalchemy.insert(failed_login_event).values(
+                id=uuid.uuid4(), session_id=session_id, date=datetime.now(), event="Face recognition failed.",
+                photo=photo))
+    return user_id, session_id
+
+
+@pytest.mark.database
+def test_upgrade_existing_database(test_client, tmp_path):
+    """
+    Tests that a database created before the migrations existed is brought up to date, once
+    """
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'old-database.db'}")
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for index in LOOKUP_INDEXES.values():
+            connection.execute(sqlalchemy.text(f"DROP INDEX {index}"))
+
+    assert migrations.upgrade(engine) == [version for version, _, _ in migrations.MIGRATIONS]
+    for table, index in LOOKUP_INDEXES.items():
+        assert index in index_names(engine, table)
+    with engine.connect() as connection:
+        assert migrations.get_version(connection) == migrations.LATEST_VERSION
+
+    assert migrations.upgrade(engine) == []
+
+
+@pytest.mark.database
+def test_upgrade_fresh_database(test_client, tmp_path):
+    """
+    Tests that a database created from the models is stamped with the latest version without running the migrations
+    """
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'new-database.db'}")
+    db.metadata.create_all(engine)
+
+    assert migrations.upgrade(engine, fresh=True) == []
+    for table, index in LOOKUP_INDEXES.items():
+        assert index in index_names(engine, table)
+    with engine.connect() as connection:
+        assert migrations.get_version(connection) == migrations.LATEST_VERSION
+
+
+@pytest.mark.database
+def test_move_photos_to_store(test_client, tmp_path):
+    """
+    Tests that the photos stored in the rows are moved to the photo store, and that the database file shrinks
+    """
+    path = tmp_path / "inline-photos.db"
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    photos = [os.urandom(256 * 1024) for _ in range(4)]
+    user_id, session_id = create_inline_photo_database(engine, photos)
+    size_before = os.path.getsize(path)
+
+    assert migrations.upgrade(engine) == [2, 3]
+    assert os.path.getsize(path) < size_before / 4
+
+    digests = [blobs.put_photo(photo) for photo in photos]
+    for digest, photo in zip(digests, photos):
+        assert blobs.get_photo(digest) == photo
+    with engine.connect() as connection:
+        for table, _, photo_column, _ in migrations.PHOTO_COLUMNS:
+            assert photo_column not in {column["name"] for column in sqlalchemy.inspect(connection).get_columns(table)}
+        assert connection.execute(sqlalchemy.text('SELECT photo_hash FROM "user"')).scalar() == digests[0]
+        assert connection.execute(sqlalchemy.text("SELECT login_photo_hash FROM login_session")).scalar() == digests[0]
+        assert (set(connection.execute(sqlalchemy.text("SELECT photo_hash FROM failed_login_event")).scalars())
+                == set(digests))
+
+
+@pytest.mark.database
+def test_encode_auth_stages(test_client, tmp_path, monkeypatch):
+    """
+    Tests that the JSON auth stages and added motion sequences of the login sessions are encoded, over several pages
+    """
+    monkeypatch.setattr(migrations, "SESSION_BATCH_SIZE", 3)
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'json-auth-stages.db'}")
+    db.metadata.create_all(engine)
+    sessions = [
+        ({"password": False, "motion_pattern": False, "face_recognition": False}, None, 0b111, 0b000, None),
+        ({"password": True, "face_recognition": False}, ["FLIP"], 0b101, 0b001, "X"),
+        ({"motion_pattern": True, "face_recognition": True}, ["UP", "DOWN", "BACKWARD"], 0b110, 0b110, "UDB"),
+        ({}, None, 0, 0, None),
+    ]
+    with engine.begin() as connection:
+        create_json_auth_stage_columns(connection)
+        migrations.get_version(connection)
+        migrations.set_version(connection, 2)
+        for index, (auth_stage, moves, _, _, _) in enumerate(sessions):
+            connection.execute(sqlalchemy.text(
+                "INSERT INTO login_session (session_id, id, date, auth_stage, motion_added_sequence, "
+                "motion_pattern_completed, motion_pattern_retry) VALUES (:session_id, :id, :date, :auth_stage, "
+                ":moves, 0, 0)"), {"session_id": f"{index:032x}", "id": uuid.uuid4().hex, "date": datetime.now(),
+                                   "auth_stage": json.dumps(auth_stage),
+                                   "moves": json.dumps(moves) if moves is not None else None})
+
+    assert migrations.upgrade(engine) == [3]
+    with engine.connect() as connection:
+        assert "auth_stage" not in {column["name"] for column in sqlalchemy.inspect(connection).get_columns(
+            "login_session")}
+        rows = connection.execute(sqlalchemy.text("SELECT auth_methods, auth_completed, motion_added_sequence "
+                                                  "FROM login_session ORDER BY session_id")).all()
+    assert [tuple(row) for row in rows] == [session[2:] for session in sessions]
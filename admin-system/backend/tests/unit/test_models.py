@@ -1,12 +1,12 @@
 import datetime
-import json
 import os
 import uuid
 
 import pytest
+from sqlalchemy.exc import IntegrityError
 
 from api.app import db
-from api.helpers import get_auth_methods_as_dict
+from api.helpers import get_auth_methods
 from api.models import User, LoginSession
 
 
@@ -50,7 +50,8 @@ def test_login_session_create_fail(test_client, users):
         session_id=uuid.uuid4(),
         id=users[0].id,
         date=datetime.datetime.now(),
-        auth_stage=json.dumps(get_auth_methods_as_dict(users[0])),
+        auth_methods=int(get_auth_methods(users[0])),
+        auth_completed=0,
         motion_pattern_completed=False,
         motion_pattern_retry=False,
         pico_id=str(uuid.uuid4()),
@@ -63,16 +64,28 @@ def test_login_session_create_fail(test_client, users):
     with pytest.raises(AssertionError):
         session.pico_id = None
 
-    with pytest.raises(AssertionError):
-        session.pico_id = session_real.pico_id
-
-    # Make sure the session id is auto generated to something unique
-    session.session_id = session_real.session_id
-    assert session.session_id != session_real.session_id
-
     with pytest.raises(AssertionError):
         session.session_id = None
 
+    # Uniqueness is not checked by the validators, the database rejects duplicates on insert
+    duplicates = ({"session_id": session_real.session_id, "pico_id": str(uuid.uuid4())},
+                  {"session_id": uuid.uuid4(), "pico_id": session_real.pico_id})
+    auth_methods = session_real.auth_methods
+    db.session.expunge(session_real)
+    for duplicate in duplicates:
+        db.session.add(LoginSession(
+            id=users[0].id,
+            date=datetime.datetime.now(),
+            auth_methods=auth_methods,
+            auth_completed=0,
+            motion_pattern_completed=False,
+            motion_pattern_retry=False,
+            **duplicate,
+        ))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
     with pytest.raises(AssertionError):
         session.motion_added_sequence = None
 
@@ -80,7 +93,13 @@ def test_login_session_create_fail(test_client, users):
         session.motion_added_sequence = "{not_dict: 'hi'}"
 
     with pytest.raises(AssertionError):
-        session.auth_stage = None
+        session.motion_added_sequence = "UDZ"
+
+    with pytest.raises(AssertionError):
+        session.auth_methods = None
+
+    with pytest.raises(AssertionError):
+        session.auth_methods = "{not_dict: 'hi'}"
 
     with pytest.raises(AssertionError):
-        session.auth_stage = "{not_dict: 'hi'}"
+        session.auth_completed = 8
@@ -0,0 +1,140 @@
+import base64
+import hashlib
+import io
+import json
+import os
+
+import pytest
+
+import api.blobs
+import api.helpers
+from api import provisioning
+from constants import ValidMoves
+
+with open(os.path.join(os.curdir, "tests", "data", "user1.png"), 'rb') as image:
+    PHOTO = base64.b64encode(image.read()).decode("utf-8")
+
+
+def test_read_records():
+    """
+    Tests reading the NDJSON and CSV import formats into signup records
+    """
+    ndjson = io.StringIO('{"email": "a@b.co"}\n\n[1, 2]\nnot json\n')
+    assert list(provisioning.read_records(ndjson, "ndjson")) == [
+        (1, {"email": "a@b.co"}, None),
+        (3, None, "Record is not a JSON object"),
+        (4, None, "Record is not valid JSON"),
+    ]
+
+    csv = io.StringIO("email,password,motion_pattern,auth_methods,photo\n"
+                      "a@b.co,Password1,UP FLIP,password motion_pattern,\n"
+                      "c@d.co,,,face_recognition,cGhvdG8=\n")
+    assert list(provisioning.read_records(csv, "csv")) == [
+        (2, {"email": "a@b.co", "password": "Password1", "motion_pattern": ["UP", "FLIP"],
+             "auth_methods": {"password": True, "motion_pattern": True, "face_recognition": False}, "photo": None},
+         None),
+        (3, {"email": "c@d.co", "password": None, "motion_pattern": None,
+             "auth_methods": {"password": False, "motion_pattern": False, "face_recognition": True},
+             "photo": "cGhvdG8="}, None),
+    ]
+
+    assert provisioning.get_import_format("users.JSONL") == "ndjson"
+    with pytest.raises(AssertionError):
+        provisioning.get_import_format("users.xlsx")
+
+
+@pytest.mark.database
+def test_import_users(test_client, users):
+    """
+    Tests that the valid users are created over several batches and that the invalid ones are reported
+    """
+    unused_photo = b"photo of a user that is not created"
+    def record(email, password=None, motion_pattern=None, photo=None):
+        return {"email": email, "password": password, "motion_pattern": motion_pattern, "photo": photo,
+                "auth_methods": {"password": password is not None, "motion_pattern": motion_pattern is not None,
+                                 "face_recognition": photo is not None}}
+
+    records = [
+        (1, record("Bulk1@import.com", "Password1", [ValidMoves.UP.value, ValidMoves.FLIP.value]), None),
+        (2, record("bulk2@import.com", motion_pattern=[ValidMoves.LEFT.value], photo=PHOTO), None),
+        (3, record("not an email", "Password1"), None),
+        (4, record("bulk1@import.com", "Password1"), None),  # Duplicate in the file
+        (5, record(users[0].email, "Password1", photo=base64.b64encode(unused_photo).decode()), None),  # Registered
+        (6, record("bulk3@import.com", "password"), None),  # Invalid password
+        (7, record("bulk4@import.com", photo="not base64!"), None),
+        (8, None, "Record is not valid JSON"),
+        (9, record("bulk5@import.com", "Password2"), None),
+    ]
+    report = provisioning.import_users(records, workers=1, batch_size=2)
+
+    assert report["created"] == 3
+    assert [(failure["line"], failure["email"]) for failure in report["failed"]] == [
+        (3, "not an email"), (4, "bulk1@import.com"), (5, users[0].email), (6, "bulk3@import.com"),
+        (7, "bulk4@import.com"), (8, None)]
+    assert report["failed"][2]["error"] == "Provided email is already in use"
+    # The photos are only stored with the users inserted
+    assert not os.path.exists(api.blobs.get_photo_path(hashlib.sha256(unused_photo).hexdigest()))
+
+    user = api.helpers.get_user_from_email("bulk1@import.com")
+    assert user.check_password("Password1")
+    assert user.check_motion_pattern(str([ValidMoves.UP.value, ValidMoves.FLIP.value]))
+    assert api.helpers.get_auth_methods_as_dict(user) == {"password": False, "motion_pattern": False}
+
+    user = api.helpers.get_user_from_email("bulk2@import.com")
+    assert user.pwd is None
+    assert user.photo == base64.b64decode(PHOTO)
+    assert api.helpers.get_auth_methods_as_dict(user) == {"motion_pattern": False, "face_recognition": False}
+
+    # Importing the same users again only reports them
+    report = provisioning.import_users(records[:2], workers=1)
+    assert report["created"] == 0 and len(report["failed"]) == 2
+
+
+@pytest.mark.database
+def test_import_users_streams(test_client, monkeypatch):
+    """
+    Tests that the records are read one batch ahead of the inserts, and not all before the first one
+    """
+    read = []
+
+    def records():
+        for index in range(5):
+            read.append(index)
+            yield index + 1, {"email": f"stream{index}@import.com", "photo": PHOTO, "auth_methods": {
+                "password": False, "motion_pattern": False, "face_recognition": True}}, None
+
+    read_before_insert = []
+    insert_users = provisioning.insert_users
+
+    def counting_insert_users(users, report):
+        read_before_insert.append(len(read))
+        insert_users(users, report)
+
+    monkeypatch.setattr(provisioning, "insert_users", counting_insert_users)
+    report = provisioning.import_users(records(), workers=1, batch_size=2)
+
+    assert report == {"created": 5, "failed": []}
+    assert read_before_insert == [4, 5, 5]
+
+
+@pytest.mark.database
+def test_import_users_command(test_client, tmp_path):
+    """
+    Tests the import-users command, hashing in a pool of processes
+    """
+    path = tmp_path / "users.ndjson"
+    path.write_text("\n".join(json.dumps({
+        "email": f"command{index}@import.com",
+        "password": f"Password{index}",
+        "auth_methods": {"password": True, "motion_pattern": False, "face_recognition": False},
+    }) for index in range(3)) + "\nnot json\n")
+
+    result = test_client.application.test_cli_runner().invoke(
+        args=["import-users", str(path), "--workers", "2", "--batch-size", "2"])
+    assert result.exit_code == 0
+    assert "Created 3 users, 1 failed" in result.output
+    assert "Line 4 (None): Record is not valid JSON" in result.output
+    assert api.helpers.get_user_from_email("command2@import.com").check_password("Password2")
+
+    result = test_client.application.test_cli_runner().invoke(args=["import-users", str(path), "--format", "xml"])
+    assert result.exit_code != 0
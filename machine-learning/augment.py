@@ -0,0 +1,43 @@
+import torch
+import torch.nn.functional as F
+
+# probability of mirroring an image
+flip_probability = 0.5
+# the crop covers this fraction of the image (per side) before being resized back
+crop_scale = (0.9, 1.0)
+# brightness is multiplied by a factor in [1 - brightness, 1 + brightness]
+brightness = 0.2
+
+
+def augment_batch(images: torch.Tensor) -> torch.Tensor:
+    """Randomly flip, crop and brighten every image of a batch.
+
+    All the images are transformed at once: the flip and the crop are folded into one affine
+    transform per image and applied with a single ``grid_sample`` call, so the cost does not
+    depend on per-image Python calls. The random values come from the torch RNG, so checkpoints
+    resume with the same augmentations.
+
+    Args:
+        images (torch.Tensor): (N, 3, H, W) batch with values in [0, 1]
+
+    Returns:
+        torch.Tensor: the augmented batch, same shape
+    """
+    n = images.shape[0]
+    options = {"device": images.device, "dtype": images.dtype}
+
+    flip = torch.where(torch.rand(n, **options) < flip_probability, -1.0, 1.0)
+    scale = torch.empty(n, **options).uniform_(*crop_scale)
+    # move the crop anywhere it still fits inside the image
+    shift = (torch.rand(n, 2, **options) * 2 - 1) * (1 - scale)[:, None]
+
+    theta = torch.zeros(n, 2, 3, **options)
+    theta[:, 0, 0] = scale * flip
+    theta[:, 1, 1] = scale
+    theta[:, :, 2] = shift
+
+    grid = F.affine_grid(theta, list(images.shape), align_corners=False)
+    out = F.grid_sample(images, grid, mode="bilinear", padding_mode="border", align_corners=False)
+
+    factor = 1 + (torch.rand(n, 1, 1, 1, **options) * 2 - 1) * brightness
+    return out.mul_(factor).clamp_(0, 1)
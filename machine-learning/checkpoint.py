@@ -0,0 +1,121 @@
+import copy
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+from torch import nn
+
+LAST_CHECKPOINT = "last.pt"
+BEST_MODEL = "best.pth"
+
+
+##################################################################
+#####                    Checkpoint Contents                 #####
+##################################################################
+
+def snapshot_state_dict(module: nn.Module) -> dict:
+    """Copy a state dict so training can keep updating the weights while the copy is written."""
+    return {key: value.detach().to("cpu", copy=True) for key, value in module.state_dict().items()}
+
+
+def capture(model: nn.Module, optimizer: torch.optim.Optimizer, epoch: int, best_accuracy: float) -> dict:
+    """Capture everything needed to resume training exactly after ``epoch``.
+
+    The sampler state is not stored directly: ``DistributedSampler`` and the ``WeightedRandomSampler``
+    of ``--dedup weight`` draw from (seed, epoch) and the single-process ``DataLoader`` shuffles
+    from the torch RNG, which is restored.
+
+    Args:
+        model (nn.Module): the model being trained (unwrapped from DDP)
+        optimizer (torch.optim.Optimizer): its optimizer
+        epoch (int): number of completed epochs
+        best_accuracy (float): best validation accuracy so far
+
+    Returns:
+        dict: the checkpoint
+    """
+    return {
+        "epoch": epoch,
+        "best_accuracy": best_accuracy,
+        "model": snapshot_state_dict(model),
+        "optimizer": copy.deepcopy(optimizer.state_dict()),
+        "rng": {
+            "torch": torch.get_rng_state(),
+            "numpy": np.random.get_state(),
+            "python": random.getstate(),
+        },
+    }
+
+
+def restore(path: str, model: nn.Module, optimizer: torch.optim.Optimizer) -> tuple[int, float]:
+    """Load a checkpoint written by ``capture`` into the model, optimizer and RNGs.
+
+    Args:
+        path (str): path to the checkpoint
+        model (nn.Module): the model to load the weights into (unwrapped from DDP)
+        optimizer (torch.optim.Optimizer): the optimizer to load the state into
+
+    Returns:
+        tuple[int, float]: the number of completed epochs and the best validation accuracy so far
+    """
+    checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+
+    model.load_state_dict(checkpoint["model"])
+    optimizer.load_state_dict(checkpoint["optimizer"])
+
+    torch.set_rng_state(checkpoint["rng"]["torch"])
+    np.random.set_state(checkpoint["rng"]["numpy"])
+    random.setstate(checkpoint["rng"]["python"])
+
+    return checkpoint["epoch"], checkpoint["best_accuracy"]
+
+
+##################################################################
+#####                     Background Writer                  #####
+##################################################################
+
+class AsyncCheckpointWriter:
+    """Write checkpoints from a background thread so training does not wait on disk I/O.
+
+    Only one write can be pending at a time: if the disk is slower than training, ``save`` blocks
+    instead of piling up copies of the model in memory. Files are written to a temporary path and
+    renamed, so an interrupted write never corrupts the previous checkpoint.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, obj, path: str):
+        """Queue ``obj`` to be saved to ``path``. ``obj`` must not be modified afterwards."""
+        self._raise_error()
+        self._queue.put((obj, path))
+
+    def close(self):
+        """Wait for the pending writes to finish."""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            obj, path = item
+            try:
+                tmp_path = path + ".tmp"
+                torch.save(obj, tmp_path)
+                os.replace(tmp_path, path)
+            except Exception as exception:
+                self._error = exception
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Checkpoint write failed") from error
@@ -0,0 +1,75 @@
+from multiprocessing import Pool
+
+from PIL import Image
+
+# the hash has hash_size * hash_size bits, images whose hashes differ by at most `threshold` bits are near-duplicates
+hash_size = 8
+threshold = 4
+
+MODES = ("none", "drop", "weight")
+
+
+def perceptual_hash(path: str) -> int:
+    """Difference hash of an image: one bit per pixel of a tiny grayscale version, set if it is brighter than its
+    right neighbour. It does not change with small shifts in brightness, compression or scaling."""
+    with Image.open(path) as image:
+        pixels = list(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            bits = (bits << 1) | (left > pixels[row * (hash_size + 1) + column + 1])
+    return bits
+
+
+def cluster(hashes: list[int], threshold: int = threshold) -> list[int]:
+    """Group near-duplicate images.
+
+    Args:
+        hashes (list[int]): perceptual hashes of the images of one group
+        threshold (int): maximum number of different bits between near-duplicates
+
+    Returns:
+        list[int]: for each image, the index of the first image of its cluster (itself if it is not a duplicate)
+    """
+    representatives = []
+    out = []
+    for index, value in enumerate(hashes):
+        match = next((rep for rep in representatives if (hashes[rep] ^ value).bit_count() <= threshold), None)
+        if match is None:
+            representatives.append(index)
+            match = index
+        out.append(match)
+    return out
+
+
+def find_near_duplicates(groups: dict, threshold: int = threshold, workers: int = None) -> dict:
+    """Cluster the near-duplicates inside each group of images.
+
+    The images are hashed in a pool of processes, duplicates are only looked for inside a group.
+
+    Args:
+        groups (dict): key -> list of image paths
+        threshold (int): maximum number of different bits between near-duplicates
+        workers (int): number of processes (defaults to the number of cores)
+
+    Returns:
+        dict: key -> output of ``cluster`` for the images of the group
+    """
+    paths = [path for group in groups.values() for path in group]
+    with Pool(workers) as pool:
+        hashes = pool.map(perceptual_hash, paths, chunksize=16)
+
+    out, start = {}, 0
+    for key, group in groups.items():
+        out[key] = cluster(hashes[start:start + len(group)], threshold)
+        start += len(group)
+    return out
+
+
+def cluster_sizes(clusters: list[int]) -> list[int]:
+    """Size of the cluster of every image."""
+    counts = {}
+    for representative in clusters:
+        counts[representative] = counts.get(representative, 0) + 1
+    return [counts[representative] for representative in clusters]
@@ -0,0 +1,167 @@
+import argparse
+import statistics
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from model import DATA_PATH, MODEL_PATH, SiameseNetwork, build_dataset, device, load_model, split_dataset
+
+STUDENT_PATH = "student.pth"
+# a quarter of the teacher's conv channels and an eighth of its feature vector
+STUDENT_CHANNELS = (16, 32, 32, 64)
+STUDENT_FEATURES = 512
+
+batch_size = 64
+lr = 0.0001
+epochs = 10
+# softening of the teacher's logits and weight of the distillation loss against the true labels
+temperature = 4.0
+alpha = 0.7
+# maximum fraction of test pairs where the student may decide differently from the teacher
+tolerance = 0.02
+
+
+##################################################################
+#####                        Distillation                    #####
+##################################################################
+
+def teacher_logits(dataset: TensorDataset, teacher: SiameseNetwork) -> torch.Tensor:
+    """Run the teacher once over the whole dataset, so each epoch only has to run the student."""
+    teacher.eval()
+    out = []
+    with torch.no_grad():
+        for X, Y, _ in DataLoader(dataset, batch_size=batch_size):
+            out.append(teacher(X.to(device), Y.to(device)).cpu())
+    return torch.cat(out)
+
+
+def distillation_loss(student_out: torch.Tensor, teacher_out: torch.Tensor, labels: torch.Tensor,
+                      temperature: float, alpha: float) -> torch.Tensor:
+    """Mix of the KL divergence to the softened teacher outputs and the cross entropy with the true labels.
+
+    The KL term is scaled by ``temperature ** 2`` so its gradients keep the same magnitude as the temperature changes.
+    """
+    soft = F.kl_div(F.log_softmax(student_out / temperature, dim=1), F.softmax(teacher_out / temperature, dim=1),
+                    reduction="batchmean") * temperature ** 2
+    hard = F.cross_entropy(student_out, labels)
+    return alpha * soft + (1 - alpha) * hard
+
+
+def distill(dataloader, student, optimizer, temperature, alpha):
+    student.train()
+    for X, Y, z, t in dataloader:
+        X, Y, z, t = X.to(device), Y.to(device), z.to(device).long(), t.to(device)
+
+        loss = distillation_loss(student(X, Y), t, z, temperature, alpha)
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+
+def compare(dataloader, student, teacher) -> dict:
+    """Compare the decisions of the student and the teacher on the same pairs."""
+    student.eval()
+    teacher.eval()
+    agree, student_correct, teacher_correct, size = 0, 0, 0, 0
+
+    with torch.no_grad():
+        for X, Y, z in dataloader:
+            X, Y, z = X.to(device), Y.to(device), z.to(device).long()
+            student_pred = student(X, Y).argmax(1)
+            teacher_pred = teacher(X, Y).argmax(1)
+
+            agree += (student_pred == teacher_pred).sum().item()
+            student_correct += (student_pred == z).sum().item()
+            teacher_correct += (teacher_pred == z).sum().item()
+            size += len(z)
+
+    return {
+        "agreement": agree / size,
+        "student_accuracy": student_correct / size,
+        "teacher_accuracy": teacher_correct / size,
+    }
+
+
+##################################################################
+#####                        Benchmarking                    #####
+##################################################################
+
+def parameter_megabytes(model: nn.Module) -> float:
+    return sum(p.numel() * p.element_size() for p in model.parameters()) / 2 ** 20
+
+
+def login_latency_ms(model: nn.Module, repeats: int = 20) -> float:
+    """Median time of a single-pair forward pass, which is what the backend runs for every face login."""
+    model.eval()
+    anchor, image = torch.rand(1, 3, 105, 105), torch.rand(1, 3, 105, 105)
+    times = []
+    with torch.no_grad():
+        model(anchor, image)  # warm up
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(anchor, image)
+            times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill the siamese model into a smaller student network.")
+    parser.add_argument("--teacher", default=MODEL_PATH, help="state dict of the trained teacher")
+    parser.add_argument("--output", default=STUDENT_PATH, help="where to save the student state dict")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--channels", type=int, nargs=4, default=STUDENT_CHANNELS,
+                        help="output channels of the student's four conv layers")
+    parser.add_argument("--features", type=int, default=STUDENT_FEATURES, help="size of the student's feature vector")
+    parser.add_argument("--epochs", type=int, default=epochs)
+    parser.add_argument("--lr", type=float, default=lr)
+    parser.add_argument("--temperature", type=float, default=temperature)
+    parser.add_argument("--alpha", type=float, default=alpha)
+    parser.add_argument("--tolerance", type=float, default=tolerance,
+                        help="maximum fraction of test pairs the student may decide differently from the teacher")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.epochs < 1:
+        # the student is only compared with the teacher after an epoch
+        parser.error("--epochs must be at least 1")
+
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    train_set, test_set = split_dataset(build_dataset(args.data), torch.Generator().manual_seed(args.seed))
+
+    teacher = load_model(args.teacher).to(device)
+    student = SiameseNetwork(tuple(args.channels), args.features).to(device)
+
+    train_dataloader = DataLoader(TensorDataset(*train_set.tensors, teacher_logits(train_set, teacher)),
+                                  batch_size=batch_size, shuffle=True)
+    test_dataloader = DataLoader(test_set, batch_size=batch_size)
+
+    optimizer = torch.optim.Adam(student.parameters(), lr=args.lr)
+    for t in range(args.epochs):
+        print(f"Epoch {t+1}: -------------------------------")
+        distill(train_dataloader, student, optimizer, args.temperature, args.alpha)
+        result = compare(test_dataloader, student, teacher)
+        print(f"Agreement: {(100*result['agreement']):>0.1f}%, "
+              f"Student accuracy: {(100*result['student_accuracy']):>0.1f}%, "
+              f"Teacher accuracy: {(100*result['teacher_accuracy']):>0.1f}% \n")
+
+    # Same state dict format as the teacher, the backend reads the architecture from the weight shapes
+    torch.save(student.cpu().state_dict(), args.output)
+
+    teacher, student = teacher.cpu(), student.cpu()
+    print(f"Parameters: {parameter_megabytes(teacher):>0.1f} MB -> {parameter_megabytes(student):>0.1f} MB")
+    print(f"Login latency: {login_latency_ms(teacher):>0.1f} ms -> {login_latency_ms(student):>0.1f} ms")
+
+    if 1 - result["agreement"] > args.tolerance:
+        print(f"Student disagrees with the teacher on {(100*(1 - result['agreement'])):>0.1f}% of pairs, "
+              f"more than the {(100*args.tolerance):>0.1f}% tolerance")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import os
+
+import torch
+import torch.distributed as dist
+
+# gloo is the only torch.distributed backend that supports CPU tensors everywhere
+BACKEND = "gloo"
+DEFAULT_MASTER_ADDR = "127.0.0.1"
+DEFAULT_MASTER_PORT = "29500"
+
+
+##################################################################
+#####                    Process Group Setup                 #####
+##################################################################
+
+def launched_with_torchrun() -> bool:
+    """Check whether the current process was started by ``torchrun`` (or another launcher setting the env vars).
+
+    Returns:
+        bool: True if ``RANK`` and ``WORLD_SIZE`` are present in the environment
+    """
+    return "RANK" in os.environ and "WORLD_SIZE" in os.environ
+
+
+def setup(rank: int, world_size: int):
+    """Join the gloo process group.
+
+    When launched with ``torchrun`` the rendezvous address comes from the environment, otherwise
+    a local address is used so a single-node multi-process run needs no external services.
+
+    Args:
+        rank (int): global rank of this process
+        world_size (int): total number of processes across all nodes
+    """
+    os.environ.setdefault("MASTER_ADDR", DEFAULT_MASTER_ADDR)
+    os.environ.setdefault("MASTER_PORT", DEFAULT_MASTER_PORT)
+    dist.init_process_group(BACKEND, rank=rank, world_size=world_size)
+
+
+def cleanup():
+    """Leave the process group (if one was joined)."""
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def threads_per_process(local_world_size: int) -> int:
+    """Split the cores of this node evenly between the local training processes.
+
+    Without this every process starts one intra-op thread per core and they oversubscribe the machine.
+
+    Args:
+        local_world_size (int): number of training processes running on this node
+
+    Returns:
+        int: number of torch threads each process should use
+    """
+    return max(1, (os.cpu_count() or 1) // max(1, local_world_size))
+
+
+##################################################################
+#####                    Rank Information                    #####
+##################################################################
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+##################################################################
+#####                      Communication                     #####
+##################################################################
+
+def all_reduce_sum(*values: float) -> list[float]:
+    """Sum scalar values over all processes.
+
+    Args:
+        values (float): the local values to sum
+
+    Returns:
+        list[float]: the summed values, in the same order (the local values if not distributed)
+    """
+    tensor = torch.tensor(values, dtype=torch.float64)
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
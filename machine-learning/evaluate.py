@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+
+import torch
+from torchvision import datasets
+from torchvision.transforms import ToTensor, Compose, Resize
+
+from model import DATA_PATH, MODEL_PATH, SiameseNetwork, get_people, load_model
+
+# same preprocessing as the backend, no augmentation
+eval_transforms = Compose([
+    ToTensor(),
+    Resize((105, 105), antialias=None),
+])
+
+embedding_batch_size = 256
+# number of (anchor, candidate) pairs passed through the head at once, bounds the memory used by the differences
+pair_batch_size = 1024
+
+
+##################################################################
+#####                        Data Loading                    #####
+##################################################################
+
+def load_images(data_path=DATA_PATH) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Load every anchor and positive image of the data folder, labelled with the index of the person.
+
+    Args:
+        data_path (str): folder containing one ``anchor``/``positive`` folder pair per person
+
+    Returns:
+        tuple: anchor images, anchor person ids, candidate (positive) images, candidate person ids
+    """
+    anchors, anchor_ids, candidates, candidate_ids = [], [], [], []
+
+    for person_id, person in enumerate(get_people(data_path)):
+        folder = datasets.ImageFolder(root=os.path.join(data_path, person), transform=eval_transforms)
+        anchor_class = folder.class_to_idx["anchor"]
+        for img, target in folder:
+            if target == anchor_class:
+                anchors.append(img)
+                anchor_ids.append(person_id)
+            else:
+                candidates.append(img)
+                candidate_ids.append(person_id)
+
+    return torch.stack(anchors), torch.tensor(anchor_ids), torch.stack(candidates), torch.tensor(candidate_ids)
+
+
+##################################################################
+#####                          Scoring                       #####
+##################################################################
+
+def embed(model: SiameseNetwork, images: torch.Tensor) -> torch.Tensor:
+    """Pass every image through the embedding network once."""
+    embeddings = [model.embedding_layer(images[i:i + embedding_batch_size])
+                  for i in range(0, len(images), embedding_batch_size)]
+    return torch.cat(embeddings)
+
+
+def head(model: SiameseNetwork, dist: torch.Tensor) -> torch.Tensor:
+    """The part of ``SiameseNetwork.forward`` after the embedding distance."""
+    return model.classification_layer(model.feature_vector(dist))
+
+
+def score_all_pairs(model: SiameseNetwork, anchor_embeddings: torch.Tensor,
+                    candidate_embeddings: torch.Tensor) -> torch.Tensor:
+    """Score every (anchor, candidate) pair from cached embeddings.
+
+    The pairs are passed through the head in blocks of ``pair_batch_size`` so each block is a
+    single large matmul, instead of running both towers of the network for every pair.
+
+    Args:
+        model (SiameseNetwork): the model being evaluated
+        anchor_embeddings (torch.Tensor): (A, D) embeddings of the anchors
+        candidate_embeddings (torch.Tensor): (C, D) embeddings of the candidates
+
+    Returns:
+        torch.Tensor: (A, C) probability that each pair is the same person
+    """
+    num_anchors, num_candidates = len(anchor_embeddings), len(candidate_embeddings)
+    col_chunk = min(num_candidates, pair_batch_size)
+    row_chunk = max(1, pair_batch_size // col_chunk)
+
+    scores = torch.empty(num_anchors, num_candidates)
+    for i in range(0, num_anchors, row_chunk):
+        rows = anchor_embeddings[i:i + row_chunk]
+        for j in range(0, num_candidates, col_chunk):
+            cols = candidate_embeddings[j:j + col_chunk]
+            dist = (rows[:, None, :] - cols[None, :, :]).abs_().flatten(0, 1)
+            logits = head(model, dist)
+            scores[i:i + len(rows), j:j + len(cols)] = logits.softmax(1)[:, 1].view(len(rows), len(cols))
+
+    return scores
+
+
+##################################################################
+#####                          Metrics                       #####
+##################################################################
+
+def roc_curve(scores: torch.Tensor, labels: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Compute the ROC curve of a set of scores.
+
+    Args:
+        scores (torch.Tensor): 1D tensor of scores, higher means more likely positive
+        labels (torch.Tensor): 1D boolean tensor, True for positive pairs
+
+    Returns:
+        tuple[torch.Tensor, torch.Tensor, torch.Tensor]: false positive rates, true positive rates and thresholds
+    """
+    order = torch.argsort(scores, descending=True)
+    scores, labels = scores[order], labels[order].double()
+
+    true_positives = torch.cumsum(labels, 0)
+    false_positives = torch.cumsum(1 - labels, 0)
+
+    # only keep the last pair of each distinct score
+    last = torch.cat([torch.nonzero(scores[1:] != scores[:-1]).flatten(), torch.tensor([len(scores) - 1])])
+
+    tpr = torch.cat([torch.zeros(1, dtype=torch.double), true_positives[last] / max(1, true_positives[-1].item())])
+    fpr = torch.cat([torch.zeros(1, dtype=torch.double), false_positives[last] / max(1, false_positives[-1].item())])
+    thresholds = torch.cat([torch.tensor([float("inf")]), scores[last].double()])
+
+    return fpr, tpr, thresholds
+
+
+def equal_error_rate(fpr: torch.Tensor, tpr: torch.Tensor, thresholds: torch.Tensor) -> tuple[float, float]:
+    """Find the point of the ROC curve where the false accept and false reject rates are equal.
+
+    Returns:
+        tuple[float, float]: the equal error rate and its threshold
+    """
+    fnr = 1 - tpr
+    index = torch.argmin(torch.abs(fpr - fnr))
+    return ((fpr[index] + fnr[index]) / 2).item(), thresholds[index].item()
+
+
+def threshold_sweep(scores: torch.Tensor, labels: torch.Tensor, steps: int = 21) -> list[dict]:
+    """Compute the accuracy, false accept rate and false reject rate at evenly spaced thresholds."""
+    positives, negatives = labels, ~labels
+    out = []
+    for threshold in torch.linspace(0, 1, steps).tolist():
+        accepted = scores >= threshold
+        out.append({
+            "threshold": round(threshold, 4),
+            "accuracy": (accepted == labels).double().mean().item(),
+            "far": (accepted & negatives).sum().item() / max(1, negatives.sum().item()),
+            "frr": (~accepted & positives).sum().item() / max(1, positives.sum().item()),
+        })
+    return out
+
+
+def evaluate(model: SiameseNetwork, data_path=DATA_PATH) -> dict:
+    """Evaluate the model on every anchor/candidate pair of the data folder.
+
+    Each image is embedded once, so evaluating N images costs N embeddings instead of a full
+    forward pass for every pair.
+
+    Args:
+        model (SiameseNetwork): the model to evaluate
+        data_path (str): folder containing one ``anchor``/``positive`` folder pair per person
+
+    Returns:
+        dict: the evaluation report
+    """
+    model.eval()
+    anchors, anchor_ids, candidates, candidate_ids = load_images(data_path)
+
+    with torch.no_grad():
+        scores = score_all_pairs(model, embed(model, anchors), embed(model, candidates)).flatten()
+    labels = (anchor_ids[:, None] == candidate_ids[None, :]).flatten()
+
+    fpr, tpr, thresholds = roc_curve(scores, labels)
+    eer, eer_threshold = equal_error_rate(fpr, tpr, thresholds)
+
+    return {
+        "images": len(anchors) + len(candidates),
+        "pairs": len(scores),
+        "positive_pairs": labels.sum().item(),
+        # the backend accepts a match when the positive class wins, which is a 0.5 threshold
+        "accuracy": ((scores >= 0.5) == labels).double().mean().item(),
+        "auc": torch.trapezoid(tpr, fpr).item(),
+        "eer": eer,
+        "eer_threshold": eer_threshold,
+        "sweep": threshold_sweep(scores, labels),
+        "roc": {"fpr": fpr.tolist(), "tpr": tpr.tolist(), "thresholds": thresholds.tolist()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the model on all anchor/candidate pairs.")
+    parser.add_argument("--model", default=MODEL_PATH, help="state dict to evaluate")
+    parser.add_argument("--data", default=DATA_PATH, help="folder containing the evaluation images")
+    parser.add_argument("--report", default=None, help="write the full report (including the ROC curve) as JSON")
+    args = parser.parse_args()
+
+    report = evaluate(load_model(args.model), args.data)
+
+    print(f"{report['images']} images, {report['pairs']} pairs ({report['positive_pairs']} positive)")
+    print(f"Accuracy: {(100*report['accuracy']):>0.1f}%, AUC: {report['auc']:>0.4f}, "
+          f"EER: {(100*report['eer']):>0.1f}% at threshold {report['eer_threshold']:>0.4f}")
+    print("threshold  accuracy     FAR      FRR")
+    for row in report["sweep"]:
+        print(f"{row['threshold']:>9.2f}  {100*row['accuracy']:>7.1f}%  {100*row['far']:>6.1f}%  {100*row['frr']:>6.1f}%")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import argparse
+import io
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from PIL import Image
+from sqlalchemy import DateTime, String, Uuid, and_, column, create_engine, or_, select, table
+
+from shards import SHARD_SIZE, ShardWriter, encode_image
+
+DATABASE_URL = "sqlite:///../admin-system/backend/instance/database.db"
+# the photos are stored by the backend in files named by their SHA-256, the rows only keep the hash
+PHOTO_STORE = "../admin-system/backend/instance/data/photos"
+STATE_FILE = "export_state.json"
+# rows fetched from the database at a time
+fetch_size = 500
+# at least the backend's LOGIN_SESSION_EXPIRY_MINUTES: a login photo is only saved before its session expires
+session_window = timedelta(minutes=10)
+
+# only the columns the export needs, so this does not depend on the backend package
+user = table("user", column("id", Uuid), column("photo_hash", String))
+login_session = table("login_session", column("session_id", Uuid), column("id", Uuid),
+                      column("date", DateTime), column("login_photo_hash", String))
+failed_login_event = table("failed_login_event", column("id", Uuid), column("session_id", Uuid),
+                           column("date", DateTime), column("photo_hash", String))
+
+
+##################################################################
+#####                         Watermarks                     #####
+##################################################################
+# The watermark of a table is the (date, id) of the last exported row. Rows are exported in that
+# order, so the next export starts right after it and ties on the date are not lost.
+#
+# A login session is dated when it is created, but its photo is only saved later, at the face
+# recognition stage: a session still in progress during an export can end up older than the
+# watermark. So the login sessions of the last ``session_window`` before the watermark are read
+# again, and the watermark keeps the IDs of the sessions exported in that window to skip them.
+
+def read_state(output_dir: str) -> dict:
+    path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(output_dir: str, state: dict):
+    path = os.path.join(output_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def after_watermark(date_column, id_column, watermark: dict | None):
+    if watermark is None:
+        return True
+    date = datetime.fromisoformat(watermark["date"])
+    return or_(date_column > date, and_(date_column == date, id_column > uuid.UUID(watermark["id"])))
+
+
+def session_watermark(watermark: dict | None, exported: list[tuple[datetime, str]]) -> dict:
+    """Add the login sessions exported by a run to the login session watermark.
+
+    Args:
+        watermark (dict | None): the watermark of the previous export
+        exported (list[tuple[datetime, str]]): the (date, id) of the sessions exported by this run
+
+    Returns:
+        dict: the date of the latest exported session, and the (date, id) of the exported
+        sessions within ``session_window`` of it
+    """
+    recent = [(datetime.fromisoformat(date), row_id) for date, row_id in watermark["recent"]] if watermark else []
+    recent += exported
+    latest = max(date for date, _ in recent)
+    return {"date": latest.isoformat(),
+            "recent": [[date.isoformat(), row_id] for date, row_id in recent if date >= latest - session_window]}
+
+
+def new_photos(connection, state: dict):
+    """Stream the photos added since the last export, oldest first.
+
+    Yields:
+        tuple[str, str, str, datetime, str]: (table, row id, user id, date, SHA-256 of the photo)
+    """
+    query = (select(login_session.c.session_id, login_session.c.id, login_session.c.date,
+                    login_session.c.login_photo_hash)
+             .where(login_session.c.login_photo_hash.is_not(None))
+             .order_by(login_session.c.date, login_session.c.session_id))
+    watermark, exported = state.get("login_session"), set()
+    if watermark is not None:
+        query = query.where(login_session.c.date >= datetime.fromisoformat(watermark["date"]) - session_window)
+        exported = {row_id for _, row_id in watermark["recent"]}
+    for row_id, user_id, date, photo in connection.execution_options(yield_per=fetch_size).execute(query):
+        if str(row_id) not in exported:
+            yield "login_session", row_id, user_id, date, photo
+
+    query = (select(failed_login_event.c.id, login_session.c.id, failed_login_event.c.date,
+                    failed_login_event.c.photo_hash)
+             .join(login_session, failed_login_event.c.session_id == login_session.c.session_id)
+             .where(failed_login_event.c.photo_hash.is_not(None))
+             .where(after_watermark(failed_login_event.c.date, failed_login_event.c.id,
+                                    state.get("failed_login_event")))
+             .order_by(failed_login_event.c.date, failed_login_event.c.id))
+    for row_id, user_id, date, photo in connection.execution_options(yield_per=fetch_size).execute(query):
+        yield "failed_login_event", row_id, user_id, date, photo
+
+
+##################################################################
+#####                           Export                       #####
+##################################################################
+
+def load_photo(photo_store: str, digest: str) -> bytes | None:
+    """Read a photo from the backend's photo store, ``None`` if it is not there (e.g. already removed)."""
+    try:
+        with open(os.path.join(photo_store, digest[:2], digest), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def decode(photo: bytes | None) -> bytes | None:
+    if photo is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(photo)) as image:
+            return encode_image(image)[0]
+    except OSError:
+        return None
+
+
+def export(database_url: str, output_dir: str, shard_size: int = SHARD_SIZE, photo_store: str = PHOTO_STORE) -> dict:
+    """Append the login photos added since the last export to the shards in ``output_dir``.
+
+    Successful login photos are exported as positives and photos of failed login events as "failed"
+    images (hard negatives for ``PairStream(include_failed=True)``). Each of them is paired with a
+    copy of the user's enrollment photo as anchor. Users without an enrollment photo are skipped.
+
+    Photos are buffered per user and written once about ``shard_size`` images are buffered, so a
+    user's photos stay in the same shard as their anchors. The watermarks are only saved once the
+    index is written, an interrupted export is simply redone by the next one.
+
+    Args:
+        database_url (str): SQLAlchemy URL of the backend database
+        output_dir (str): folder with the shards to append to
+        shard_size (int): number of images per shard
+        photo_store (str): folder of the backend's photo store
+
+    Returns:
+        dict: the number of exported, skipped and unreadable (or missing) photos
+    """
+    state = read_state(output_dir)
+    writer = ShardWriter(output_dir, shard_size, append=True)
+    stats = {"positive": 0, "failed": 0, "no_enrollment": 0, "unreadable": 0}
+    # user id -> enrollment png, login photos and failed photos waiting to be written
+    buffered = {}
+    buffered_images = 0
+
+    def flush():
+        nonlocal buffered_images
+        for user_id, (enrollment, positives, failed) in buffered.items():
+            anchors = [("anchor", f"user/{user_id}", enrollment)] * max(len(positives), len(failed))
+            writer.write_person(f"user-{user_id}", anchors + positives + failed)
+        buffered.clear()
+        buffered_images = 0
+
+    # (date, id) of the exported login sessions, added to their watermark at the end
+    exported_sessions = []
+
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        for source, row_id, user_id, date, digest in new_photos(connection, state):
+            if source == "login_session":
+                exported_sessions.append((date, str(row_id)))
+            else:
+                state[source] = {"date": date.isoformat(), "id": str(row_id)}
+
+            if user_id not in buffered:
+                enrollment = connection.execute(select(user.c.photo_hash).where(user.c.id == user_id)).scalar()
+                enrollment = decode(load_photo(photo_store, enrollment)) if enrollment else None
+                if enrollment is None:
+                    stats["no_enrollment"] += 1
+                    continue
+                buffered[user_id] = (enrollment, [], [])
+
+            png = decode(load_photo(photo_store, digest))
+            if png is None:
+                stats["unreadable"] += 1
+                continue
+
+            role = "positive" if source == "login_session" else "failed"
+            buffered[user_id][1 if role == "positive" else 2].append((role, f"{source}/{row_id}", png))
+            stats[role] += 1
+            buffered_images += 2
+            if buffered_images >= shard_size:
+                flush()
+    flush()
+    engine.dispose()
+
+    writer.close()
+    if exported_sessions:
+        state["login_session"] = session_watermark(state.get("login_session"), exported_sessions)
+    write_state(output_dir, state)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the new login photos of the backend into training shards.")
+    parser.add_argument("output", help="folder of the shards to append to")
+    parser.add_argument("--database", default=DATABASE_URL, help="SQLAlchemy URL of the backend database")
+    parser.add_argument("--photo-store", default=PHOTO_STORE, help="folder of the backend's photo store")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="number of images per shard")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = export(args.database, args.output, args.shard_size, args.photo_store)
+    elapsed = time.perf_counter() - start
+
+    print(f"Exported {stats['positive']} login photos and {stats['failed']} failed login photos in {elapsed:>0.1f}s "
+          f"({stats['no_enrollment']} without enrollment photo, {stats['unreadable']} unreadable)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import itertools
+import os
+import time
+from multiprocessing import Pool
+
+from PIL import Image
+
+from shards import SHARD_SIZE, ShardWriter, encode_image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".pgm")
+
+
+##################################################################
+#####                        Raw Images                      #####
+##################################################################
+
+def find_images(raw_dir: str) -> list[tuple[str, str, str]]:
+    """List the raw images of every person.
+
+    Two layouts are accepted for each person's folder: ``<person>/anchor/*`` and ``<person>/positive/*``
+    (the layout of ``data/``), or all the images directly in ``<person>/``, in which case they are
+    alternately used as anchors and positives like in ``data_organization.ipynb``.
+
+    Args:
+        raw_dir (str): folder with one subfolder per person
+
+    Returns:
+        list[tuple[str, str, str]]: (person, role, path) sorted by person
+    """
+    out = []
+    for person in sorted(os.listdir(raw_dir)):
+        person_dir = os.path.join(raw_dir, person)
+        if not os.path.isdir(person_dir):
+            continue
+
+        if os.path.isdir(os.path.join(person_dir, "anchor")):
+            for role in ("anchor", "positive"):
+                role_dir = os.path.join(person_dir, role)
+                if os.path.isdir(role_dir):
+                    out += [(person, role, os.path.join(role_dir, file)) for file in sorted(os.listdir(role_dir))
+                            if file.lower().endswith(IMAGE_EXTENSIONS)]
+        else:
+            files = [file for file in sorted(os.listdir(person_dir)) if file.lower().endswith(IMAGE_EXTENSIONS)]
+            out += [(person, "anchor" if count % 2 == 0 else "positive", os.path.join(person_dir, file))
+                    for count, file in enumerate(files)]
+    return out
+
+
+def process_image(item: tuple[str, str, str]) -> tuple[str, str, str, bytes | None, str | None]:
+    """Decode and resize one image (runs in the worker processes).
+
+    Args:
+        item (tuple[str, str, str]): (person, role, path)
+
+    Returns:
+        tuple: (person, role, path, png bytes, sha256 of the resized pixels), the last two are None if
+               the image could not be decoded
+    """
+    person, role, path = item
+    try:
+        with Image.open(path) as image:
+            png, digest = encode_image(image)
+    except OSError:
+        return person, role, path, None, None
+    return person, role, path, png, digest
+
+
+##################################################################
+#####                         Ingestion                      #####
+##################################################################
+
+def ingest(raw_dir: str, output_dir: str, shard_size: int = SHARD_SIZE, workers: int = None) -> dict:
+    """Decode, resize and deduplicate the raw images into shards.
+
+    The images are processed in a pool of processes, the main process only deduplicates and writes
+    the shards. Results come back in order, so a person is written as soon as their last image is done
+    and the output is the same for any number of workers.
+
+    Args:
+        raw_dir (str): folder with one subfolder per person
+        output_dir (str): folder to write the shards and the index to
+        shard_size (int): number of images per shard
+        workers (int): number of processes (defaults to the number of cores)
+
+    Returns:
+        dict: the shard index
+    """
+    images = find_images(raw_dir)
+    seen = set()
+    duplicates, unreadable = 0, 0
+    writer = ShardWriter(output_dir, shard_size)
+
+    with Pool(workers) as pool:
+        results = pool.imap(process_image, images, chunksize=32)
+        for person, person_results in itertools.groupby(results, key=lambda result: result[0]):
+            samples = []
+            for _, role, path, png, digest in person_results:
+                if png is None:
+                    unreadable += 1
+                elif digest in seen:
+                    duplicates += 1
+                else:
+                    seen.add(digest)
+                    samples.append((role, os.path.relpath(path, raw_dir), png))
+            if samples:
+                writer.write_person(person, samples)
+
+    return writer.close(duplicates=duplicates, unreadable=unreadable)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest raw face images into training shards.")
+    parser.add_argument("raw", help="folder with one subfolder of images per person")
+    parser.add_argument("output", help="folder to write the shards to")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="number of images per shard")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (defaults to the core count)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = ingest(args.raw, args.output, args.shard_size, args.workers)
+    elapsed = time.perf_counter() - start
+
+    print(f"{index['images']} images of {index['people']} people in {len(index['shards'])} shards "
+          f"({index['duplicates']} duplicates, {index['unreadable']} unreadable) in {elapsed:>0.1f}s")
+
+
+if __name__ == "__main__":
+    main()
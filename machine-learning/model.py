@@ -1,106 +1,225 @@
+import argparse
 import os
+import shutil
+import time
+from contextlib import nullcontext
 
 import numpy as np
 import torch
+import torch.multiprocessing as mp
+import torch.utils.checkpoint
 from torch import nn
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data import DataLoader
 from torch.utils.data import random_split
 from torch.utils.data import Subset
+from torch.utils.data import TensorDataset
+from torch.utils.data import WeightedRandomSampler
+from torch.utils.data.distributed import DistributedSampler
 from torchdata.datapipes.iter import Zipper, IterableWrapper
 from torchvision import datasets
-from torchvision.transforms import ToTensor, Compose, RandomHorizontalFlip, Resize
+from torchvision.transforms import ToTensor, Compose, Resize
+
+import augment
+import checkpoint
+import dedup
+import distributed
+import profiling
+import shards
 
 DATA_PATH = os.path.join("data")
-PEOPLE = tuple([name for name in os.listdir(DATA_PATH) if os.path.isdir(os.path.join(DATA_PATH, name))])
+MODEL_PATH = "model.pth"
+
+batch_size = 64
+lr = 0.00001
+epochs = 5
+seed = 0
 
+# output channels of the four conv layers and size of the feature vector
+CHANNELS = (64, 128, 128, 256)
+FEATURES = 4096
+# size of the map each conv channel is reduced to for a 105x105 input
+EMBEDDING_AREA = 9 * 9
+
+# augmentation is applied to every batch during training (see augment.py), not here: the images
+# are only loaded once, so a random transform here would be the same for every epoch
 img_transforms = Compose([
-    RandomHorizontalFlip(),
     ToTensor(),
     Resize((105, 105), antialias=None),
 ])
 
+# Get cpu or gpu device for training.
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
 
 ##################################################################
 #####                    Data Organization                   #####
 ##################################################################
 
-# maps: "person" -> datasets.ImageFolder
-full_dataset = {}
-
-for person in PEOPLE:
-    full_dataset[person] = datasets.ImageFolder(root=os.path.join('data', person), transform=img_transforms)
-
-# maps "person" -> array of booleans of where the anchor, positive, and negative images are in the dataset
-is_anchor = {}
-is_positive = {}
-
-for person in PEOPLE:
-    is_anchor[person] = torch.tensor(full_dataset[person].targets) == 0
-    is_positive[person] = torch.tensor(full_dataset[person].targets) == 1
-
-# extract the anchor, positive, and negative img indices
-anchor_indices = {}
-positive_indices = {}
-
-for person in PEOPLE:
-    anchor_indices[person] = is_anchor[person].nonzero().flatten()
-    positive_indices[person] = is_positive[person].nonzero().flatten()
-
-# create the anchor, positive, and negative datasets
-anchor_dataset = {}
-positive_dataset = {}
-
-for person in PEOPLE:
-    anchor_dataset[person] = Subset(full_dataset[person], anchor_indices[person])
-    positive_dataset[person] = Subset(full_dataset[person], positive_indices[person])
+def get_people(data_path=DATA_PATH) -> tuple:
+    return tuple([name for name in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, name))])
+
+
+def build_dataset(data_path=DATA_PATH, dedup_mode="none", dedup_threshold=dedup.threshold) -> list:
+    """Build the shuffled list of (anchor, other, label) pairs from the data folder.
+
+    Near-identical images of the same person (e.g. consecutive frames) can be deduplicated first:
+    with ``dedup_mode="drop"`` only the first image of each cluster of near-duplicates is kept, with
+    ``"weight"`` all of them are kept but every pair gets a weight of 1 / the size of the cluster.
+
+    Args:
+        data_path (str): folder containing one ``anchor``/``positive`` folder pair per person
+        dedup_mode (str): "none", "drop" or "weight"
+        dedup_threshold (int): maximum number of different perceptual hash bits between near-duplicates
+
+    Returns:
+        list: [(anchor_img, other_img, label), ...] where label is 1 for positives and 0 for negatives,
+              with a 4th weight element with ``dedup_mode="weight"``
+    """
+    people = get_people(data_path)
+
+    # maps: "person" -> datasets.ImageFolder
+    full_dataset = {}
+
+    for person in people:
+        full_dataset[person] = datasets.ImageFolder(root=os.path.join(data_path, person), transform=img_transforms)
+
+    # maps "person" -> array of booleans of where the anchor, positive, and negative images are in the dataset
+    is_anchor = {}
+    is_positive = {}
+
+    for person in people:
+        is_anchor[person] = torch.tensor(full_dataset[person].targets) == 0
+        is_positive[person] = torch.tensor(full_dataset[person].targets) == 1
+
+    # extract the anchor, positive, and negative img indices
+    anchor_indices = {}
+    positive_indices = {}
+
+    for person in people:
+        anchor_indices[person] = is_anchor[person].nonzero().flatten()
+        positive_indices[person] = is_positive[person].nonzero().flatten()
+
+    # size of the cluster of near-duplicates of every anchor and positive (all 1 without deduplication)
+    anchor_weights = {person: torch.ones(len(anchor_indices[person])) for person in people}
+    positive_weights = {person: torch.ones(len(positive_indices[person])) for person in people}
+    if dedup_mode != "none":
+        pairs_before = count_pairs(anchor_indices, positive_indices)
+        groups = {}
+        for person in people:
+            for role, indices in (("anchor", anchor_indices), ("positive", positive_indices)):
+                groups[person, role] = [full_dataset[person].samples[i][0] for i in indices[person].tolist()]
+        clusters = dedup.find_near_duplicates(groups, dedup_threshold)
+
+        for person in people:
+            for role, indices, weights in (("anchor", anchor_indices, anchor_weights),
+                                           ("positive", positive_indices, positive_weights)):
+                if dedup_mode == "drop":
+                    first = torch.tensor([rep == i for i, rep in enumerate(clusters[person, role])], dtype=torch.bool)
+                    indices[person] = indices[person][first]
+                    weights[person] = weights[person][first]
+                else:
+                    weights[person] = torch.tensor(dedup.cluster_sizes(clusters[person, role]), dtype=torch.float)
+
+        duplicates = sum(len(group) - len(set(group)) for group in clusters.values())
+        if dedup_mode == "drop":
+            pairs_after = count_pairs(anchor_indices, positive_indices)
+        else:
+            pairs_after = sum(1 / max(a, p) for person in people
+                              for a, p in zip(anchor_weights[person].tolist(), positive_weights[person].tolist()))
+            pairs_after += sum((1 / anchor_weights[person]).sum().item() for person in people
+                               if len(people) > 1)
+        print(f"Deduplication: {duplicates} of {sum(len(group) for group in clusters.values())} images are "
+              f"near-duplicates, epoch size {pairs_before} -> {pairs_after:>0.0f} pairs "
+              f"({(100 * (1 - pairs_after / max(1, pairs_before))):>0.1f}% smaller)")
+
+    # create the anchor, positive, and negative datasets
+    anchor_dataset = {}
+    positive_dataset = {}
+
+    for person in people:
+        anchor_dataset[person] = Subset(full_dataset[person], anchor_indices[person])
+        positive_dataset[person] = Subset(full_dataset[person], positive_indices[person])
+
+    # Now, the datasets are [(img, label), (img, label), (img, label), ...]. We need them to be [img, img, img, ...] only, no label needed since they are already split by label.
+    # WARNING: this takes about 2 minutes to run, please only run it once
+    for person in people:
+        anchor_dataset[person] = [sublist[0] for sublist in list(anchor_dataset[person])]
+        positive_dataset[person] = [sublist[0] for sublist in list(positive_dataset[person])]
+
+    # Zip other people's positives to make each negative
+    negative_dataset = {}
+
+    for person in people:
+        negative_dataset[person] = []
+        for other_person in people:
+            if other_person == person:
+                continue
+            negative_dataset[person].extend(positive_dataset[other_person])
+        np.random.shuffle(negative_dataset[person])
+
+    zipped_pos_dataset = {}
+    zipped_neg_dataset = {}
+
+    for person in people:
+        zipped_pos_dataset[person] = Zipper(IterableWrapper(anchor_dataset[person]), IterableWrapper(positive_dataset[person]), IterableWrapper(torch.ones(len(anchor_dataset[person]))))
+        zipped_neg_dataset[person] = Zipper(IterableWrapper(anchor_dataset[person]), IterableWrapper(negative_dataset[person]), IterableWrapper(torch.zeros(len(anchor_dataset[person]))))
+
+
+        zipped_pos_dataset[person] = list(zipped_pos_dataset[person])
+        zipped_neg_dataset[person] = list(zipped_neg_dataset[person])
+
+        if dedup_mode == "weight":
+            # a pair is as redundant as the most duplicated of its images (negatives are random, only the anchor counts)
+            pair_weights = 1 / torch.maximum(anchor_weights[person][:len(zipped_pos_dataset[person])],
+                                             positive_weights[person][:len(zipped_pos_dataset[person])])
+            zipped_pos_dataset[person] = [(*pair, w) for pair, w in zip(zipped_pos_dataset[person], pair_weights)]
+            zipped_neg_dataset[person] = [(*pair, w) for pair, w in zip(zipped_neg_dataset[person], 1 / anchor_weights[person])]
+
+    # Combine the positive and negative datasets and shuffle them
+    final_dataset = []
+    for person in people:
+        final_dataset += zipped_pos_dataset[person] + zipped_neg_dataset[person]
+
+    np.random.shuffle(final_dataset)
+
+    return final_dataset
+
+
+def count_pairs(anchor_indices: dict, positive_indices: dict) -> int:
+    """Number of pairs ``build_dataset`` makes: a positive per anchor with a positive left, and a negative per anchor."""
+    total = sum(min(len(anchor_indices[person]), len(positive_indices[person])) for person in anchor_indices)
+    if len(anchor_indices) > 1:
+        total += sum(len(indices) for indices in anchor_indices.values())
+    return total
 
-# Now, the datasets are [(img, label), (img, label), (img, label), ...]. We need them to be [img, img, img, ...] only, no label needed since they are already split by label.
-# WARNING: this takes about 2 minutes to run, please only run it once
-for person in PEOPLE:
-    anchor_dataset[person] = [sublist[0] for sublist in list(anchor_dataset[person])]
-    positive_dataset[person] = [sublist[0] for sublist in list(positive_dataset[person])]
-
-# Zip other people's positives to make each negative
-negative_dataset = {}
-
-for person in PEOPLE:
-    negative_dataset[person] = []
-    for other_person in PEOPLE:
-        if other_person == person:
-            continue
-        negative_dataset[person].extend(positive_dataset[other_person])
-    np.random.shuffle(negative_dataset[person])
-
-zipped_pos_dataset = {}
-zipped_neg_dataset = {}
-
-for person in PEOPLE:
-    zipped_pos_dataset[person] = Zipper(IterableWrapper(anchor_dataset[person]), IterableWrapper(positive_dataset[person]), IterableWrapper(torch.ones(len(anchor_dataset[person]))))
-    zipped_neg_dataset[person] = Zipper(IterableWrapper(anchor_dataset[person]), IterableWrapper(negative_dataset[person]), IterableWrapper(torch.zeros(len(anchor_dataset[person]))))
-
-    zipped_pos_dataset[person] = list(zipped_pos_dataset[person])
-    zipped_neg_dataset[person] = list(zipped_neg_dataset[person])
-
-# Combine the positive and negative datasets and shuffle them
-final_dataset = []
-for person in PEOPLE:
-    final_dataset += zipped_pos_dataset[person] + zipped_neg_dataset[person]
-
-np.random.shuffle(final_dataset)
 
 #############################################################
 #####                    Data Loading                   #####
 #############################################################
 
-batch_size = 64
+def split_dataset(final_dataset: list, generator: torch.Generator = None) -> tuple[TensorDataset, TensorDataset]:
+    """Split the pairs between training and testing 80-20.
 
-# split between training and testing 80-20
-train_set, test_set = random_split(final_dataset, [int(len(final_dataset) * 0.8), len(final_dataset) - int(len(final_dataset) * 0.8)])
-train_dataloader : DataLoader = DataLoader(train_set, batch_size=batch_size, shuffle=True)
-test_dataloader : DataLoader = DataLoader(test_set, batch_size=batch_size, shuffle=True)
+    The splits are stacked into tensor datasets so they can be shared with worker processes
+    as three shared-memory tensors instead of thousands of small ones.
 
-# Get cpu or gpu device for training.
-device = "cuda" if torch.cuda.is_available() else "cpu"
+    Args:
+        final_dataset (list): output of ``build_dataset``
+        generator (torch.Generator): generator for the split, pass a seeded one to get the same split on every rank
+
+    Returns:
+        tuple[TensorDataset, TensorDataset]: the training and testing sets
+    """
+    train_size = int(len(final_dataset) * 0.8)
+    train_set, test_set = random_split(final_dataset, [train_size, len(final_dataset) - train_size],
+                                       generator=generator or torch.default_generator)
+    return to_tensor_dataset(train_set), to_tensor_dataset(test_set)
+
+
+def to_tensor_dataset(pairs) -> TensorDataset:
+    # (anchors, others, labels) and the pair weights with deduplication by weight
+    return TensorDataset(*(torch.stack(column) for column in zip(*pairs)))
 
 
 ######################################################
@@ -108,30 +227,33 @@ device = "cuda" if torch.cuda.is_available() else "cpu"
 ######################################################
 
 class EmbeddingNetwork(nn.Module):
-    def __init__(self):
+    def __init__(self, channels=CHANNELS):
         super(EmbeddingNetwork, self).__init__()
-        
-        # layers
+
+        # layers (channel counts are for the default architecture)
         # first layer: 3 input channels, 64 output channels
-        self.l1 = nn.Conv2d(3, 64, 10, padding=1)
+        self.l1 = nn.Conv2d(3, channels[0], 10, padding=1)
         self.a1 = nn.ReLU()
         self.p1 = nn.MaxPool2d(2)
-        
+
         # second layer: 64 input channels, 128 output channels
-        self.l2 = nn.Conv2d(64, 128, 7, padding=1)
+        self.l2 = nn.Conv2d(channels[0], channels[1], 7, padding=1)
         self.a2 = nn.ReLU()
         self.p2 = nn.MaxPool2d(2)
-        
+
         # third layer: 128 input channels, 128 output channels
-        self.l3 = nn.Conv2d(128, 128, 4, padding=1)
+        self.l3 = nn.Conv2d(channels[1], channels[2], 4, padding=1)
         self.a3 = nn.ReLU()
         self.p3 = nn.MaxPool2d(2)
-        
+
         # fourth layer: 128 input channels, 256 output channels
-        self.l4 = nn.Conv2d(128, 256, 4, padding=1)
+        self.l4 = nn.Conv2d(channels[2], channels[3], 4, padding=1)
         self.a4 = nn.ReLU()
         self.p4 = nn.Flatten()
 
+        # recompute the activations of each block during the backward pass instead of keeping them
+        self.checkpointing = False
+
     def forward(self, x):
         """Pass the input tensor through the embeddding network.
 
@@ -141,36 +263,33 @@ class EmbeddingNetwork(nn.Module):
         Returns:
             torch.Tensor: output tensor, 4096 channels
         """
-        x = self.l1(x)
-        x = self.a1(x)
-        x = self.p1(x)
-        
-        x = self.l2(x)
-        x = self.a2(x)
-        x = self.p2(x)
-        
-        x = self.l3(x)
-        x = self.a3(x)
-        x = self.p3(x)
-        
-        x = self.l4(x)
-        x = self.a4(x)
-        x = self.p4(x)
-        
+        blocks = (
+            nn.Sequential(self.l1, self.a1, self.p1),
+            nn.Sequential(self.l2, self.a2, self.p2),
+            nn.Sequential(self.l3, self.a3, self.p3),
+            nn.Sequential(self.l4, self.a4, self.p4),
+        )
+        for block in blocks:
+            if self.checkpointing and self.training and torch.is_grad_enabled():
+                x = torch.utils.checkpoint.checkpoint(block, x, use_reentrant=False)
+            else:
+                x = block(x)
+
         return x
 
 class SiameseNetwork(nn.Module):
-    def __init__(self):
+    def __init__(self, channels=CHANNELS, features=FEATURES):
         super(SiameseNetwork, self).__init__()
-        
+
         # embedding layer
-        self.embedding_layer = EmbeddingNetwork()
-        
+        self.embedding_layer = EmbeddingNetwork(channels)
+
         # fully connected classification layer
         # 2 classes: 0 (negative) and 1 (positive)
-        self.feature_vector = nn.Linear(20736, 4096)
-        self.classification_layer = nn.Linear(4096, 2)
-        
+        # the embedding is a 9x9 map per output channel: 256 * 9 * 9 = 20736 by default
+        self.feature_vector = nn.Linear(channels[3] * EMBEDDING_AREA, features)
+        self.classification_layer = nn.Linear(features, 2)
+
     def forward(self, anchor, db_image):
         """Pass the input tensor through the siamese network.
 
@@ -184,65 +303,328 @@ class SiameseNetwork(nn.Module):
         # pass through embedding layer
         anchor = self.embedding_layer(anchor)
         db_image = self.embedding_layer(db_image)
-        
+
         # calculate the absolute difference between the two embeddings
         dist = torch.abs(anchor - db_image)
-        
+
         # pass through fully connected classification layer
         x = self.feature_vector(dist)
         x = self.classification_layer(x)
-        
+
         return x
 
-model = SiameseNetwork().to(device)
 
-# using cross entropy loss function and adam optimizer
-loss_fn = nn.CrossEntropyLoss()
-optimizer = torch.optim.Adam(model.parameters(recurse=True), lr=0.00001)
+def architecture(state_dict: dict) -> tuple[tuple, int]:
+    """Read the conv channels and feature size of a saved ``SiameseNetwork`` from its weights.
+
+    Args:
+        state_dict (dict): state dict of a ``SiameseNetwork``
+
+    Returns:
+        tuple[tuple, int]: the ``channels`` and ``features`` arguments to rebuild the network
+    """
+    channels = tuple(state_dict[f"embedding_layer.l{i}.weight"].shape[0] for i in range(1, 5))
+    return channels, state_dict["feature_vector.weight"].shape[0]
+
+
+def load_model(path: str) -> SiameseNetwork:
+    state_dict = torch.load(path, map_location="cpu", weights_only=False)
+    model = SiameseNetwork(*architecture(state_dict))
+    model.load_state_dict(state_dict)
+    return model
 
-def train(dataloader, model, loss_fn, optimizer):
+
+#########################################################
+#####                    Training                   #####
+#########################################################
+
+def bf16_supported() -> bool:
+    """Whether the CPU has native bf16 instructions (AVX-512 BF16 or AMX), without them bf16 is emulated and slower."""
+    if device == "cuda":
+        return torch.cuda.is_bf16_supported()
+    return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+
+
+def autocast(bf16: bool):
+    """Run the convs and matmuls in bf16 while the weights, gradients and optimizer state stay in fp32."""
+    return torch.autocast(device_type=device, dtype=torch.bfloat16, enabled=bf16)
+
+
+def with_last(iterable):
+    """Yield (item, whether it is the last one), reading one item ahead."""
+    end = object()
+    iterator = iter(iterable)
+    item = next(iterator, end)
+    while item is not end:
+        following = next(iterator, end)
+        yield item, following is end
+        item = following
+
+
+def train(dataloader, model, loss_fn, optimizer, augmentation=False, profiler=None, bf16=False,
+          accumulation_steps=1):
+    """Train the model for one epoch.
+
+    With ``accumulation_steps`` > 1 the gradients of that many batches are summed before each optimizer
+    step, which behaves like a batch that many times larger while only holding one batch in memory.
+    """
     model.train()
-    # Loop over the dataset
-    for batch, (X, Y, z) in enumerate(dataloader):
+    optimizer.zero_grad()
+    # Loop over the dataset. The batches are counted as they come: with --shards and several workers, every
+    # worker batches its own pairs so the loader yields more batches than len(dataloader)
+    for batch, ((X, Y, z), last) in enumerate(profiling.iterate(with_last(dataloader), profiler, "train")):
         X, Y, z = X.to(device), Y.to(device), z.to(device)
         z = z.type(torch.LongTensor)
 
-        pred = model(X, Y)
-        loss = loss_fn(pred, z)
-
-        optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
-
-def test(dataloader, model, loss_fn):
-    size = len(dataloader.dataset)
-    num_batches = len(dataloader)
+        if augmentation:
+            X, Y = augment.augment_batch(X), augment.augment_batch(Y)
+
+        group_size = batch % accumulation_steps + 1
+        step = group_size == accumulation_steps or last
+
+        # DDP only needs to all-reduce the gradients once they are complete
+        sync = model.no_sync() if isinstance(model, DistributedDataParallel) and not step else nullcontext()
+        with sync:
+            with autocast(bf16):
+                pred = model(X, Y)
+                loss = loss_fn(pred, z) / accumulation_steps
+            loss.backward()
+
+        if step:
+            if group_size < accumulation_steps:
+                # the last group of the epoch may have fewer batches, average over the batches it has
+                for parameter in model.parameters():
+                    if parameter.grad is not None:
+                        parameter.grad.mul_(accumulation_steps / group_size)
+            optimizer.step()
+            optimizer.zero_grad()
+
+def test(dataloader, model, loss_fn, profiler=None, bf16=False):
     model.eval()
-    test_loss, correct = 0, 0
+    test_loss, correct, size, num_batches = 0, 0, 0, 0
 
-    with torch.no_grad(): # for memory efficiency when testing
-        for X, Y, z in dataloader:
+    with torch.no_grad(), autocast(bf16): # for memory efficiency when testing
+        for X, Y, z in profiling.iterate(dataloader, profiler, "test"):
+            num_batches += 1
             X, Y, z = X.to(device), Y.to(device), z.to(device)
             z = z.type(torch.LongTensor)
 
             pred = model(X, Y)
             test_loss += loss_fn(pred, z).item()
             correct += (pred.argmax(1) == z).type(torch.float).sum().item()
+            size += len(z)
+
+    # each process only sees its shard of the test set, so sum the totals over all of them
+    test_loss, correct, size, num_batches = distributed.all_reduce_sum(test_loss, correct, size, num_batches)
 
     test_loss /= num_batches
     correct /= size
-    print(f"Accuracy: {(100*correct):>0.1f}%, Avg loss: {test_loss:>8f} \n")
-
-epochs = 5
-for t in range(epochs):
-    print(f"Epoch {t+1}: -------------------------------")
-    # Train the model
-    train(train_dataloader, model, loss_fn, optimizer)
-    # Test the model
-    test(test_dataloader, model, loss_fn)
-print("Done!")
-
-
-# Saving the model in a file, we will use it in the next cell
-torch.save(model.state_dict(), "model.pth")
-# print("Saved PyTorch Model State to model.pth")
+    if distributed.is_main_process():
+        print(f"Accuracy: {(100*correct):>0.1f}%, Avg loss: {test_loss:>8f} \n")
+
+    return correct
+
+
+def run(rank: int, world_size: int, local_world_size: int, train_set, test_set, args):
+    """Train and save the model in one process.
+
+    With a world size of 1 this is plain single-process training. Otherwise the process joins the
+    gloo group, trains on its shard of the data and the gradients are all-reduced by DDP.
+
+    Args:
+        rank (int): global rank of this process
+        world_size (int): total number of processes
+        local_world_size (int): number of processes on this node (used to split the cores)
+        train_set (TensorDataset): training pairs (None when streaming from ``args.shards``)
+        test_set (TensorDataset): testing pairs (None when streaming from ``args.shards``)
+        args (argparse.Namespace): command line arguments
+    """
+    if world_size > 1:
+        distributed.setup(rank, world_size)
+        torch.set_num_threads(distributed.threads_per_process(local_world_size))
+
+    streaming = args.shards is not None
+    if streaming:
+        # each rank streams the pairs from its own shards
+        train_set = shards.PairStream(args.shards, "train", args.seed, num_workers=args.workers,
+                                      rank=rank, world_size=world_size, include_failed=args.include_failed)
+        test_set = shards.PairStream(args.shards, "test", args.seed, num_workers=args.workers,
+                                     rank=rank, world_size=world_size)
+
+    # with --dedup weight the pairs come with a weight, they are used to sample the training pairs instead
+    train_weights = None
+    if not streaming and len(train_set.tensors) == 4:
+        train_weights = train_set.tensors[3]
+        train_set, test_set = TensorDataset(*train_set.tensors[:3]), TensorDataset(*test_set.tensors[:3])
+
+    bf16 = args.precision == "bf16"
+    if bf16 and not bf16_supported():
+        if distributed.is_main_process():
+            print("This CPU has no native bf16 support, training in fp32")
+        bf16 = False
+
+    # same seed everywhere so every rank starts from the same weights
+    torch.manual_seed(args.seed)
+
+    model = SiameseNetwork().to(device)
+    model.embedding_layer.checkpointing = args.activation_checkpointing
+
+    # using cross entropy loss function and adam optimizer
+    loss_fn = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(model.parameters(recurse=True), lr=args.lr)
+
+    # every rank loads the same checkpoint, so they all resume from the same weights and epoch
+    start_epoch, best_accuracy = 0, 0.0
+    if args.resume:
+        start_epoch, best_accuracy = checkpoint.restore(args.resume, model, optimizer)
+
+    train_sampler, test_sampler = None, None
+    if world_size > 1:
+        model = DistributedDataParallel(model)
+    if world_size > 1 and not streaming:
+        train_sampler = DistributedSampler(train_set, num_replicas=world_size, rank=rank, shuffle=True, seed=args.seed)
+        test_sampler = DistributedSampler(test_set, num_replicas=world_size, rank=rank, shuffle=False)
+    sampler_generator = None
+    if train_weights is not None:
+        # near-duplicate pairs are drawn less often, and an epoch shrinks to the total weight
+        sampler_generator = torch.Generator()
+        train_sampler = WeightedRandomSampler(train_weights, max(1, round(train_weights.sum().item() / world_size)),
+                                              generator=sampler_generator)
+
+    # keep the global batch size the same as single-process training, split in accumulation steps
+    local_batch_size = max(1, args.batch_size // (world_size * args.accumulation_steps))
+    train_dataloader : DataLoader = DataLoader(train_set, batch_size=local_batch_size, num_workers=args.workers,
+                                               shuffle=train_sampler is None and not streaming, sampler=train_sampler)
+    test_dataloader : DataLoader = DataLoader(test_set, batch_size=local_batch_size, num_workers=args.workers,
+                                              shuffle=test_sampler is None and not streaming, sampler=test_sampler)
+
+    # checkpoints are written in the background by the main process only
+    writer = None
+    if args.checkpoint_dir and distributed.is_main_process():
+        os.makedirs(args.checkpoint_dir, exist_ok=True)
+        writer = checkpoint.AsyncCheckpointWriter()
+
+    profiler = None
+    if args.profile and distributed.is_main_process():
+        profiler = profiling.Profiler(args.profile, args.profile_every)
+
+    for t in range(start_epoch, args.epochs):
+        if distributed.is_main_process():
+            print(f"Epoch {t+1}: -------------------------------")
+        if isinstance(train_sampler, DistributedSampler):
+            train_sampler.set_epoch(t)
+        elif sampler_generator is not None:
+            # like DistributedSampler.set_epoch, the draws only depend on (seed, epoch, rank) so resuming is exact
+            sampler_generator.manual_seed((args.seed + t) * world_size + rank)
+        elif streaming:
+            train_set.set_epoch(t)
+        # Train the model
+        start = time.perf_counter()
+        train(train_dataloader, model, loss_fn, optimizer, args.augment, profiler, bf16, args.accumulation_steps)
+        if distributed.is_main_process():
+            print(f"Training time: {(time.perf_counter() - start):>0.1f}s")
+        # Test the model
+        accuracy = test(test_dataloader, model, loss_fn, profiler, bf16)
+
+        if writer is not None:
+            if accuracy > best_accuracy:
+                writer.save(checkpoint.snapshot_state_dict(unwrap(model)),
+                            os.path.join(args.checkpoint_dir, checkpoint.BEST_MODEL))
+            if (t + 1) % args.checkpoint_every == 0 or t + 1 == args.epochs:
+                writer.save(checkpoint.capture(unwrap(model), optimizer, t + 1, max(best_accuracy, accuracy)),
+                            os.path.join(args.checkpoint_dir, checkpoint.LAST_CHECKPOINT))
+        best_accuracy = max(best_accuracy, accuracy)
+
+    if distributed.is_main_process():
+        print("Done!")
+        if writer is not None:
+            writer.close()
+        if profiler is not None:
+            profiling.print_summary(profiler.close())
+
+        best_path = os.path.join(args.checkpoint_dir or "", checkpoint.BEST_MODEL)
+        if args.select_best and os.path.exists(best_path):
+            print(f"Using the best model ({(100*best_accuracy):>0.1f}% accuracy)")
+            shutil.copyfile(best_path, args.output)
+        else:
+            # Saving the model in a file (unwrapped so the backend can load it)
+            torch.save(unwrap(model).state_dict(), args.output)
+
+    distributed.cleanup()
+
+
+def unwrap(model: nn.Module) -> nn.Module:
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+def parse_args(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Train the siamese face recognition model.")
+    parser.add_argument("--data", default=DATA_PATH, help="folder containing the training images")
+    parser.add_argument("--shards", default=None,
+                        help="folder of shards written by ingest.py to stream the pairs from (replaces --data)")
+    parser.add_argument("--include-failed", action="store_true",
+                        help="also train on the failed login photos exported by export_logins.py as hard negatives")
+    parser.add_argument("--dedup", choices=dedup.MODES, default="none",
+                        help="drop or down-weight near-duplicate images of the same person before building the pairs")
+    parser.add_argument("--dedup-threshold", type=int, default=dedup.threshold,
+                        help="maximum number of different perceptual hash bits between near-duplicates")
+    parser.add_argument("--workers", type=int, default=0, help="number of data loading processes per rank")
+    parser.add_argument("--output", default=MODEL_PATH, help="where to save the trained state dict")
+    parser.add_argument("--epochs", type=int, default=epochs)
+    parser.add_argument("--batch-size", type=int, default=batch_size, help="global batch size over all processes")
+    parser.add_argument("--accumulation-steps", type=int, default=1,
+                        help="split each batch into this many smaller batches whose gradients are accumulated")
+    parser.add_argument("--activation-checkpointing", action="store_true",
+                        help="recompute the conv activations during the backward pass to save memory")
+    parser.add_argument("--lr", type=float, default=lr)
+    parser.add_argument("--seed", type=int, default=seed)
+    parser.add_argument("--precision", choices=("fp32", "bf16"), default="fp32",
+                        help="bf16 runs the forward pass in bf16 autocast (fp32 weights), on CPUs with native bf16 support")
+    parser.add_argument("--no-augment", dest="augment", action="store_false",
+                        help="disable the random flip, crop and brightness augmentation of the training batches")
+    parser.add_argument("--nprocs", type=int, default=1,
+                        help="number of local training processes (ignored when launched with torchrun)")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="folder to write checkpoints to (checkpointing is disabled if not set)")
+    parser.add_argument("--checkpoint-every", type=int, default=1, help="number of epochs between checkpoints")
+    parser.add_argument("--resume", default=None, help="checkpoint to resume training from")
+    parser.add_argument("--select-best", action="store_true",
+                        help="save the epoch with the best validation accuracy instead of the last one")
+    parser.add_argument("--profile", default=None,
+                        help="folder to write profiler traces and a summary of the run to (profiling is disabled if not set)")
+    parser.add_argument("--profile-every", type=int, default=50, help="number of steps between profiler traces")
+    args = parser.parse_args(argv)
+
+    if args.select_best and not args.checkpoint_dir:
+        parser.error("--select-best requires --checkpoint-dir")
+
+    return args
+
+
+def main():
+    args = parse_args()
+
+    # seed the data organization so every rank builds the same pairs
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    split_generator = torch.Generator().manual_seed(args.seed)
+
+    if args.shards:
+        # the pairs are streamed by each process
+        train_set, test_set = None, None
+    else:
+        train_set, test_set = split_dataset(build_dataset(args.data, args.dedup, args.dedup_threshold), split_generator)
+
+    if distributed.launched_with_torchrun():
+        # multi-node: every process built the same dataset, torchrun provides the rendezvous
+        run(int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"]),
+            int(os.environ.get("LOCAL_WORLD_SIZE", 1)), train_set, test_set, args)
+    elif args.nprocs > 1:
+        # single node: the dataset tensors are shared with the spawned workers
+        mp.spawn(run, args=(args.nprocs, args.nprocs, train_set, test_set, args), nprocs=args.nprocs)
+    else:
+        run(0, 1, 1, train_set, test_set, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import TensorDataset
+
+import augment
+import dedup
+import evaluate
+import model
+
+CACHE_DIR = os.path.join("cache", "pipeline")
+STAGE_FILE = "stage.json"
+# stat cache of the data files, so unchanged files are not read again to be hashed
+FILE_HASHES = "file-hashes.json"
+STAGES = ("prepare", "train", "eval", "export")
+
+# training options that do not change the trained weights, left out of the train stage's key
+UNKEYED_TRAINING_OPTIONS = ("data", "dedup", "dedup_threshold", "shards", "output", "workers", "nprocs", "checkpoint_dir", "checkpoint_every",
+                            "resume", "profile", "profile_every")
+
+
+##################################################################
+#####                          Hashing                       #####
+##################################################################
+
+def hash_bytes(*parts: bytes | str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode() if isinstance(part, str) else part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_folder(folder: str, cache_dir: str) -> str:
+    """Hash the names and contents of every file of a folder.
+
+    A file is only read again if its size or modification time changed since the last run.
+    """
+    cache_path = os.path.join(cache_dir, FILE_HASHES)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    entries = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            stat = os.stat(path)
+            key = os.path.abspath(path)
+            if key not in cache or cache[key]["stat"] != [stat.st_size, stat.st_mtime_ns]:
+                cache[key] = {"stat": [stat.st_size, stat.st_mtime_ns], "sha256": hash_file(path)}
+            entries.append(f"{os.path.relpath(path, folder)}:{cache[key]['sha256']}")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_path + ".tmp", "w") as f:
+        json.dump(cache, f)
+    os.replace(cache_path + ".tmp", cache_path)
+    return hash_bytes(*entries)
+
+
+def hash_code(*objects) -> str:
+    """Hash the source of the functions, classes and modules a stage runs, so editing them reruns the stage."""
+    return hash_bytes(*(inspect.getsource(obj) for obj in objects))
+
+
+def hash_config(config: dict) -> str:
+    return hash_bytes(json.dumps(config, sort_keys=True, default=str))
+
+
+##################################################################
+#####                           Stages                       #####
+##################################################################
+# Every stage writes its outputs to ``<cache dir>/<stage>-<key>``, where the key hashes the stage's
+# inputs: the hashes of the outputs of the stages it depends on, its config and its code. A stage
+# whose folder already exists is skipped. The folder is built under a temporary name and renamed
+# once complete, so an interrupted stage is simply run again.
+
+def run_stage(name: str, inputs: dict, build, cache_dir: str, force: bool = False) -> dict:
+    """Run a stage unless its outputs for the same inputs are already cached.
+
+    Args:
+        name (str): name of the stage
+        inputs (dict): everything the outputs depend on (hashes and config values)
+        build: function writing the stage's outputs to the folder it is given
+        cache_dir (str): folder of the stage outputs
+        force (bool): run the stage even if it is cached
+
+    Returns:
+        dict: the stage record, with the output ``folder`` and the ``output_hash`` of its files
+    """
+    key = hash_config(inputs)
+    folder = os.path.join(cache_dir, f"{name}-{key[:16]}")
+    record_path = os.path.join(folder, STAGE_FILE)
+
+    if os.path.exists(record_path) and not force:
+        with open(record_path) as f:
+            record = json.load(f)
+        print(f"[{name}] up to date ({os.path.basename(folder)})")
+        return {**record, "folder": folder}
+
+    print(f"[{name}] running ({os.path.basename(folder)})")
+    start = time.perf_counter()
+    tmp = folder + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    build(tmp)
+
+    outputs = sorted(file for file in os.listdir(tmp))
+    record = {
+        "stage": name,
+        "inputs": inputs,
+        "output_hash": hash_bytes(*(f"{file}:{hash_file(os.path.join(tmp, file))}" for file in outputs)),
+        "seconds": round(time.perf_counter() - start, 1),
+    }
+    with open(os.path.join(tmp, STAGE_FILE), "w") as f:
+        json.dump(record, f, indent=2)
+
+    shutil.rmtree(folder, ignore_errors=True)
+    os.replace(tmp, folder)
+    print(f"[{name}] done in {record['seconds']}s")
+    return {**record, "folder": folder}
+
+
+def prepare(args) -> dict:
+    """Organize the data folder into the train/test pairs."""
+    inputs = {
+        "data": hash_folder(args.data, args.cache_dir),
+        "seed": args.seed,
+        "dedup": [args.dedup, args.dedup_threshold],
+        "code": hash_code(model.get_people, model.build_dataset, model.split_dataset, model.to_tensor_dataset, dedup),
+        "transforms": repr(model.img_transforms),
+    }
+
+    def build(folder):
+        np.random.seed(args.seed)
+        torch.manual_seed(args.seed)
+        train_set, test_set = model.split_dataset(model.build_dataset(args.data, args.dedup, args.dedup_threshold),
+                                                  torch.Generator().manual_seed(args.seed))
+        torch.save({"train": train_set.tensors, "test": test_set.tensors}, os.path.join(folder, "pairs.pt"))
+
+    return run_stage("prepare", inputs, build, args.cache_dir, args.force == "prepare")
+
+
+def train(args, prepared: dict) -> dict:
+    """Train the model on the prepared pairs, with the training options forwarded to ``model.py``."""
+    training_args = model.parse_args(args.training_args)
+    config = {key: value for key, value in vars(training_args).items() if key not in UNKEYED_TRAINING_OPTIONS}
+    inputs = {
+        "pairs": prepared["output_hash"],
+        "config": config,
+        "code": hash_code(model.EmbeddingNetwork, model.SiameseNetwork, model.train, model.test, model.run, augment),
+    }
+
+    def build(folder):
+        pairs = torch.load(os.path.join(prepared["folder"], "pairs.pt"), mmap=True)
+        training_args.output = os.path.join(folder, model.MODEL_PATH)
+        training_args.shards, training_args.resume = None, None
+        model.run(0, 1, 1, TensorDataset(*pairs["train"]), TensorDataset(*pairs["test"]), training_args)
+
+    return run_stage("train", inputs, build, args.cache_dir, args.force == "train")
+
+
+def evaluation(args, trained: dict) -> dict:
+    """Evaluate the trained model on every anchor/candidate pair of the data folder."""
+    inputs = {
+        "model": trained["output_hash"],
+        "data": hash_folder(args.data, args.cache_dir),
+        "code": hash_code(evaluate),
+    }
+
+    def build(folder):
+        report = evaluate.evaluate(model.load_model(os.path.join(trained["folder"], model.MODEL_PATH)), args.data)
+        with open(os.path.join(folder, "report.json"), "w") as f:
+            json.dump(report, f, indent=2)
+
+    record = run_stage("eval", inputs, build, args.cache_dir, args.force == "eval")
+    with open(os.path.join(record["folder"], "report.json")) as f:
+        report = json.load(f)
+    print(f"[eval] accuracy: {(100*report['accuracy']):>0.1f}%, AUC: {report['auc']:>0.4f}, "
+          f"EER: {(100*report['eer']):>0.1f}%")
+    return record
+
+
+def export(args, trained: dict):
+    """Copy the trained model to ``args.output``, unless it is already there."""
+    source = os.path.join(trained["folder"], model.MODEL_PATH)
+    if os.path.exists(args.output) and hash_file(args.output) == hash_file(source) and args.force != "export":
+        print(f"[export] up to date ({args.output})")
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    shutil.copyfile(source, args.output + ".tmp")
+    os.replace(args.output + ".tmp", args.output)
+    print(f"[export] {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the training pipeline up to a stage, skipping the stages whose inputs did not change.",
+        epilog="Any other option is forwarded to the training (see python model.py --help), e.g. --epochs 10.")
+    parser.add_argument("stage", nargs="?", choices=STAGES, default="export",
+                        help="last stage to run, the stages it depends on are run first (default: export)")
+    parser.add_argument("--data", default=model.DATA_PATH, help="folder containing the training images")
+    parser.add_argument("--seed", type=int, default=model.seed, help="seed of the data organization and split")
+    parser.add_argument("--dedup", choices=dedup.MODES, default="none",
+                        help="drop or down-weight near-duplicate images of the same person in the prepare stage")
+    parser.add_argument("--dedup-threshold", type=int, default=dedup.threshold,
+                        help="maximum number of different perceptual hash bits between near-duplicates")
+    parser.add_argument("--output", default=model.MODEL_PATH, help="where the export stage copies the trained model")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="folder of the stage outputs")
+    parser.add_argument("--force", choices=STAGES, default=None, help="run this stage even if it is up to date")
+    args, training_args = parser.parse_known_args()
+    args.training_args = ["--seed", str(args.seed)] + training_args
+
+    prepared = prepare(args)
+    if args.stage == "prepare":
+        return
+
+    trained = train(args, prepared)
+    if args.stage in ("eval", "export"):
+        evaluation(args, trained)
+    if args.stage == "export":
+        export(args, trained)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import json
+import os
+import time
+from collections import defaultdict
+
+from torch.profiler import ProfilerActivity, profile, schedule
+
+# number of steps recorded in each trace, and of steps run before them to warm the profiler up
+active_steps = 3
+warmup_steps = 1
+top_operators = 15
+
+
+class Profiler:
+    """Opt-in profiling of the training and testing loops.
+
+    Every step is timed to split the time spent waiting for the data loader from the time spent
+    computing. Every ``every`` steps a few steps are recorded with ``torch.profiler``: the trace is
+    exported for chrome://tracing or TensorBoard and its operator times are added to the summary.
+
+    Args:
+        output_dir (str): folder to write the traces and the summary to
+        every (int): number of steps between traces
+    """
+
+    def __init__(self, output_dir: str, every: int = 50):
+        self.output_dir = output_dir
+        self.run_name = time.strftime("%Y%m%d-%H%M%S")
+        self.data_wait = defaultdict(float)
+        self.compute = defaultdict(float)
+        self.steps = defaultdict(int)
+        self.operators = defaultdict(lambda: {"self_cpu_ms": 0.0, "count": 0})
+        self.traces = []
+
+        os.makedirs(output_dir, exist_ok=True)
+        self._profile = profile(
+            activities=[ProfilerActivity.CPU],
+            schedule=schedule(wait=max(0, every - warmup_steps - active_steps), warmup=warmup_steps,
+                              active=active_steps),
+            on_trace_ready=self._trace_ready,
+            record_shapes=True,
+        )
+        self._profile.start()
+
+    def iterate(self, dataloader, phase: str):
+        """Iterate over ``dataloader`` while timing the data wait and the compute of each step.
+
+        Args:
+            dataloader: the data loader of the loop
+            phase (str): "train" or "test"
+        """
+        iterator = iter(dataloader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self.data_wait[phase] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            yield batch
+            self.compute[phase] += time.perf_counter() - start
+            self.steps[phase] += 1
+            self._profile.step()
+
+    def close(self) -> dict:
+        """Stop profiling and write the summary of the run.
+
+        Returns:
+            dict: the summary
+        """
+        self._profile.stop()
+
+        phases = {}
+        for phase in self.steps:
+            total = self.data_wait[phase] + self.compute[phase]
+            phases[phase] = {
+                "steps": self.steps[phase],
+                "data_wait_s": round(self.data_wait[phase], 3),
+                "compute_s": round(self.compute[phase], 3),
+                "data_wait_fraction": round(self.data_wait[phase] / total, 4) if total else 0.0,
+            }
+
+        operators = sorted(self.operators.items(), key=lambda item: item[1]["self_cpu_ms"], reverse=True)
+        summary = {
+            "phases": phases,
+            "top_operators": [{"name": name, **stats} for name, stats in operators[:top_operators]],
+            "traces": self.traces,
+        }
+        with open(os.path.join(self.output_dir, f"summary-{self.run_name}.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+    def _trace_ready(self, prof):
+        name = f"trace-{self.run_name}-{prof.step_num}.json"
+        prof.export_chrome_trace(os.path.join(self.output_dir, name))
+        self.traces.append(name)
+
+        for event in prof.key_averages():
+            # the step markers span the whole step, they are not operators
+            if event.key.startswith("ProfilerStep"):
+                continue
+            self.operators[event.key]["self_cpu_ms"] += event.self_cpu_time_total / 1000
+            self.operators[event.key]["count"] += event.count
+
+
+def iterate(dataloader, profiler: Profiler | None, phase: str):
+    """Iterate over ``dataloader`` through the profiler, if profiling is enabled."""
+    return dataloader if profiler is None else profiler.iterate(dataloader, phase)
+
+
+def print_summary(summary: dict):
+    for phase, stats in summary["phases"].items():
+        print(f"{phase}: {stats['steps']} steps, {stats['data_wait_s']:>0.1f}s waiting for data, "
+              f"{stats['compute_s']:>0.1f}s computing ({(100*stats['data_wait_fraction']):>0.1f}% data wait)")
+    print("Top operators by self CPU time:")
+    for operator in summary["top_operators"][:10]:
+        print(f"  {operator['self_cpu_ms']:>10.1f} ms  {operator['count']:>6}x  {operator['name']}")
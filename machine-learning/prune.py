@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from distill import login_latency_ms, parameter_megabytes
+from model import (DATA_PATH, EMBEDDING_AREA, MODEL_PATH, SiameseNetwork, build_dataset, device, load_model,
+                   split_dataset, test, train)
+
+OUTPUT_DIR = "pruned"
+REPORT_FILE = "report.json"
+# fraction of the output channels of every conv layer that is removed
+ratios = (0.25, 0.5, 0.75)
+batch_size = 64
+lr = 0.00001
+finetune_epochs = 2
+
+CONV_LAYERS = ("l1", "l2", "l3", "l4")
+
+
+##################################################################
+#####                          Pruning                       #####
+##################################################################
+
+def channel_importance(conv: nn.Conv2d) -> torch.Tensor:
+    """L1 norm of the weights of each output channel, channels with small filters contribute little."""
+    return conv.weight.detach().abs().sum(dim=(1, 2, 3))
+
+
+def kept_channels(conv: nn.Conv2d, ratio: float) -> torch.Tensor:
+    """Indices (in their original order) of the most important output channels to keep."""
+    keep = max(1, round(conv.out_channels * (1 - ratio)))
+    return channel_importance(conv).topk(keep).indices.sort().values
+
+
+def prune(model: SiameseNetwork, ratio: float) -> SiameseNetwork:
+    """Remove the least important output channels of the four conv layers.
+
+    The next conv layer loses the matching input channels, and ``feature_vector`` loses the columns of
+    the removed l4 channels (each channel is a ``EMBEDDING_AREA`` block of the flattened embedding), so
+    the pruned network computes the same thing as the original one without the removed channels.
+
+    Args:
+        model (SiameseNetwork): the trained network (not modified)
+        ratio (float): fraction of the channels to remove from each layer
+
+    Returns:
+        SiameseNetwork: a smaller network with the same state dict format
+    """
+    embedding = model.embedding_layer
+    keep = [kept_channels(getattr(embedding, name), ratio) for name in CONV_LAYERS]
+    pruned = SiameseNetwork(tuple(len(k) for k in keep), model.feature_vector.out_features)
+
+    with torch.no_grad():
+        previous = torch.arange(3)
+        for name, channels in zip(CONV_LAYERS, keep):
+            source, target = getattr(embedding, name), getattr(pruned.embedding_layer, name)
+            target.weight.copy_(source.weight[channels][:, previous])
+            target.bias.copy_(source.bias[channels])
+            previous = channels
+
+        columns = (previous[:, None] * EMBEDDING_AREA + torch.arange(EMBEDDING_AREA)).flatten()
+        pruned.feature_vector.weight.copy_(model.feature_vector.weight[:, columns])
+        pruned.feature_vector.bias.copy_(model.feature_vector.bias)
+        pruned.classification_layer.load_state_dict(model.classification_layer.state_dict())
+    return pruned
+
+
+##################################################################
+#####                        Benchmarking                    #####
+##################################################################
+
+def activation_megabytes(model: SiameseNetwork) -> float:
+    """Memory of the intermediate tensors of the embedding network for a single-pair forward pass."""
+    total = 0
+
+    def hook(module, inputs, output):
+        nonlocal total
+        total += output.numel() * output.element_size()
+
+    handles = [module.register_forward_hook(hook) for module in model.embedding_layer.children()]
+    with torch.no_grad():
+        model.eval()
+        model(torch.rand(1, 3, 105, 105), torch.rand(1, 3, 105, 105))
+    for handle in handles:
+        handle.remove()
+    return total / 2 ** 20
+
+
+def measure(model: SiameseNetwork, accuracy: float) -> dict:
+    model = model.cpu()
+    return {
+        "channels": [getattr(model.embedding_layer, name).out_channels for name in CONV_LAYERS],
+        "accuracy": accuracy,
+        "parameter_mb": round(parameter_megabytes(model), 2),
+        "activation_mb": round(activation_megabytes(model), 2),
+        "login_latency_ms": round(login_latency_ms(model), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune the conv channels of the siamese model and fine-tune it.")
+    parser.add_argument("--model", default=MODEL_PATH, help="state dict of the trained model")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="folder to write the pruned models and the report to")
+    parser.add_argument("--ratios", type=float, nargs="+", default=ratios,
+                        help="fractions of the channels to remove, one pruned model per ratio")
+    parser.add_argument("--epochs", type=int, default=finetune_epochs, help="fine-tuning epochs after pruning")
+    parser.add_argument("--lr", type=float, default=lr)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    train_set, test_set = split_dataset(build_dataset(args.data), torch.Generator().manual_seed(args.seed))
+    train_dataloader = DataLoader(train_set, batch_size=batch_size, shuffle=True)
+    test_dataloader = DataLoader(test_set, batch_size=batch_size)
+    loss_fn = nn.CrossEntropyLoss()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    original = load_model(args.model).to(device)
+    print("Original model:")
+    report = [{"ratio": 0.0, **measure(original, test(test_dataloader, original, loss_fn))}]
+
+    for ratio in args.ratios:
+        print(f"Pruning {(100*ratio):>0.0f}% of the channels: -------------------------------")
+        pruned = prune(original.cpu(), ratio).to(device)
+        print("Before fine-tuning:")
+        pruned_accuracy = test(test_dataloader, pruned, loss_fn)
+
+        optimizer = torch.optim.Adam(pruned.parameters(), lr=args.lr)
+        accuracy = pruned_accuracy
+        for t in range(args.epochs):
+            print(f"Fine-tuning epoch {t+1}:")
+            train(train_dataloader, pruned, loss_fn, optimizer)
+            accuracy = test(test_dataloader, pruned, loss_fn)
+
+        # Same state dict format as the original model, the backend reads the architecture from the weight shapes
+        path = os.path.join(args.output_dir, f"pruned-{round(100 * ratio)}.pth")
+        torch.save(pruned.cpu().state_dict(), path)
+        report.append({"ratio": ratio, "path": path, "accuracy_before_finetuning": pruned_accuracy,
+                       **measure(pruned, accuracy)})
+
+    with open(os.path.join(args.output_dir, REPORT_FILE), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'ratio':>6} {'channels':>20} {'accuracy':>9} {'params':>10} {'activations':>12} {'latency':>10}")
+    for row in report:
+        print(f"{row['ratio']:>6.2f} {str(row['channels']):>20} {(100*row['accuracy']):>8.1f}% "
+              f"{row['parameter_mb']:>7.1f} MB {row['activation_mb']:>9.1f} MB {row['login_latency_ms']:>7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
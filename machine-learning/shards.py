@@ -0,0 +1,290 @@
+import hashlib
+import io
+import json
+import os
+import random
+import tarfile
+import zlib
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+
+INDEX_FILE = "index.json"
+IMAGE_SIZE = 105
+# images per shard, a person is never split between two shards
+SHARD_SIZE = 1000
+# one person in five is held out for testing
+TEST_FRACTION = 5
+
+
+##################################################################
+#####                        Shard Format                    #####
+##################################################################
+# A shard is an uncompressed tar file. Every image is stored as two members sharing a key:
+# ``<key>.png`` (the image, already resized to IMAGE_SIZE) and ``<key>.json`` ({"person", "role", "source"}).
+# The role is "anchor", "positive" or "failed" (a photo that failed face recognition against the anchors,
+# only used as a hard negative if asked for). All the anchors written for a person are in the same shard
+# as the other images they should be paired with, and ``index.json`` lists the shards with the number
+# of pairs they produce for each split.
+
+ROLES = ("anchor", "positive", "failed")
+
+
+def split_of(person: str) -> str:
+    """Assign a person to the train or test split, the same way on every machine."""
+    return "test" if zlib.crc32(person.encode()) % TEST_FRACTION == 0 else "train"
+
+
+def count_pairs(people: dict[str, list[int]]) -> int:
+    """Count the pairs ``PairStream`` produces from a shard.
+
+    Args:
+        people (dict[str, list[int]]): person -> number of images of each role for one split
+
+    Returns:
+        int: the number of pairs
+    """
+    positive_pairs = sum(min(anchors, positives) for anchors, positives, _ in people.values())
+    # negatives come from the positives of the other people of the shard
+    total_positives = sum(positives for _, positives, _ in people.values())
+    negative_pairs = sum(anchors for anchors, positives, _ in people.values() if total_positives > positives)
+    return positive_pairs + negative_pairs
+
+
+def count_failed_pairs(people: dict[str, list[int]]) -> int:
+    """Count the additional hard negative pairs ``PairStream`` produces from a shard with ``include_failed``."""
+    return sum(min(anchors, failed) for anchors, _, failed in people.values())
+
+
+def encode_image(image: Image.Image) -> tuple[bytes, str]:
+    """Resize an image to the shard format.
+
+    Args:
+        image (Image.Image): the decoded image
+
+    Returns:
+        tuple[bytes, str]: the png bytes and the sha256 of the resized pixels (to find duplicates)
+    """
+    image = image.convert("RGB").resize((IMAGE_SIZE, IMAGE_SIZE), Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue(), hashlib.sha256(image.tobytes()).hexdigest()
+
+
+class ShardWriter:
+    """Write people's images to numbered shards and keep track of the index.
+
+    With ``append``, the shards already in ``output_dir`` are kept and new shards are added after them.
+    """
+
+    def __init__(self, output_dir: str, shard_size: int = SHARD_SIZE, append: bool = False):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.shards = []
+        self._tar = None
+        self._key = 0
+        self._previous = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+        if append and os.path.exists(os.path.join(output_dir, INDEX_FILE)):
+            self._previous = read_index(output_dir)
+            self._key = self._previous["images"]
+
+    def write_person(self, person: str, images: list[tuple[str, str, bytes]]):
+        """Add images of a person.
+
+        Args:
+            person (str): the person's name
+            images (list[tuple[str, str, bytes]]): (role, source path, png bytes) for each image
+        """
+        if self._tar is None or self.shards[-1]["images"] >= self.shard_size:
+            self._next_shard()
+
+        shard = self.shards[-1]
+        counts = shard["_people"].setdefault(split_of(person), {}).setdefault(person, [0, 0, 0])
+        for role, source, png in images:
+            key = f"{self._key:09d}"
+            self._key += 1
+            self._add(f"{key}.png", png)
+            self._add(f"{key}.json", json.dumps({"person": person, "role": role, "source": source}).encode())
+            counts[ROLES.index(role)] += 1
+        shard["images"] += len(images)
+        shard["people"] += 1
+
+    def close(self, **stats) -> dict:
+        """Finish the last shard and write the index.
+
+        Args:
+            stats: additional values to record in the index
+
+        Returns:
+            dict: the index
+        """
+        if self._tar is not None:
+            self._tar.close()
+
+        for shard in self.shards:
+            people = shard.pop("_people")
+            shard["pairs"] = {split: count_pairs(people.get(split, {})) for split in ("train", "test")}
+            shard["failed_pairs"] = {split: count_failed_pairs(people.get(split, {})) for split in ("train", "test")}
+
+        shards = self._previous.get("shards", []) + self.shards
+        index = {
+            **self._previous,
+            "image_size": IMAGE_SIZE,
+            "images": sum(shard["images"] for shard in shards),
+            "people": sum(shard["people"] for shard in shards),
+            "shards": shards,
+            **stats,
+        }
+        with open(os.path.join(self.output_dir, INDEX_FILE), "w") as f:
+            json.dump(index, f, indent=2)
+        return index
+
+    def _next_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+        name = f"shard-{len(self._previous.get('shards', [])) + len(self.shards):06d}.tar"
+        self._tar = tarfile.open(os.path.join(self.output_dir, name), "w")
+        self.shards.append({"name": name, "images": 0, "people": 0, "_people": {}})
+
+    def _add(self, name: str, data: bytes):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self._tar.addfile(info, io.BytesIO(data))
+
+
+##################################################################
+#####                       Shard Reading                    #####
+##################################################################
+
+def read_index(shard_dir: str) -> dict:
+    with open(os.path.join(shard_dir, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def read_shard(path: str):
+    """Stream the images of a shard.
+
+    Yields:
+        tuple[dict, np.ndarray]: the metadata and the (H, W, 3) uint8 image
+    """
+    samples = {}
+    with tarfile.open(path, "r|") as tar:
+        for member in tar:
+            key, extension = member.name.split(".", 1)
+            data = tar.extractfile(member).read()
+            sample = samples.setdefault(key, {})
+            if extension == "json":
+                sample["meta"] = json.loads(data)
+            else:
+                sample["image"] = np.array(Image.open(io.BytesIO(data)).convert("RGB"))
+            if len(sample) == 2:
+                del samples[key]
+                yield sample["meta"], sample["image"]
+
+
+def to_tensor(image: np.ndarray) -> torch.Tensor:
+    """Same conversion as ``ToTensor``: (H, W, 3) uint8 -> (3, H, W) float in [0, 1]."""
+    return torch.from_numpy(image).permute(2, 0, 1).float().div_(255)
+
+
+class PairStream(IterableDataset):
+    """Stream (anchor, other, label) pairs from shards without loading the whole dataset.
+
+    Like ``model.build_dataset``, every anchor is paired with a positive of the same person
+    and with a positive of another person. Only one shard is held in memory at a time, and
+    pairs are mixed through a shuffle buffer.
+
+    With ``include_failed``, every anchor is also paired with a "failed" image of the same person
+    (an exported login photo that did not pass face recognition) as a hard negative.
+
+    The shards are split between the distributed ranks and the ``DataLoader`` workers
+    (``num_workers`` must match the ``DataLoader``). Every rank stops after the same number of
+    pairs so they all run the same number of steps.
+    """
+
+    def __init__(self, shard_dir: str, split: str = "train", seed: int = 0, shuffle_buffer: int = 1000,
+                 num_workers: int = 0, rank: int = 0, world_size: int = 1, include_failed: bool = False):
+        self.shard_dir = shard_dir
+        self.split = split
+        self.seed = seed
+        self.shuffle_buffer = shuffle_buffer
+        self.num_workers = max(1, num_workers)
+        self.rank = rank
+        self.world_size = world_size
+        self.include_failed = include_failed
+        self.epoch = 0
+        self.shards = read_index(shard_dir)["shards"]
+
+    def set_epoch(self, epoch: int):
+        """Reshuffle the shards and pairs differently for every epoch (same role as ``DistributedSampler``)."""
+        self.epoch = epoch
+
+    def _worker_shards(self, rank: int, worker_id: int) -> list[dict]:
+        return self.shards[rank::self.world_size][worker_id::self.num_workers]
+
+    def _shard_pairs(self, shard: dict) -> int:
+        pairs = shard["pairs"][self.split]
+        if self.include_failed:
+            pairs += shard.get("failed_pairs", {}).get(self.split, 0)
+        return pairs
+
+    def _worker_limit(self, worker_id: int) -> int:
+        # the rank with the fewest pairs sets the limit for every rank
+        return min(sum(self._shard_pairs(shard) for shard in self._worker_shards(rank, worker_id))
+                   for rank in range(self.world_size))
+
+    def __len__(self) -> int:
+        return sum(self._worker_limit(worker_id) for worker_id in range(self.num_workers))
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id = worker.id if worker else 0
+        rng = random.Random(f"{self.seed}-{self.epoch}-{worker_id}")
+
+        shards = self._worker_shards(self.rank, worker_id)
+        shards = rng.sample(shards, len(shards)) if self.split == "train" else shards
+
+        limit = self._worker_limit(worker_id)
+        for count, pair in enumerate(self._shuffled(self._pairs(shards, rng), rng)):
+            if count >= limit:
+                return
+            yield pair
+
+    def _pairs(self, shards: list[dict], rng: random.Random):
+        for shard in shards:
+            people = {}
+            for meta, image in read_shard(os.path.join(self.shard_dir, shard["name"])):
+                if split_of(meta["person"]) == self.split:
+                    people.setdefault(meta["person"], ([], [], []))[ROLES.index(meta["role"])].append(image)
+
+            for person, (anchors, positives, failed) in people.items():
+                others = [image for other, (_, other_positives, _) in people.items() if other != person
+                          for image in other_positives]
+                for anchor, positive in zip(anchors, positives):
+                    yield to_tensor(anchor), to_tensor(positive), torch.tensor(1.)
+                if others:
+                    for anchor in anchors:
+                        yield to_tensor(anchor), to_tensor(rng.choice(others)), torch.tensor(0.)
+                if self.include_failed:
+                    for anchor, photo in zip(anchors, failed):
+                        yield to_tensor(anchor), to_tensor(photo), torch.tensor(0.)
+
+    def _shuffled(self, pairs, rng: random.Random):
+        if self.split != "train":
+            yield from pairs
+            return
+
+        buffer = []
+        for pair in pairs:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(pair)
+                continue
+            index = rng.randrange(len(buffer))
+            yield buffer[index]
+            buffer[index] = pair
+        rng.shuffle(buffer)
+        yield from buffer
@@ -0,0 +1,172 @@
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import statistics
+import time
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, TensorDataset
+
+import model
+import pipeline
+
+CACHE_DIR = "cache"
+RESULTS_PATH = "sweep.csv"
+# trials need at least this many epochs and this many other trials to compare against before being stopped
+grace_epochs = 1
+min_reports = 3
+
+# set in every worker process by init_worker
+_cache_path = None
+_history = None
+_history_lock = None
+
+
+##################################################################
+#####                         Data Cache                     #####
+##################################################################
+
+def prepare_cache(data_path: str, seed: int, cache_dir: str = CACHE_DIR) -> str:
+    """Build the train/test pairs once and save them, so trials do not repeat the data organization.
+
+    Args:
+        data_path (str): folder containing the training images
+        seed (int): seed of the data organization and split
+        cache_dir (str): folder to save the cache in
+
+    Returns:
+        str: path to the cache (reused if the images, the seed and the data organization code are unchanged)
+    """
+    key = pipeline.hash_bytes(pipeline.hash_folder(data_path, cache_dir), str(seed),
+                              pipeline.hash_code(model.build_dataset, model.split_dataset))
+    path = os.path.join(cache_dir, f"pairs-{key[:16]}.pt")
+    if os.path.exists(path):
+        return path
+
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    train_set, test_set = model.split_dataset(model.build_dataset(data_path), torch.Generator().manual_seed(seed))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    torch.save({"train": train_set.tensors, "test": test_set.tensors}, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def load_cache(path: str) -> tuple[TensorDataset, TensorDataset]:
+    # memory-mapped, so the trials running at the same time share the same pages
+    cache = torch.load(path, mmap=True)
+    return TensorDataset(*cache["train"]), TensorDataset(*cache["test"])
+
+
+##################################################################
+#####                           Trials                       #####
+##################################################################
+
+def init_worker(threads: int, cache_path: str, history, history_lock):
+    """Set up a worker process of the pool.
+
+    Args:
+        threads (int): number of torch threads for each trial
+        cache_path (str): path to the data cache
+        history: shared dict of (epoch -> list of accuracies reported by all the trials)
+        history_lock: lock guarding ``history``
+    """
+    global _cache_path, _history, _history_lock
+    torch.set_num_threads(threads)
+    _cache_path = cache_path
+    _history = history
+    _history_lock = history_lock
+
+
+def should_stop(epoch: int, accuracy: float) -> bool:
+    """Median stopping rule: stop a trial doing worse than the median of the other trials at the same epoch."""
+    with _history_lock:
+        others = _history.get(epoch, [])
+        _history[epoch] = others + [accuracy]
+    return epoch >= grace_epochs and len(others) >= min_reports and accuracy < statistics.median(others)
+
+
+def run_trial(trial: dict) -> dict:
+    """Train one configuration and report its accuracy after every epoch.
+
+    Args:
+        trial (dict): {"lr", "batch_size", "epochs", "seed"}
+
+    Returns:
+        dict: the trial with its results
+    """
+    start = time.perf_counter()
+    train_set, test_set = load_cache(_cache_path)
+    torch.manual_seed(trial["seed"])
+
+    net = model.SiameseNetwork().to(model.device)
+    loss_fn = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(net.parameters(), lr=trial["lr"])
+    train_dataloader = DataLoader(train_set, batch_size=trial["batch_size"], shuffle=True)
+    test_dataloader = DataLoader(test_set, batch_size=trial["batch_size"])
+
+    accuracies = []
+    stopped = False
+    for t in range(trial["epochs"]):
+        model.train(train_dataloader, net, loss_fn, optimizer, augmentation=True)
+        accuracies.append(model.test(test_dataloader, net, loss_fn))
+        if t + 1 < trial["epochs"] and should_stop(t + 1, accuracies[-1]):
+            stopped = True
+            break
+
+    return {
+        **trial,
+        "epochs_run": len(accuracies),
+        "best_accuracy": max(accuracies),
+        "final_accuracy": accuracies[-1],
+        "stopped_early": stopped,
+        "seconds": round(time.perf_counter() - start, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a hyperparameter sweep of the siamese model.")
+    parser.add_argument("--data", default=model.DATA_PATH)
+    parser.add_argument("--lr", type=float, nargs="+", default=[model.lr])
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[model.batch_size])
+    parser.add_argument("--epochs", type=int, nargs="+", default=[model.epochs])
+    parser.add_argument("--seed", type=int, default=model.seed, help="seed of the data split, shared by all trials")
+    parser.add_argument("--parallel", type=int, default=2, help="number of trials running at the same time")
+    parser.add_argument("--output", default=RESULTS_PATH, help="CSV file to write the results to")
+    args = parser.parse_args()
+
+    trials = [{"lr": lr, "batch_size": batch, "epochs": epochs, "seed": args.seed}
+              for lr, batch, epochs in itertools.product(args.lr, args.batch_size, args.epochs)]
+
+    cache_path = prepare_cache(args.data, args.seed)
+
+    # split the cores between the trials so they do not oversubscribe the machine
+    threads = max(1, (os.cpu_count() or 1) // args.parallel)
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        history = manager.dict()
+        initargs = (threads, cache_path, history, manager.Lock())
+        with context.Pool(args.parallel, initializer=init_worker, initargs=initargs) as pool:
+            results = []
+            for result in pool.imap_unordered(run_trial, trials):
+                results.append(result)
+                print(f"lr={result['lr']} batch_size={result['batch_size']}: "
+                      f"{(100*result['best_accuracy']):>0.1f}% after {result['epochs_run']} epochs"
+                      f"{' (stopped early)' if result['stopped_early'] else ''}")
+
+    results.sort(key=lambda result: result["best_accuracy"], reverse=True)
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"Best: lr={results[0]['lr']} batch_size={results[0]['batch_size']} epochs={results[0]['epochs']} "
+          f"({(100*results[0]['best_accuracy']):>0.1f}%), results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import math
+
+import pytest
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+import ingest
+import model
+import shards
+
+BATCH_SIZE = 3
+WORKERS = 2
+
+
+class TinyModel(nn.Module):
+    """A small model with the signature of ``SiameseNetwork``, so the test runs quickly."""
+
+    def __init__(self):
+        super().__init__()
+        self.linear = nn.Linear(3, 2)
+
+    def forward(self, anchor, other):
+        return self.linear((anchor - other).abs().mean((2, 3)))
+
+
+class RecordingOptimizer(torch.optim.SGD):
+    """SGD that records the gradients of every step, without changing the weights (so the gradients of every step
+    can be compared with the gradients of the batches from the initial weights)."""
+
+    def __init__(self, params):
+        super().__init__(params, lr=0)
+        self.steps = []
+
+    def step(self, closure=None):
+        self.steps.append([parameter.grad.clone() for group in self.param_groups for parameter in group["params"]])
+        return super().step(closure)
+
+
+@pytest.fixture(scope="module")
+def shard_dir(tmp_path_factory):
+    """Shards of the training images, small enough to give each DataLoader worker several shards"""
+    output = tmp_path_factory.mktemp("shards")
+    ingest.ingest(model.DATA_PATH, str(output), shard_size=10, workers=1)
+    return str(output)
+
+
+@pytest.mark.parametrize("accumulation_steps", [1, 2, 4])
+def test_train_accumulation_with_shards(shard_dir, accumulation_steps):
+    """
+    Tests that every streamed batch is trained on and each step averages the gradients of its group of batches
+    """
+    stream = shards.PairStream(shard_dir, "train", num_workers=WORKERS)
+    dataloader = DataLoader(stream, batch_size=BATCH_SIZE, num_workers=WORKERS)
+    loss_fn = nn.CrossEntropyLoss()
+
+    # The gradient of every batch, from the same weights
+    torch.manual_seed(0)
+    network = TinyModel()
+    batch_gradients = []
+    for X, Y, z in dataloader:
+        network.zero_grad()
+        loss_fn(network(X, Y), z.type(torch.LongTensor)).backward()
+        batch_gradients.append([parameter.grad.clone() for parameter in network.parameters()])
+    # Every worker batches its own pairs, so there are more batches than len(dataloader)
+    assert len(batch_gradients) > len(dataloader)
+
+    torch.manual_seed(0)
+    network = TinyModel()
+    optimizer = RecordingOptimizer(network.parameters())
+    model.train(dataloader, network, loss_fn, optimizer, accumulation_steps=accumulation_steps)
+
+    assert len(optimizer.steps) == math.ceil(len(batch_gradients) / accumulation_steps)
+    for step, gradients in enumerate(optimizer.steps):
+        group = batch_gradients[step * accumulation_steps:(step + 1) * accumulation_steps]
+        for index, gradient in enumerate(gradients):
+            expected = torch.stack([batch[index] for batch in group]).mean(0)
+            torch.testing.assert_close(gradient, expected)
+    # No gradient is left accumulated after the last step
+    assert all(parameter.grad is None or not parameter.grad.any() for parameter in network.parameters())